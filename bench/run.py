@@ -0,0 +1,248 @@
+# Offline benchmark of the pipeline stages on synthetic wells (see synth.py). From the repo root:
+#   python -m bench.run --save-baseline bench/baseline.json      # record a baseline
+#   python -m bench.run --baseline bench/baseline.json           # exits 1 on a regression
+# Each stage runs --repeat times and keeps its best run, which is far less noisy than one run.
+# Everything it writes goes to a temp work dir; only the results JSON is left there
+import argparse
+import http.client
+import json
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data import DataLoader
+from src.database import Database
+from src.events_generator import EventsGenerator
+from src.server import QueryHandler, QueryServer
+
+from .synth import generate
+
+# metric -> which way is better, for the baseline comparison
+METRICS = {
+    "load.seconds": "lower",
+    "load.rows_per_second": "higher",
+    "generate.seconds": "lower",
+    "generate.cycles_per_second": "higher",
+    "insert.single_per_second": "higher",
+    "insert.batch_per_second": "higher",
+    "query.p50_ms": "lower",
+    "query.p95_ms": "lower",
+    "query.requests_per_second": "higher",
+}
+
+
+def bench_load(data_dir, config_file):
+    loader = DataLoader(data_dir, config_file=config_file)
+    started = time.perf_counter()
+    df = loader.load(force_reload=True)
+    seconds = time.perf_counter() - started
+    return loader, {"seconds": seconds, "rows": len(df), "rows_per_second": len(df) / seconds}
+
+
+def bench_generate(loader, db_name):
+    # Replays the stored history, so the generator sees every cycle the load produced
+    database = Database(db_name)
+    started = time.perf_counter()
+    EventsGenerator(loader, database, start=0, end=2 ** 62).generate_events()
+    seconds = time.perf_counter() - started
+    cycles = database.connection.execute("SELECT COUNT(*) FROM EVENTS").fetchone()[0]
+    database.close()
+    return database.path, {"seconds": seconds, "cycles": cycles, "cycles_per_second": cycles / seconds}
+
+
+def bench_insert(db_name, single=2000, batched=50000):
+    # insertEvent throughput, committing every event and inside one batch() transaction
+    database = Database(db_name)
+    event = {"name": "CYCLE_DURATION_EVENTS", "start_time": 0, "end_time": 600,
+             "total_duration": 600, "flow_duration": 300, "shutin_duration": 300}
+    started = time.perf_counter()
+    for _ in range(single):
+        database.insertEvent(event)
+    single_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    with database.batch():
+        for _ in range(batched):
+            database.insertEvent(event)
+    batch_seconds = time.perf_counter() - started
+    database.close()
+    return {"single_per_second": single / single_seconds, "batch_per_second": batched / batch_seconds}
+
+
+class QuietHandler(QueryHandler):
+    # no log line per request while timing them
+    def log_message(self, *args):
+        pass
+
+
+def bench_query(db_path, clients=8, requests=200, cache=False):
+    # /query and /rollups latency with `clients` concurrent keep-alive connections. The result
+    # cache is off unless asked for, so every request runs its query
+    start_time = _first_cycle_start(db_path)
+    requests_mix = [
+        ("POST", "/", "SELECT COUNT(*) AS n FROM EVENTS"),
+        ("POST", "/", f"SELECT * FROM CYCLE_SUMMARY WHERE start_time >= {start_time} "
+                      f"AND start_time < {start_time + 86400} AND (low_flow OR non_arrival)"),
+        ("POST", "/", "SELECT e.cycle_id, d.total_duration, g.gas_volume FROM EVENTS e "
+                      "JOIN CYCLE_DURATION_EVENTS d ON d._id = e.cycle_duration_event "
+                      "LEFT JOIN GAS_VOLUME_PRODUCED_EVENTS g ON g._id = e.gas_volume_produced_event "
+                      "WHERE e.well_id = 1 ORDER BY e.cycle_id DESC LIMIT 200"),
+        ("GET", "/rollups/daily", None),
+        ("GET", "/rollups/hourly?well_id=1", None),
+    ]
+    server = QueryServer(("127.0.0.1", 0), db_path, cache_bytes=64 * 1024 * 1024 if cache else 0,
+                         handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def client(index):
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=30)
+        own = []
+        for i in range(requests):
+            method, path, body = requests_mix[(index + i) % len(requests_mix)]
+            started = time.perf_counter()
+            connection.request(method, path, body=body)
+            response = connection.getresponse()
+            response.read()
+            own.append(time.perf_counter() - started)
+            if response.status != 200:
+                failures.append((path, response.status))
+        connection.close()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    server.shutdown()
+    server.server_close()
+    if failures:
+        raise RuntimeError(f"{len(failures)} requests failed, e.g. {failures[0]}")
+    latencies = np.array(latencies) * 1000
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "requests_per_second": len(latencies) / seconds,
+    }
+
+
+def _first_cycle_start(db_path):
+    connection = sqlite3.connect(db_path)
+    first = connection.execute("SELECT MIN(start_time) FROM CYCLE_SUMMARY").fetchone()[0]
+    connection.close()
+    return first or 0
+
+
+def compare(results, baseline, tolerance):
+    # (metric, baseline value, current value, relative change, regressed?) for every metric
+    # both runs have; regressed means worse than the baseline by more than `tolerance`
+    rows = []
+    for metric, better in METRICS.items():
+        stage, name = metric.split(".")
+        old = baseline.get("stages", {}).get(stage, {}).get(name)
+        new = results["stages"].get(stage, {}).get(name)
+        if old is None or new is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = change > tolerance if better == "lower" else change < -tolerance
+        rows.append((metric, old, new, change, worse))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic wells, offline")
+    parser.add_argument("--wells", type=int, default=2)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--step", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent /query clients")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--cache", action="store_true", help="leave the server's result cache on")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one is kept")
+    parser.add_argument("--stages", default="load,generate,insert,query")
+    parser.add_argument("--out", help="where to write this run's results (default: results.json in the work dir)")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write this run's results here")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+    stages = args.stages.split(",")
+    if args.baseline and not Path(args.baseline).is_file():
+        print(f"No baseline at {args.baseline}, record one first with --save-baseline {args.baseline}")
+        return 2
+
+    results = {
+        "params": {"wells": args.wells, "days": args.days, "step": args.step, "seed": args.seed,
+                   "clients": args.clients, "requests": args.requests, "cache": args.cache, "repeat": args.repeat},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+                        "machine": platform.machine(), "system": platform.system()},
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stages": {},
+    }
+    work = Path(tempfile.mkdtemp(prefix="plunger-bench-"))
+    db_name = str(work / "db" / "bench")
+    (work / "db").mkdir()
+    db_path = None
+    try:
+        print(f"Generating {args.wells} wells x {args.days} days (seed {args.seed}) in {work}")
+        generate(work, args.wells, args.days, args.step, args.seed)
+        config_file = work / "config" / "wells-config.json"
+        runs = [bench_load(work / "data", config_file) for _ in range(args.repeat)]
+        loader, results["stages"]["load"] = min(runs, key=lambda run: run[1]["seconds"])
+        print(f"load: {results['stages']['load']}")
+        if "generate" in stages or "query" in stages:
+            runs = [bench_generate(loader, f"{db_name}-{i}") for i in range(args.repeat)]
+            db_path, results["stages"]["generate"] = min(runs, key=lambda run: run[1]["seconds"])
+            print(f"generate: {results['stages']['generate']}")
+        if "insert" in stages:
+            runs = [bench_insert(f"{db_name}-insert-{i}") for i in range(args.repeat)]
+            results["stages"]["insert"] = {
+                name: max(run[name] for run in runs) for name in ("single_per_second", "batch_per_second")
+            }
+            print(f"insert: {results['stages']['insert']}")
+        if "query" in stages:
+            runs = [bench_query(db_path, args.clients, args.requests, args.cache) for _ in range(args.repeat)]
+            results["stages"]["query"] = max(runs, key=lambda run: run["requests_per_second"])
+            print(f"query: {results['stages']['query']}")
+        for stage in ("load", "generate"):
+            if stage not in stages:
+                results["stages"].pop(stage, None)
+    finally:
+        for generated in ("data", "config", "db"):
+            shutil.rmtree(work / generated, ignore_errors=True)
+
+    for path in filter(None, (args.out or work / "results.json", args.save_baseline)):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(results, f, indent=3)
+        print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != results["params"]:
+            print(f"Warning: baseline ran with {baseline.get('params')}, this run with {results['params']}")
+        regressed = False
+        for metric, old, new, change, worse in compare(results, baseline, args.tolerance):
+            regressed |= worse
+            print(f"{'REGRESSED' if worse else 'ok':>9}  {metric:<28} {old:>12.2f} -> {new:>12.2f}  ({change:+.1%})")
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Same PIDs, names and files as a real well: fetch_data saves "<data>/<well name>/<pid name>.csv"
+PIDS = [
+    "Tubing Pressure (PSI)",
+    "Casing Pressure (PSI)",
+    "Down Hole Pressure (PSI)",
+    "Sales Meter Flow Rate (MCF_Day)",
+    "Arrival Speed",
+    "Line Pressure (PSIA)",
+    "Current Non-Arrival Count",
+    "Arrival Time Remaining",
+]
+START = 1754006400  # 2025-08-01T00:00:00Z
+
+
+def generate(out_dir, wells=2, days=3, step=1, seed=0, flow_minutes=(20, 60), shutin_minutes=(15, 45),
+             non_arrival_rate=0.1, drop_rate=0.02, start=START):
+    # Writes <out_dir>/data/<well>/<pid>.csv for every well and <out_dir>/config/wells-config.json,
+    # laid out like fetch_data leaves them. Wells alternate shut-in and flow periods with lengths
+    # drawn from shutin_minutes / flow_minutes; pressures build while shut in and bleed off
+    # while flowing. Each PID drops drop_rate of its samples, like gaps in the OnPing history.
+    # The same seed always gives the same files. Returns the config
+    out_dir = Path(out_dir)
+    rng = np.random.default_rng(seed)
+    config = {
+        "username": "",
+        "password": "",
+        "lastFetchTime": pd.Timestamp(start + days * 86400, unit="s", tz="UTC").isoformat(),
+        "step_seconds": step,
+        "wells": [],
+    }
+    for w in range(wells):
+        name = f"Synthetic {w + 1}H"
+        well_dir = out_dir / "data" / name
+        well_dir.mkdir(parents=True, exist_ok=True)
+        times = np.arange(start, start + days * 86400, step, dtype=np.int64)
+        for pid_name, values in _well_series(times, rng, flow_minutes, shutin_minutes, non_arrival_rate).items():
+            kept = rng.random(len(times)) >= drop_rate
+            _write_csv(well_dir / f"{pid_name}.csv", times[kept], values[kept])
+        config["wells"].append({
+            "name": name,
+            "id": w + 1,
+            "arrival_time_remaining_threshold": 30,
+            "pids": [{"name": pid, "pid": 900000 + 100 * w + i, "op_name": ""} for i, pid in enumerate(PIDS)],
+        })
+    (out_dir / "config").mkdir(parents=True, exist_ok=True)
+    with open(out_dir / "config" / "wells-config.json", "w") as f:
+        json.dump(config, f, indent=3)
+    return config
+
+
+def _well_series(times, rng, flow_minutes, shutin_minutes, non_arrival_rate):
+    # {pid name: value per time} for one well
+    n = len(times)
+    span = int(times[-1] - times[0]) + 1
+    # cycle boundaries: shut-in, then flow, repeated until the end
+    lengths = []
+    total = 0
+    while total < span:
+        shutin = int(rng.uniform(*shutin_minutes) * 60)
+        flow = int(rng.uniform(*flow_minutes) * 60)
+        lengths.append((shutin, flow))
+        total += shutin + flow
+    lengths = np.array(lengths, dtype=np.int64)
+    cycle_starts = np.r_[0, np.cumsum(lengths.sum(axis=1))[:-1]]
+    offset = times - times[0]
+    cycle = np.searchsorted(cycle_starts, offset, side="right") - 1
+    into = offset - cycle_starts[cycle]               # seconds into the cycle
+    shutin = lengths[cycle, 0]
+    flowing = into >= shutin
+    flow_for = np.where(flowing, into - shutin, 0)    # seconds since the well opened
+
+    cycles = len(lengths)
+    peak = rng.uniform(150, 300, cycles)
+    speed = rng.uniform(0.8, 3.5, cycles)
+    non_arrival = rng.random(cycles) < non_arrival_rate
+    arrival_window = rng.uniform(300, 900, cycles)
+    # the controller's countdown stops when the plunger arrives, and runs out when it does not
+    arrives_after = np.where(non_arrival, np.inf, arrival_window * rng.uniform(0.5, 0.99, cycles))
+    line = rng.uniform(70, 90)
+
+    # casing builds towards its shut-in pressure and bleeds off once the well flows
+    build = 1 - np.exp(-np.where(flowing, shutin, into) / 900.0)
+    casing = 150 + 120 * build * np.where(flowing, np.exp(-flow_for / 1200.0), 1.0)
+    tubing = np.where(flowing, line + 20 + (casing - line - 20) * np.exp(-flow_for / 300.0), casing - 15)
+    flow_rate = np.where(flowing, 40 + (peak[cycle] - 40) * np.exp(-flow_for / 900.0), 0.0)
+    # a shut-in meter reads 0 apart from the odd slightly negative reading
+    noise = np.where(rng.random(n) < 0.01, -np.round(np.abs(rng.normal(0, 0.02, n)), 2), 0.0) + 0.0
+    flow_rate = np.where(flowing, flow_rate + rng.normal(0, 3, n), noise)
+    return {
+        "Tubing Pressure (PSI)": tubing + rng.normal(0, 1.0, n),
+        "Casing Pressure (PSI)": casing + rng.normal(0, 1.0, n),
+        "Down Hole Pressure (PSI)": casing + 200 + rng.normal(0, 2.0, n),
+        "Sales Meter Flow Rate (MCF_Day)": flow_rate,
+        "Arrival Speed": np.where(non_arrival[cycle], 0.0, speed[cycle]),
+        "Line Pressure (PSIA)": line + rng.normal(0, 0.5, n),
+        "Current Non-Arrival Count": (non_arrival[cycle] & flowing).astype(np.float64),
+        "Arrival Time Remaining": np.where(
+            flowing, np.maximum(arrival_window[cycle] - np.minimum(flow_for, arrives_after[cycle]), 0), arrival_window[cycle]),
+    }
+
+
+def _write_csv(path, times, values):
+    # "timestamp,val" rows with the ISO UTC times OnPing returns, as save_to_csv writes them
+    iso = np.char.add(np.datetime_as_string(times.astype("datetime64[s]"), unit="s"), "Z")
+    pd.DataFrame({"timestamp": iso, "val": np.round(values, 3)}).to_csv(path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic plunger-lift PID csvs and their wells config")
+    parser.add_argument("out_dir")
+    parser.add_argument("--wells", type=int, default=2)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--step", type=int, default=1, help="seconds between samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flow-minutes", type=float, nargs=2, default=(20, 60))
+    parser.add_argument("--shutin-minutes", type=float, nargs=2, default=(15, 45))
+    args = parser.parse_args()
+    generate(args.out_dir, args.wells, args.days, args.step, args.seed, tuple(args.flow_minutes), tuple(args.shutin_minutes))
+    print(f"Wrote {args.wells} wells x {args.days} days to {args.out_dir}")
@@ -0,0 +1,28 @@
+-- Run after schema.sql and the ADDED_COLUMNS migrations, so every column indexed here exists
+
+CREATE INDEX IF NOT EXISTS EVENTS_cycle_id ON EVENTS (cycle_id);
+CREATE INDEX IF NOT EXISTS EVENTS_well_id ON EVENTS (well_id, cycle_id);
+CREATE INDEX IF NOT EXISTS EVENTS_basic_pressure_event ON EVENTS (basic_pressure_event);
+CREATE INDEX IF NOT EXISTS EVENTS_cycle_duration_event ON EVENTS (cycle_duration_event);
+CREATE INDEX IF NOT EXISTS EVENTS_plunger_arrival_velocity_event ON EVENTS (plunger_arrival_velocity_event);
+CREATE INDEX IF NOT EXISTS EVENTS_gas_volume_produced_event ON EVENTS (gas_volume_produced_event);
+CREATE INDEX IF NOT EXISTS EVENTS_unexpected_low_casing_pressure ON EVENTS (unexpected_low_casing_pressure);
+CREATE INDEX IF NOT EXISTS EVENTS_plunger_arrival_status_event ON EVENTS (plunger_arrival_status_event);
+CREATE INDEX IF NOT EXISTS EVENTS_plunger_unsafe_velocity_event ON EVENTS (plunger_unsafe_velocity_event);
+CREATE INDEX IF NOT EXISTS EVENTS_unexpected_low_flow ON EVENTS (unexpected_low_flow);
+CREATE INDEX IF NOT EXISTS EVENTS_unexpected_low_cycle_duration ON EVENTS (unexpected_low_cycle_duration);
+CREATE INDEX IF NOT EXISTS EVENTS_unexpected_high_cycle_duration ON EVENTS (unexpected_high_cycle_duration);
+
+CREATE INDEX IF NOT EXISTS CYCLE_DURATION_EVENTS_start_time ON CYCLE_DURATION_EVENTS (start_time);
+CREATE INDEX IF NOT EXISTS GAS_VOLUME_PRODUCED_EVENTS_cycle_duration_event ON GAS_VOLUME_PRODUCED_EVENTS (cycle_duration_event);
+CREATE INDEX IF NOT EXISTS UNEXPECTED_LOW_CASING_PRESSURE_EVENTS_basic_pressure_event ON UNEXPECTED_LOW_CASING_PRESSURE_EVENTS (basic_pressure_event);
+CREATE INDEX IF NOT EXISTS PLUNGER_ARRIVAL_STATUS_EVENTS_unexpected_low_casing_pressure ON PLUNGER_ARRIVAL_STATUS_EVENTS (unexpected_low_casing_pressure);
+CREATE INDEX IF NOT EXISTS PLUNGER_UNSAFE_VELOCITY_EVENTS_velocity_event ON PLUNGER_UNSAFE_VELOCITY_EVENTS (velocity_event);
+CREATE INDEX IF NOT EXISTS UNEXPECTED_LOW_FLOW_EVENTS_gas_volume_produced_event ON UNEXPECTED_LOW_FLOW_EVENTS (gas_volume_produced_event);
+CREATE INDEX IF NOT EXISTS UNEXPECTED_LOW_CYCLE_DURATION_EVENTS_cycle_duration_event ON UNEXPECTED_LOW_CYCLE_DURATION_EVENTS (cycle_duration_event);
+CREATE INDEX IF NOT EXISTS UNEXPECTED_HIGH_CYCLE_DURATION_EVENTS_cycle_duration_event ON UNEXPECTED_HIGH_CYCLE_DURATION_EVENTS (cycle_duration_event);
+
+-- time range scans, overall and per well
+CREATE INDEX IF NOT EXISTS CYCLE_SUMMARY_start_time ON CYCLE_SUMMARY (start_time);
+CREATE INDEX IF NOT EXISTS CYCLE_SUMMARY_well_id ON CYCLE_SUMMARY (well_id, start_time);
+CREATE INDEX IF NOT EXISTS CYCLE_SUMMARY_event_id ON CYCLE_SUMMARY (event_id);
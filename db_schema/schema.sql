@@ -1,6 +1,7 @@
 CREATE TABLE IF NOT EXISTS EVENTS (
     _id INTEGER  NOT NULL PRIMARY KEY,
     cycle_id INTEGER NOT NULL,
+    well_id INTEGER,
     basic_pressure_event INTEGER,
     cycle_duration_event INTEGER,
     plunger_arrival_velocity_event INTEGER,
@@ -65,6 +66,7 @@ CREATE TABLE IF NOT EXISTS UNEXPECTED_LOW_CASING_PRESSURE_EVENTS (
 CREATE TABLE IF NOT EXISTS PLUNGER_ARRIVAL_STATUS_EVENTS (
     _id INTEGER  NOT NULL PRIMARY KEY,
     non_arrival BOOLEAN NOT NULL,
+    late_arrival BOOLEAN NOT NULL DEFAULT 0,
     unexpected_casing_pressure BOOLEAN NOT NULL,
     unexpected_low_casing_pressure INTEGER,
     FOREIGN KEY (unexpected_low_casing_pressure) REFERENCES UNEXPECTED_LOW_CASING_PRESSURE_EVENTS(_id)
@@ -92,4 +94,76 @@ CREATE TABLE IF NOT EXISTS UNEXPECTED_HIGH_CYCLE_DURATION_EVENTS (
     _id INTEGER  NOT NULL PRIMARY KEY,
     cycle_duration_event INTEGER NOT NULL,
     FOREIGN KEY (cycle_duration_event) REFERENCES CYCLE_DURATION_EVENTS(_id)
-);
\ No newline at end of file
+);
+
+-- One row per cycle with what the events above say about it as plain columns, written in
+-- the same transaction as its EVENTS row. Anomaly flags are NULL when their rule did not run
+CREATE TABLE IF NOT EXISTS CYCLE_SUMMARY (
+    _id INTEGER  NOT NULL PRIMARY KEY,
+    cycle_id INTEGER NOT NULL UNIQUE,
+    event_id INTEGER NOT NULL,
+    well_id INTEGER NOT NULL,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP NOT NULL,
+    total_duration INTEGER NOT NULL,
+    flow_duration INTEGER NOT NULL,
+    shutin_duration INTEGER NOT NULL,
+    pt_first FLOAT,
+    pt_last FLOAT,
+    cp_first FLOAT,
+    cp_last FLOAT,
+    pl_first FLOAT,
+    pl_last FLOAT,
+    delta_pt FLOAT,
+    delta_cp FLOAT,
+    delta_pl FLOAT,
+    gas_volume FLOAT,
+    arrival_speed FLOAT,
+    non_arrival BOOLEAN NOT NULL,
+    late_arrival BOOLEAN,
+    low_casing_pressure BOOLEAN,
+    unsafe_velocity BOOLEAN,
+    low_flow BOOLEAN,
+    low_cycle_duration BOOLEAN,
+    high_cycle_duration BOOLEAN,
+    FOREIGN KEY (event_id) REFERENCES EVENTS(_id)
+);
+
+-- Per-well totals of the cycles starting in each UTC hour / day (bucket_start is the bucket's
+-- first second, epoch seconds), recomputed from CYCLE_SUMMARY for the buckets each run adds
+-- cycles to. The anomaly columns count the cycles that had the anomaly
+CREATE TABLE IF NOT EXISTS CYCLE_ROLLUP_HOURLY (
+    well_id INTEGER NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    cycles INTEGER NOT NULL,
+    gas_volume FLOAT NOT NULL,
+    mean_arrival_speed FLOAT,
+    flow_duration INTEGER NOT NULL,
+    shutin_duration INTEGER NOT NULL,
+    non_arrivals INTEGER NOT NULL,
+    late_arrivals INTEGER,
+    low_casing_pressure INTEGER,
+    unsafe_velocity INTEGER,
+    low_flow INTEGER,
+    low_cycle_duration INTEGER,
+    high_cycle_duration INTEGER,
+    PRIMARY KEY (well_id, bucket_start)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS CYCLE_ROLLUP_DAILY (
+    well_id INTEGER NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    cycles INTEGER NOT NULL,
+    gas_volume FLOAT NOT NULL,
+    mean_arrival_speed FLOAT,
+    flow_duration INTEGER NOT NULL,
+    shutin_duration INTEGER NOT NULL,
+    non_arrivals INTEGER NOT NULL,
+    late_arrivals INTEGER,
+    low_casing_pressure INTEGER,
+    unsafe_velocity INTEGER,
+    low_flow INTEGER,
+    low_cycle_duration INTEGER,
+    high_cycle_duration INTEGER,
+    PRIMARY KEY (well_id, bucket_start)
+) WITHOUT ROWID;
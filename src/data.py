@@ -1,121 +1,371 @@
-import csv
+import json
+import numpy as np
 import pandas as pd
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-import datetime
+
+from .metadata import WELLS_CONFIG_FILE
+from .metrics import ROWS_PARSED, STAGE_SECONDS
+from .samples import SAMPLES_SUFFIX, read_samples
+from .store import ColumnStore
+
+# a PID sample is attached to a flow-rate row if it lies within +/- this many seconds
+JOIN_TOLERANCE_SECONDS = 60
+FLOW_RATE_FILE = "Sales Meter Flow Rate (MCF_Day).csv"
+# a PID lagging the flow rate by more than this is treated as missing data instead of late data
+MAX_PID_LAG_SECONDS = 3600
 
 class DataLoader:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, config_file=WELLS_CONFIG_FILE, max_workers=None,
+                 flow_threshold=0.0, min_shutin_seconds=0):
         self.data_dir = data_dir
-        self.df = None  # DataFrame to hold the loaded data
-        if (self.data_dir / "processed_data.pkl").exists():
-            self.df = pd.read_pickle(self.data_dir / "processed_data.pkl")
-            return
-        self.__files = {}
+        self.config_file = config_file
+        self.max_workers = max_workers
+        # cycle definition, a well can override it with "cycle_flow_threshold" and
+        # "cycle_min_shutin_seconds" in the wells config
+        self.flow_threshold = flow_threshold
+        self.min_shutin_seconds = min_shutin_seconds
+        self.df = None  # rows (re)processed by the last load()
+        self.store = ColumnStore(self.data_dir / "processed")
+        self.watermarks_path = self.data_dir / "watermarks.json"
 
     def load(self, force_reload=False):
-        # if self.df is not None and not force_reload:
-        #     return self.df  # Return the existing DataFrame if it has already been loaded
-        
-        # Initialize the files dictionary to store parsed CSV data
-        self.__files = {}
-        _data_dir = Path(self.data_dir / "La Vista 1H") 
-        for file_name in os.listdir(_data_dir):
-            print(file_name)
-            content = self.__parse_csv(
-                _data_dir / file_name
-            )
-            self.__files[file_name] = content
-        self.__cleanup()
-        self.__files['Sales Meter Flow Rate (MCF_Day).csv'] = self.__flow_rate_cycles()
-        self.df = pd.DataFrame(self.__files['Sales Meter Flow Rate (MCF_Day).csv'], columns=['cycle_id', 'isotime', 'flow_rate'])
-        self.__data_entries_manager()
-
-        output_path = self.data_dir / "processed_data.pkl"
-        self.df.to_pickle(output_path)
-        
+        # Incremental load: only samples newer than the per well/PID watermarks are processed.
+        # The trailing cycle of every well may still have been in progress last time, so it is
+        # re-opened and processed again together with the new data (as is any cycle whose rows
+        # could still be matched by PID samples that had not arrived yet).
+        # Returns the rows that were (re)processed; get_data() reads the stored history.
+        started = time.perf_counter()
+        watermarks = {} if force_reload else self.__read_watermarks()
+
+        wells = self.__wells()
+        jobs = []
+        for well_id, name, cycle_definition in wells:
+            well_watermarks = watermarks.get(str(well_id), {})
+            tail = None if force_reload else self.store.tail(well_id, _settled_until(well_watermarks))
+            jobs.append((Path(self.data_dir / name), well_watermarks, tail, cycle_definition))
+
+        workers = min(len(jobs), self.max_workers or os.cpu_count() or 1)
+        if workers > 1:
+            # one process per well, results come back in config order whatever the worker count
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_load_well, jobs))
+        else:
+            results = [_load_well(job) for job in jobs]
+
+        updated = []
+        for (well_id, name, _), (frame, well_watermarks, stats) in zip(wells, results):
+            # the workers' own metrics die with them, so their stats are recorded here
+            STAGE_SECONDS.observe(stats["parse_seconds"], stage="parse")
+            STAGE_SECONDS.observe(stats["join_seconds"], stage="join")
+            ROWS_PARSED.inc(stats["rows_parsed"], well=name)
+            self.store.write(well_id, frame)
+            watermarks[str(well_id)] = well_watermarks
+            if not frame.empty:
+                frame.insert(0, 'well_id', well_id)
+                updated.append(frame)
+        self.__write_watermarks(watermarks)
+
+        self.df = pd.concat(updated, ignore_index=True) if updated else pd.DataFrame(
+            columns=['well_id', 'cycle_id', 'isotime', 'flow_rate'])
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="load")
         return self.df
-    
-    def get_data(self):
-        if not hasattr(self, 'df'):
+
+    def get_data(self, start=None, end=None, well_ids=None):
+        # Stored history, optionally restricted to start <= isotime <= end and to some wells.
+        # Partitions are memory-mapped, only the requested range is read
+        if not self.store.wells():
             raise ValueError("Data has not been loaded yet. Call load() first.")
+        return self.store.read(well_ids, start, end)
+
+    def unreported(self, reported_until):
+        # Stored rows of the closed cycles that have no events yet. reported_until maps a well
+        # to the end time of its last reported cycle; the well's rows after it are returned, up
+        # to its first cycle that is still running or may still receive PID samples. Worked out
+        # from the store and the watermarks on disk only, so the cycles of a run whose events
+        # failed to commit are picked up again by the next one
+        watermarks = self.__read_watermarks()
+        frames = []
+        for well_id in self.store.wells():
+            settled = _settled_until(watermarks.get(str(well_id), {}))
+            after = reported_until.get(well_id)
+            rows = self.store.read([well_id], None if after is None else after + 1)
+            if settled is None or rows.empty:
+                continue
+            times = rows['isotime'].to_numpy(dtype=np.int64)
+            cycle_ids = rows['cycle_id'].to_numpy(dtype=np.int64)
+            # the last cycle is still running, earlier ones may still be waiting for PID samples
+            first_unsettled = min(np.searchsorted(times, settled, side="right"), len(times) - 1)
+            frames.append(rows[cycle_ids < cycle_ids[first_unsettled]])
+        if not frames:
+            return pd.DataFrame(columns=['well_id', 'cycle_id', 'isotime', 'flow_rate'])
+        return pd.concat(frames, ignore_index=True)
+
+    def cycle_definitions(self):
+        # {well_id: keyword arguments for find_cycle_onsets} of the wells load() reads
+        return {well_id: cycle_definition for well_id, _, cycle_definition in self.__wells()}
+
+    def __wells(self):
+        # (well_id, well_name, cycle_definition) for every configured well that has a data folder
+        with open(self.config_file, "r") as f:
+            config = json.load(f)
+        wells = []
+        for well in config.get("wells", []):
+            if not (self.data_dir / well["name"]).is_dir():
+                print(f"No data folder for well {well['name']}, skipping")
+                continue
+            cycle_definition = {
+                "flow_threshold": well.get("cycle_flow_threshold", self.flow_threshold),
+                "min_shutin_seconds": well.get("cycle_min_shutin_seconds", self.min_shutin_seconds),
+            }
+            wells.append((well["id"], well["name"], cycle_definition))
+        return wells
+
+    def __read_watermarks(self):
+        if not self.watermarks_path.exists():
+            return {}
+        with open(self.watermarks_path, "r") as f:
+            return json.load(f)
+
+    def __write_watermarks(self, watermarks):
+        # Written after the store, next to the old file and renamed over it: a crash leaves
+        # either the old or the new watermarks, never a truncated file. Old watermarks next to
+        # a newer store are harmless, WellLoader skips flow rows its tail already holds
+        tmp = self.watermarks_path.with_name(self.watermarks_path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(watermarks, f, indent=3)
+        os.replace(tmp, self.watermarks_path)
+
+
+def _load_well(job):
+    # Module level so it can be shipped to worker processes
+    well_dir, watermarks, tail, cycle_definition = job
+    loader = WellLoader(well_dir, watermarks, tail, cycle_definition)
+    return loader.load(), loader.watermarks, loader.stats
+
+
+def find_cycle_onsets(times, flow_rate, flow_threshold=0.0, min_shutin_seconds=0, in_shutin=False):
+    # Boolean mask of the rows where a new cycle starts: the first row of every shut-in, i.e. a
+    # flow rate within +/- flow_threshold of zero after the well was flowing. Rows that are
+    # neither shut in nor flowing (negative meter noise) keep the previous state. Shut-ins
+    # shorter than min_shutin_seconds (measured up to the row where flow resumes, or up to the
+    # last row while still shut in) do not start a cycle. `in_shutin` is the state before row 0
+    shut = np.where(np.abs(flow_rate) <= flow_threshold, 1.0,
+                    np.where(flow_rate > flow_threshold, 0.0, np.nan))
+    state = pd.Series(np.r_[float(in_shutin), shut]).ffill().to_numpy(dtype=bool)
+    onsets = state[1:] & ~state[:-1]
+    if min_shutin_seconds > 0 and onsets.any():
+        starts = np.flatnonzero(onsets)
+        flowing = np.flatnonzero(~state[1:])
+        ends = np.searchsorted(flowing, starts)
+        end_times = np.where(ends < len(flowing), times[flowing[np.minimum(ends, len(flowing) - 1)]],
+                             times[-1])
+        onsets[starts[end_times - times[starts] < min_shutin_seconds]] = False
+    return onsets
+
+
+def _settled_until(watermarks):
+    # Rows at or before this time have seen every PID sample that can match them
+    flow_watermark = watermarks.get(FLOW_RATE_FILE)
+    if flow_watermark is None:
+        return None
+    pid_watermarks = [v for k, v in watermarks.items() if k != FLOW_RATE_FILE]
+    slowest = min(pid_watermarks, default=flow_watermark)
+    return max(slowest, flow_watermark - MAX_PID_LAG_SECONDS) - JOIN_TOLERANCE_SECONDS
+
+
+class WellLoader:
+    def __init__(self, well_dir, watermarks=None, tail=None, cycle_definition=None):
+        self.well_dir = well_dir
+        # keyword arguments for find_cycle_onsets (flow_threshold, min_shutin_seconds)
+        self.cycle_definition = dict(cycle_definition or {})
+        # last sample time already processed for every PID file of the well
+        self.watermarks = dict(watermarks or {})
+        # stored rows of the well's unsettled trailing cycles, None on a first load
+        self.tail = tail
+        self.df = None
+        # time spent reading PID files and joining them, and the samples read
+        self.stats = {"parse_seconds": 0.0, "join_seconds": 0.0, "rows_parsed": 0}
+        self.__files = {}
+
+    def load(self):
+        # Initialize the files dictionary to store parsed CSV data
+        self.__files = {}
+        # PIDs are keyed by their csv name, whether stored as csv or as typed samples
+        file_names = sorted({
+            f if f.endswith(".csv") else f[:-len(SAMPLES_SUFFIX)] + ".csv"
+            for f in os.listdir(self.well_dir) if f.endswith((".csv", SAMPLES_SUFFIX))
+        })
+        if FLOW_RATE_FILE not in file_names:
+            print(f"{self.well_dir.name}: no flow rate data, skipping")
+            return self.__empty_frame()
+
+        if self.tail is None:
+            for file_name in file_names:
+                print(f"{self.well_dir.name}: {file_name}")
+                self.__files[file_name] = self.__read_pid(file_name)
+            self.__cleanup()
+            flow_times, flow_values = self.__files[FLOW_RATE_FILE]
+            cycle_ids = self.__flow_rate_cycles(flow_times, flow_values)
+            tail_rows = 0
+        else:
+            # the flow rate rows of the re-opened cycle come from the store, only newer ones from disk
+            new_times, new_values = self.__read_pid(FLOW_RATE_FILE, self.__newer_than(FLOW_RATE_FILE))
+            # after a run that stopped between writing the store and the watermarks, the tail
+            # already holds some of the rows past the flow watermark
+            fresh = new_times > self.tail['isotime'].iloc[-1]
+            if not fresh.all():
+                new_times, new_values = new_times[fresh], new_values[fresh]
+            # new flow rows may match PID samples up to the tolerance before them
+            lookback = new_times[0] - JOIN_TOLERANCE_SECONDS if len(new_times) else None
+            for file_name in file_names:
+                if file_name == FLOW_RATE_FILE:
+                    continue
+                since = self.__newer_than(file_name)
+                if since is not None and lookback is not None:
+                    since = min(since, lookback)
+                self.__files[file_name] = self.__read_pid(file_name, since)
+            if len(new_times) == 0 and not any(len(times) for times, _ in self.__files.values()):
+                return self.__empty_frame()
+
+            tail_rows = len(self.tail)
+            flow_times = np.concatenate([self.tail['isotime'].to_numpy(dtype=np.int64), new_times])
+            flow_values = np.concatenate([self.tail['flow_rate'].to_numpy(dtype=np.float64), new_values])
+            cycle_ids = self.__flow_rate_cycles(flow_times, flow_values, int(self.tail['cycle_id'].iloc[0]))
+
+        self.df = pd.DataFrame({
+            'cycle_id': cycle_ids,
+            'isotime': flow_times,
+            'flow_rate': flow_values,
+        })
+        started = time.perf_counter()
+        self.__data_entries_manager(tail_rows)
+        self.stats["join_seconds"] += time.perf_counter() - started
+        self.__advance_watermarks(flow_times)
         return self.df
 
+    def __empty_frame(self):
+        return pd.DataFrame(columns=['cycle_id', 'isotime', 'flow_rate'])
+
+    def __newer_than(self, file_name):
+        # first timestamp not yet processed for this file, None when it has never been seen
+        watermark = self.watermarks.get(file_name)
+        return None if watermark is None else watermark + 1
+
+    def __advance_watermarks(self, flow_times):
+        if len(flow_times):
+            self.watermarks[FLOW_RATE_FILE] = max(int(flow_times[-1]), self.watermarks.get(FLOW_RATE_FILE, 0))
+        for file_name, (times, _) in self.__files.items():
+            if file_name != FLOW_RATE_FILE and len(times):
+                self.watermarks[file_name] = max(int(times.max()), self.watermarks.get(file_name, 0))
 
-    def __iso_to_unix(self, iso_str):
-        # Handles ISO 8601 with 'Z' (UTC)
-        # 2025-06-29T08:08:20Z
+    def __iso_to_unix(self, iso_strs):
+        # Bulk converts ISO 8601 strings with 'Z' (UTC), e.g. 2025-06-29T08:08:20Z, to int64
+        # epoch seconds. Also returns a mask of the entries that could not be parsed
+        parsed = pd.to_datetime(iso_strs, format="ISO8601", utc=True, errors="coerce")
+        invalid = parsed.isna().to_numpy()
+        seconds = parsed.dt.tz_localize(None).to_numpy(dtype="datetime64[s]").astype(np.int64)
+        return seconds, invalid
+
+    def __read_pid(self, file_name, since=None):
+        # Typed samples written by the fetcher's sink need no parsing; they win over a csv
+        started = time.perf_counter()
+        samples_dir = self.well_dir / (file_name[:-len(".csv")] + SAMPLES_SUFFIX)
+        if samples_dir.is_dir():
+            times, values = read_samples(samples_dir, since)
+        else:
+            times, values = self.__parse_csv(self.well_dir / file_name, since)
+        self.stats["parse_seconds"] += time.perf_counter() - started
+        self.stats["rows_parsed"] += len(times)
+        return times, values
+
+    def __parse_csv(self, file_path, since=None):
+        # Parses a PID csv straight into (times, values) columns: int64 epoch seconds and
+        # float64 readings. Malformed rows are reported and skipped rather than aborting the load.
+        # With `since`, only samples at or after that epoch second are kept; timestamps are ISO
+        # strings in UTC, so older rows are dropped by string comparison before any conversion
         try:
-            dt = datetime.datetime.strptime(iso_str, "%Y-%m-%dT%H:%M:%SZ")
-            dt = dt.replace(tzinfo=datetime.timezone.utc)
-            return int(dt.timestamp())
-        except ValueError as e:
-            print(f"error: {iso_str}")
-            raise e
-        
-    def __parse_csv(self, file_path):
-        csv_file = []
-        idx = 0
-        with open(file_path, mode='r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if (idx == 0):
-                    idx+=1
-                    continue
-                row[0] = self.__iso_to_unix(row[0])
-                row[1] = float(row[1])
-                csv_file.append(row)
-        return csv_file
+            raw = pd.read_csv(file_path, usecols=[0, 1], header=0, names=["timestamp", "val"],
+                              dtype=str, on_bad_lines="warn", encoding="utf-8")
+        except pd.errors.EmptyDataError:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if since is not None:
+            since_iso = datetime.fromtimestamp(since, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            timestamps = raw["timestamp"]
+            older = (timestamps < since_iso) & (timestamps.str.len() == len(since_iso))
+            raw = raw[~older.to_numpy()]
+
+        times, malformed = self.__iso_to_unix(raw["timestamp"])
+        values = pd.to_numeric(raw["val"], errors="coerce").to_numpy(dtype=np.float64)
+        malformed = malformed | np.isnan(values)
+        if malformed.any():
+            bad_lines = raw.index.to_numpy()[malformed] + 2  # header row + 1-based line numbers
+            shown = ", ".join(map(str, bad_lines[:5])) + (", ..." if len(bad_lines) > 5 else "")
+            print(f"{Path(file_path).name}: skipped {len(bad_lines)} malformed rows (lines {shown})")
+            times = times[~malformed]
+            values = values[~malformed]
+        if since is not None:
+            keep = times >= since
+            times = times[keep]
+            values = values[keep]
+        return times, values
 
     def __cleanup(self):
-        isotime_threshold = 0
-        for i in range(len(self.__files["Sales Meter Flow Rate (MCF_Day).csv"])):
-            if self.__files["Sales Meter Flow Rate (MCF_Day).csv"][i][1] == 0.0:
-                if i==0: # if list is already clean (starting from zero)
-                    break
-                isotime_threshold = self.__files["Sales Meter Flow Rate (MCF_Day).csv"][i-1][0] + 60 # added one minute of threshold
-                self.__files["Sales Meter Flow Rate (MCF_Day).csv"] = self.__files["Sales Meter Flow Rate (MCF_Day).csv"][i:]
-                break
-        # now cleaning all the data using this in all files
-        for file in self.__files:
-            if(file=="Sales Meter Flow Rate (MCF_Day).csv"):
+        # Drop the flow rate rows before the first cycle starts, and PID samples older than one
+        # minute after the last of those rows
+        flow_times, flow_values = self.__files[FLOW_RATE_FILE]
+        onsets = np.flatnonzero(find_cycle_onsets(flow_times, flow_values, **self.cycle_definition))
+        if len(onsets) == 0 or onsets[0] == 0:  # no cycle yet, or already clean (starting from zero)
+            return
+        first = onsets[0]
+        isotime_threshold = flow_times[first - 1] + 60  # added one minute of threshold
+        self.__files[FLOW_RATE_FILE] = (flow_times[first:], flow_values[first:])
+        for file_name, (times, values) in self.__files.items():
+            if file_name == FLOW_RATE_FILE:
                 continue
-            for i in range(len(self.__files[file])):
-                if self.__files[file][i][0] >= isotime_threshold:
-                    #print(f"threshold: ${isotime_threshold} and data: ${files[file][i][0]}\n")
-                    self.__files[file] = self.__files[file][i:]  # remove the first element
-                    break
-
-    def __flow_rate_cycles(self):
-        flow_rate = self.__files['Sales Meter Flow Rate (MCF_Day).csv']
-        data = [[None, None, None] for i in range(len(flow_rate))]
-        cycle_id = -1
-        new_cycle_mil_gia = False
-        for i in range(len(data)):
-            if flow_rate[i][1] == 0.0 and not new_cycle_mil_gia:
-                cycle_id+=1
-                new_cycle_mil_gia = True
-            elif flow_rate[i][1] > 0.0:
-                new_cycle_mil_gia = False
-            data[i][0] = cycle_id
-            data[i][1] = flow_rate[i][0]
-            data[i][2] = flow_rate[i][1]
-
-        return data
-
-    def __data_entries_manager(self):
+            start = np.searchsorted(times, isotime_threshold, side="left")
+            if start < len(times):
+                self.__files[file_name] = (times[start:], values[start:])
+
+    def __flow_rate_cycles(self, flow_times, flow_rate, start_cycle_id=None):
+        # A new cycle starts at every zero-flow onset. When continuing a stored cycle
+        # (start_cycle_id given), its first row stays in that cycle
+        if start_cycle_id is None:
+            onsets = find_cycle_onsets(flow_times, flow_rate, **self.cycle_definition)
+            return np.cumsum(onsets, dtype=np.int64) - 1
+        onsets = find_cycle_onsets(flow_times, flow_rate, in_shutin=True, **self.cycle_definition)
+        return np.cumsum(onsets, dtype=np.int64) + start_cycle_id
+
+    def __data_entries_manager(self, tail_rows=0):
+        # The first tail_rows rows come from the store; their already joined values are kept
+        # since a matched sample is always older than any sample seen since
+        flow_times = self.df["isotime"].to_numpy(dtype=np.int64)
         for file_name in self.__files:
-            if file_name == "Sales Meter Flow Rate (MCF_Day).csv":
+            if file_name == FLOW_RATE_FILE:
                 continue
-            self.df[file_name] = None  # Create a new column for each file
-            # Iterate through the DataFrame and for each isotime of flow rate (threshold_isotime)
-            # find the corresponding isotime in the range of the thereshold_isotime_range
-            # and assign the value from the corresponding file to the DataFrame      
-            for i in range(len(self.df)):
-                threshold_isotime = self.df.iloc[i]["isotime"]
-                threshold_isotime_range = [threshold_isotime-60, threshold_isotime+61] # last is not included soo +61 to get +60
-                for j in range(len(self.__files[file_name])):
-                    if self.__files[file_name][j][0] in range(threshold_isotime_range[0], threshold_isotime_range[1]):
-                        # found the data entry
-                        self.df.at[i,file_name] = self.__files[file_name][j][1]
-                        break
\ No newline at end of file
+            times, values = self.__files[file_name]
+            joined = self.__asof_join(flow_times, times, values)
+            if tail_rows and file_name in self.tail:
+                stored = self.tail[file_name].to_numpy(dtype=np.float64)
+                joined[:tail_rows] = np.where(np.isnan(stored), joined[:tail_rows], stored)
+            self.df[file_name] = joined
+
+    @staticmethod
+    def __asof_join(flow_times, times, values, tolerance=JOIN_TOLERANCE_SECONDS):
+        # For every flow-rate timestamp t pick the first sample (in time order) lying in
+        # [t - tolerance, t + tolerance], NaN if there is none
+        result = np.full(len(flow_times), np.nan)
+        if len(times) == 0:
+            return result
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind="stable")
+            times = times[order]
+            values = values[order]
+        idx = np.searchsorted(times, flow_times - tolerance, side="left")
+        hit = idx < len(times)
+        hit[hit] = times[idx[hit]] <= flow_times[hit] + tolerance
+        result[hit] = values[idx[hit]]
+        return result
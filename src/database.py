@@ -1,8 +1,22 @@
+import re
 import sqlite3
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from .metrics import ROWS_INSERTED, STAGE_SECONDS
+
+BUSY_TIMEOUT_SECONDS = 60  # how long a writer waits for another writer's transaction to finish
+
+# Columns added to tables after their first release, as (table, column, definition).
+# CREATE TABLE IF NOT EXISTS leaves existing databases alone, so these are added on connect
+ADDED_COLUMNS = [
+    ("PLUNGER_ARRIVAL_STATUS_EVENTS", "late_arrival", "BOOLEAN NOT NULL DEFAULT 0"),
+    ("EVENTS", "well_id", "INTEGER"),
+]
+
 class Database:
-    def __init__(self, db_name=':memory:'):
+    def __init__(self, db_name=':memory:', cached_statements=256):
         self.data_dir = Path(__file__).parent.parent / 'data'
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.schema_dir = Path(__file__).parent.parent / 'db_schema'
@@ -10,21 +24,39 @@ class Database:
         
         if db_name == ':memory:':
             print("Using in-memory database.")
-            self.connection = sqlite3.connect(db_name)
+            self.path = None
+            self.connection = sqlite3.connect(db_name, cached_statements=cached_statements)
         else:
+            db_name = str(db_name)
             if not db_name.endswith('.db'):
                 db_name += '.db'
             print(f"Connecting to database: {db_name}")
-            db_path = self.data_dir / db_name
-            self.connection = sqlite3.connect(str(db_path))
+            # a bare name lives in the repo's data/ folder, a path (e.g. a temp dir) is used as is
+            self.path = self.data_dir / db_name if Path(db_name).parent == Path('.') else Path(db_name)
+            self.connection = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT_SECONDS,
+                                              cached_statements=cached_statements)
+            # WAL lets the query server read while events are being written
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
 
         self.cursor = self.connection.cursor()
+        self.__statements = {}  # (table, columns) -> INSERT statement
+        self.__pending = None   # (table, columns) -> buffered rows while inside batch()
+        self.__pending_rows = 0
+        self.__next_ids = {}    # table -> next _id to hand out while inside batch()
+        self.__flush_rows = 0
         self.create_tables()
 
     def create_tables(self):
         with open(self.schema_dir / 'schema.sql', 'r') as f:
             schema = f.read()
         self.cursor.executescript(schema)
+        for table, column, definition in ADDED_COLUMNS:
+            existing = [row[1] for row in self.cursor.execute(f"PRAGMA table_info({table})")]
+            if column not in existing:
+                self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        with open(self.schema_dir / 'indexes.sql', 'r') as f:
+            self.cursor.executescript(f.read())
         self.connection.commit()
 
     def close(self):
@@ -36,14 +68,112 @@ class Database:
             raise ValueError("Event must have a 'name' field.")
 
         event_data = {k: v for k, v in event.items() if k != 'name'}
-        columns = ', '.join(event_data.keys())
-        placeholders = ', '.join(['?'] * len(event_data))
-        sql = f"INSERT INTO {name} ({columns}) VALUES ({placeholders})"
+        if self.__pending is not None:
+            return self.__buffer_event(name, event_data)
+        sql = self.__insert_statement(name, tuple(event_data.keys()))
         self.cursor.execute(sql, tuple(event_data.values()))
-        self.connection.commit()
+        self.__commit()
+        ROWS_INSERTED.inc(table=name)
         return self.cursor.lastrowid
 
+    def insertEvents(self, name, columns: dict):
+        # Bulk insertEvent: columns maps column name -> list of values, one per row. The rows
+        # get consecutive ids, which are returned in row order
+        with self.batch():
+            count = len(next(iter(columns.values()))) if columns else 0
+            first_id = self.__allocate_ids(name, count)
+            key = (name, ('_id',) + tuple(columns.keys()))
+            self.__pending.setdefault(key, []).extend(
+                zip(range(first_id, first_id + count), *columns.values())
+            )
+            self.__pending_rows += count
+            if self.__pending_rows >= self.__flush_rows:
+                self.__flush()
+        return list(range(first_id, first_id + count))
+
+    @contextmanager
+    def batch(self, flush_rows=5000):
+        # Inside the block insertEvent only buffers rows, per table, and writes them with
+        # executemany every flush_rows rows. Everything runs in one transaction that is
+        # committed when the block exits and rolled back if it raises. Row ids are handed out
+        # up front so ids returned for child tables can be linked from EVENTS right away
+        if self.__pending is not None:  # already batching, join the outer transaction
+            yield self
+            return
+        if not self.connection.in_transaction:
+            # take the write lock before any ids are handed out: a deferred transaction only
+            # locks at its first INSERT, so another writer on the same database (e.g. the
+            # streaming detector next to a batch run) could read the same MAX(_id) meanwhile
+            self.connection.execute("BEGIN IMMEDIATE")
+        self.__pending = {}
+        self.__pending_rows = 0
+        self.__next_ids = {}
+        self.__flush_rows = flush_rows
+        try:
+            yield self
+            self.__flush()
+            self.__commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+        finally:
+            self.__pending = None
+            self.__pending_rows = 0
+            self.__next_ids = {}
+
+    def __allocate_ids(self, name, count=1):
+        # first of `count` consecutive unused ids for the table
+        if name not in self.__next_ids:
+            self.cursor.execute(f"SELECT COALESCE(MAX(_id), 0) FROM {name}")
+            self.__next_ids[name] = self.cursor.fetchone()[0] + 1
+        first_id = self.__next_ids[name]
+        self.__next_ids[name] += count
+        return first_id
+
+    def __buffer_event(self, name, event_data):
+        event_id = self.__allocate_ids(name)
+
+        key = (name, ('_id',) + tuple(event_data.keys()))
+        self.__pending.setdefault(key, []).append((event_id,) + tuple(event_data.values()))
+        self.__pending_rows += 1
+        if self.__pending_rows >= self.__flush_rows:
+            self.__flush()
+        return event_id
+
+    def __commit(self):
+        started = time.perf_counter()
+        self.connection.commit()
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="commit")
+
+    def __flush(self):
+        # tables are written in the order they were first used, i.e. children before EVENTS
+        if not self.__pending:
+            return
+        for (name, columns), rows in self.__pending.items():
+            self.cursor.executemany(self.__insert_statement(name, columns), rows)
+            ROWS_INSERTED.inc(len(rows), table=name)
+        self.__pending = {}
+        self.__pending_rows = 0
+
+    def __insert_statement(self, name, columns):
+        key = (name, columns)
+        sql = self.__statements.get(key)
+        if sql is None:
+            placeholders = ', '.join(['?'] * len(columns))
+            sql = f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({placeholders})"
+            self.__statements[key] = sql
+        return sql
+
+    def executemany(self, sql, rows):
+        # Runs a statement once per row in the current transaction, after writing whatever
+        # rows batch() is still holding so the statement sees them
+        if self.__pending:
+            self.__flush()
+        self.cursor.executemany(sql, rows)
+
     def fetch_event(self, event_id, event_name):
+        if self.__pending:
+            self.__flush()  # buffered rows must be written before they can be read back
         sql = f"SELECT * FROM {event_name} WHERE _id = ?"
         self.cursor.execute(sql, (event_id,))
         row = self.cursor.fetchone()
@@ -58,13 +188,17 @@ class Database:
         return self.cursor.fetchall()
     
     def run_query(self, query: str):
-        if not query.strip().lower().startswith("select"):
-            raise ValueError("Only SELECT queries are allowed.")
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        columns = [desc[0] for desc in self.cursor.description]
-        result = [dict(zip(columns, row)) for row in rows]
-        return result
+        # a WITH can lead into a DELETE, so the connection refuses writes while the query runs
+        self.connection.execute("PRAGMA query_only=ON")
+        try:
+            return run_query(self.cursor, query)
+        finally:
+            self.connection.execute("PRAGMA query_only=OFF")
+
+    def last_reported_times(self):
+        # {well_id: end_time of the well's last cycle in CYCLE_SUMMARY}, how far events go
+        self.cursor.execute("SELECT well_id, MAX(end_time) FROM CYCLE_SUMMARY GROUP BY well_id")
+        return dict(self.cursor.fetchall())
 
     def get_last_cycle_id(self) -> int:
         try:
@@ -73,4 +207,32 @@ class Database:
             return row[0] if row and row[0] is not None else -1
         except sqlite3.Error:
             # If table doesn't exist yet or other error, start fresh
-            return -1
\ No newline at end of file
+            return -1
+
+
+def run_query(cursor, query: str):
+    # Rows of a SELECT as dicts, on any cursor (the query server runs it on pooled connections)
+    columns, rows = stream_query(cursor, query)
+    result = [dict(zip(columns, row)) for row in rows]
+    return result
+
+
+def check_select(query: str):
+    # Early refusal of what is obviously not a query. It is not what keeps writes out: a WITH
+    # may also lead into a DELETE, which the query server's authorizer and read-only
+    # connections (or run_query's query_only) refuse
+    if not re.match(r"\s*(select|with)\b", query, re.IGNORECASE):
+        raise ValueError("Only SELECT queries (optionally starting with WITH) are allowed.")
+
+
+def stream_query(cursor, query: str, params=(), batch_rows=1000):
+    # (column names, iterator over the row tuples), read from the cursor batch_rows at a time
+    # so the whole result is never held in memory
+    check_select(query)
+    cursor.execute(query, params)
+    columns = [desc[0] for desc in cursor.description]
+
+    def rows():
+        while batch := cursor.fetchmany(batch_rows):
+            yield from batch
+    return columns, rows()
@@ -1,354 +1,194 @@
+import numpy as np
+import pandas as pd
+
+from .metrics import CYCLES, EVENTS, STAGE_SECONDS
+from .rollups import update_rollups
+from .rules import FEATURE_COLUMNS, RULES, load_thresholds, run_rules
+
+TUBING_PRESSURE = "Tubing Pressure (PSI).csv"
+CASING_PRESSURE = "Casing Pressure (PSI).csv"
+LINE_PRESSURE = "Line Pressure (PSIA).csv"
+ARRIVAL_SPEED = "Arrival Speed.csv"
+NON_ARRIVAL_COUNT = "Current Non-Arrival Count.csv"
+ARRIVAL_TIME_REMAINING = "Arrival Time Remaining.csv"
+
+
+def cycle_features(df, flow_thresholds=None):
+    # One row per (well_id, cycle_id) with everything the events need, computed in a single
+    # pass over the rows. df must hold each cycle's rows contiguously and in time order.
+    # flow_thresholds maps a well to its cycle definition's flow threshold (0 if missing): rows
+    # within it of zero count as shut in, rows above it as flowing, as for the cycle onsets
+    if df.empty:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+    n = len(df)
+    well_ids = df['well_id'].to_numpy(dtype=np.int64)
+    cycle_ids = df['cycle_id'].to_numpy(dtype=np.int64)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = (well_ids[1:] != well_ids[:-1]) | (cycle_ids[1:] != cycle_ids[:-1])
+    starts = np.flatnonzero(new_group)
+    ends = np.r_[starts[1:], n] - 1
+
+    def column(name):
+        if name not in df:
+            return np.full(n, np.nan)
+        return df[name].to_numpy(dtype=np.float64)
+
+    def masked_mean(values, mask):
+        total = np.add.reduceat(np.where(mask, values, 0.0), starts)
+        count = np.add.reduceat(mask.astype(np.int64), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / count, count
+
+    def masked_duration(times, mask):
+        # last minus first time where mask holds, 0 if it never does
+        first = np.minimum.reduceat(np.where(mask, times, np.iinfo(np.int64).max), starts)
+        last = np.maximum.reduceat(np.where(mask, times, np.iinfo(np.int64).min), starts)
+        return np.where(np.add.reduceat(mask.astype(np.int64), starts) > 0, last - first, 0)
+
+    times = df['isotime'].to_numpy(dtype=np.int64)
+    flow = df['flow_rate'].to_numpy(dtype=np.float64)
+    threshold = pd.Series(well_ids).map(flow_thresholds or {}).fillna(0.0).to_numpy(dtype=np.float64)
+    flowing = flow > threshold
+    shut_in = np.abs(flow) <= threshold
+    features = {
+        'well_id': well_ids[starts],
+        'cycle_id': cycle_ids[starts],
+        'start_time': times[starts],
+        'end_time': times[ends],
+    }
+    for key, name in (('pt', TUBING_PRESSURE), ('cp', CASING_PRESSURE), ('pl', LINE_PRESSURE)):
+        values = column(name)
+        features[f'{key}_first'] = values[starts]
+        features[f'{key}_last'] = values[ends]
+    features['flow_duration'] = masked_duration(times, flowing)
+    features['shutin_duration'] = masked_duration(times, shut_in)
+    mean_flow_rate, flowing_rows = masked_mean(flow, flowing)  # MCF/Day, flowing rows only
+    features['mean_flow_rate'] = mean_flow_rate
+    speed = column(ARRIVAL_SPEED)
+    features['mean_arrival_speed'] = masked_mean(speed, ~np.isnan(speed))[0]
+    features['max_non_arrival_count'] = np.fmax.reduceat(column(NON_ARRIVAL_COUNT), starts)
+    features['min_arrival_time_remaining'] = np.fmin.reduceat(column(ARRIVAL_TIME_REMAINING), starts)
+
+    features['flowing_rows'] = flowing_rows
+    return derive_cycle_features(features)
+
+
+def derive_cycle_features(features):
+    # Completes the per-cycle aggregates (arrays keyed like FEATURE_COLUMNS, plus the number of
+    # flowing rows) with the values the basic events report, for all cycles at once
+    flowing_rows = features['flowing_rows']
+    features['delta_pt'] = features['pt_last'] - features['pt_first']
+    features['delta_cp'] = features['cp_last'] - features['cp_first']
+    features['delta_pl'] = features['pl_last'] - features['pl_first']
+    features['total_duration'] = features['end_time'] - features['start_time']
+    # mean flow converted from MCF/Day to m³/s (1 MCF = 28.3168 m³, 1 day = 86400 s) times flow time
+    features['gas_volume'] = np.where(
+        flowing_rows > 0,
+        features['mean_flow_rate'] * 28.3168 / 86400 * features['flow_duration'],
+        0.0,
+    )
+    features['non_arrival'] = features['max_non_arrival_count'] > 0
+    return pd.DataFrame(features, columns=FEATURE_COLUMNS)
+
+
 class EventsGenerator:
-    def __init__(self, data_loader, database):
+    def __init__(self, data_loader, database, start=None, end=None, rules=None, config_file=None):
         self.data_loader = data_loader
-        self.df = data_loader.load()
+        # Normally the freshly loaded rows; with a time range the stored history is replayed
+        # from the memory-mapped store instead (e.g. to re-run events over a past period)
+        self.from_load = start is None and end is None
+        if self.from_load:
+            self.df = data_loader.load()
+        else:
+            self.df = data_loader.get_data(start, end)
         self.database = database
+        # Event rules and their per-well thresholds (see src/rules.py)
+        self.rules = RULES if rules is None else rules
+        self.thresholds = load_thresholds(config_file or data_loader.config_file)
 
         # Ensure the database is ready
         if not self.database.connection:
             raise ValueError("Database connection is not established.")
 
     def generate_events(self):
-        return self.__generate_events_per_cycle(
-            basic_event_funcs=[
-                self.__BasicPressureEvent,
-                self.__CycleDurationEvent,
-                self.__PlungerArrivalVelocityEvent
-            ],
-            complex_event_funcs=[
-                self.__GasVolumeProducedEvent,
-                # self.__CycleDataEvent,
-                self.__UnexpectedLowCasingPressure,
-                self.__PlungerArrivalStatusEvent,
-                self.__PlungerUnsafeVelocityEvent,
-                self.__UnexpectedLowFlow,
-                self.__UnexpectedLowCycleDuration,
-                self.__UnexpectedHighCycleDuration,
-                # self.__CycleAnomalyEvent
-            ]
-        )
-
-
-    def __generate_events_per_cycle(self, basic_event_funcs, complex_event_funcs):
-        # Determine starting cycle_id based on existing DB records
-        base_cycle_id = 0
-        if hasattr(self.database, 'get_last_cycle_id'):
-            last = self.database.get_last_cycle_id()
-            base_cycle_id = (last + 1) if last is not None and last >= 0 else 0
-
-        for new_idx, (cycle_id, group) in enumerate(self.df.groupby('cycle_id', sort=True)):
-            cycle_events = {}
-            # Generate basic events
-            for event_func in basic_event_funcs:
-                if callable(event_func):
-                    id, name = event_func(group)
-                    cycle_events[name] = id
-            # Generate complex events (may depend on basic ones)
-            for event_func in complex_event_funcs:
-                if callable(event_func):
-                    id, name = event_func(group, cycle_events)
-                    cycle_events[name] = id
-
-            # Filter out events with None as id or name
-            filtered_events = {k: v for k, v in cycle_events.items() if v is not None}
-            parent_event = {
-                "name": "EVENTS",
-                # Continuously increasing cycle_id across runs
-                "cycle_id": int(base_cycle_id + new_idx),
-                **filtered_events
-            }
-            self.database.insertEvent(parent_event)
-    
-    # == Basic Events ==
-
-    def __BasicPressureEvent(self, cycle_df, SG=0.6, hl=1000):
-        cols = [
-            "Tubing Pressure (PSI).csv",
-            "Casing Pressure (PSI).csv",
-            "Line Pressure (PSIA).csv"
-        ]
-        for col in cols:
-            cycle_df[col] = cycle_df[col].astype(float)
-
-        Pt_init = cycle_df.iloc[0]["Tubing Pressure (PSI).csv"]
-        Pt_final = cycle_df.iloc[-1]["Tubing Pressure (PSI).csv"]
-        Cp_init = cycle_df.iloc[0]["Casing Pressure (PSI).csv"]
-        Cp_final = cycle_df.iloc[-1]["Casing Pressure (PSI).csv"]
-        Pl_init = cycle_df.iloc[0]["Line Pressure (PSIA).csv"]
-        Pl_final = cycle_df.iloc[-1]["Line Pressure (PSIA).csv"]
-
-        delta_Pt = Pt_final - Pt_init
-        delta_Cp = Cp_final - Cp_init
-        delta_Pl = Pl_final - Pl_init
-        ph = 0.433 * SG * hl
-
-        id = self.database.insertEvent(
-            {
-                "name": "BASIC_PRESSURE_EVENTS",
-                "delta_pt": round(float(delta_Pt), 3),
-                "delta_cp": round(float(delta_Cp), 3),
-                "delta_pl": round(float(delta_Pl), 3),
-                "ph": round(float(ph), 3)
-            }
-        )
-
-        return id, 'basic_pressure_event'
-    
-    def __CycleDurationEvent(self, cycle_df):
-        # Start and end time of the cycle
-        start_time = int(cycle_df.iloc[0]['isotime'])
-        end_time = int(cycle_df.iloc[-1]['isotime'])
-        total_duration = end_time - start_time
-
-        # Flow duration: time when flow_rate was not zero
-        non_zero = cycle_df[cycle_df['flow_rate'] > 0]
-        if not non_zero.empty:
-            flow_start = int(non_zero.iloc[0]['isotime'])
-            flow_end = int(non_zero.iloc[-1]['isotime'])
-            flow_duration = flow_end - flow_start
-        else:
-            flow_duration = 0
-
-        # Shutin duration: time when flow_rate was zero
-        zero = cycle_df[cycle_df['flow_rate'] == 0]
-        if not zero.empty:
-            shutin_start = int(zero.iloc[0]['isotime'])
-            shutin_end = int(zero.iloc[-1]['isotime'])
-            shutin_duration = shutin_end - shutin_start
-        else:
-            shutin_duration = 0
-
-        id = self.database.insertEvent(
-            {
-                "name": "CYCLE_DURATION_EVENTS",
-                "start_time": start_time,
-                "end_time": end_time,
-                "total_duration": total_duration,
-                "flow_duration": flow_duration,
-                "shutin_duration": shutin_duration
-            }
-        )
-        return id, 'cycle_duration_event'
-
-    def __PlungerArrivalVelocityEvent(self, cycle_df):
-        # Convert Arrival Speed.csv to float and get mean arrival speed for the cycle
-        arrival_speed = cycle_df["Arrival Speed.csv"].astype(float).mean()
-        id = self.database.insertEvent(
-            {
-                "name": "PLUNGER_ARRIVAL_VELOCITY_EVENTS",
-                "arrival_speed": round(float(arrival_speed), 3)  # m/s
-            }
-        )
-    
-        return id, 'plunger_arrival_velocity_event'
-    
-    # == Complex Events ==
-
-    def __GasVolumeProducedEvent(self, cycle_df, events):
-        cycle_duration_id = events.get('cycle_duration_event')
-        cycle_duration_event = self.database.fetch_event(cycle_duration_id, "CYCLE_DURATION_EVENTS")
-
-        flow_duration = cycle_duration_event["flow_duration"]  # in seconds
-        # Use mean flow_rate during the cycle (excluding zeros)
-        non_zero_flow = cycle_df[cycle_df['flow_rate'] > 0]
-        if not non_zero_flow.empty:
-            avg_flow_rate = non_zero_flow['flow_rate'].mean()  # MCF/Day
-            # Convert avg_flow_rate from MCF/Day to cubic meters/second
-            # 1 MCF = 28.3168 m³, 1 day = 86400 seconds
-            avg_flow_rate_m3s = avg_flow_rate * 28.3168 / 86400
-            gas_volume = avg_flow_rate_m3s * flow_duration  # in cubic meters
+        with STAGE_SECONDS.time(stage="generate"):
+            return self.__generate_events_per_cycle()
+
+    def __generate_events_per_cycle(self):
+        if self.from_load:
+            # Every settled, closed cycle stored after the last one with events. The last cycle
+            # of a well has not been closed by a zero-flow onset yet (and a few more may still
+            # wait for PID samples); they are re-opened by the next incremental load and only
+            # reported once complete. A run whose events failed leaves its cycles to the next
+            closed = self.data_loader.unreported(self.database.last_reported_times())
         else:
-            gas_volume = 0.0
-
-        id = self.database.insertEvent(
-            {
-                "name": "GAS_VOLUME_PRODUCED_EVENTS",
-                "gas_volume": round(float(gas_volume), 3),  # m³
-                "cycle_duration_event": cycle_duration_id,
-            }
-        )
-        
-        return id, 'gas_volume_produced_event'
-    
-    # def __CycleDataEvent(self, cycle_df, events):
-    #     event_log = {
-    #         "cycle_id": int(cycle_df.iloc[0]["cycle_id"])
-    #     }
-    #     # Map event names to their data
-    #     for event in events:
-    #         if "BasicPressureEvent" in event:
-    #             event_log["basicPressureEvent"] = event["BasicPressureEvent"]
-    #         elif "CycleDurationEvent" in event:
-    #             event_log["cycleDurationEvent"] = event["CycleDurationEvent"]
-    #         elif "GasVolumeProducedEvent" in event:
-    #             event_log["gasVolumeProduced"] = event["GasVolumeProducedEvent"]
-    #         elif "PlungerArrivalVelocityEvent" in event:
-    #             event_log["velocityEvent"] = event["PlungerArrivalVelocityEvent"]
-    #     return {"CycleDataEvent": event_log}
-
-    def __UnexpectedLowCasingPressure(self, cycle_df, events, threshold=-5.0):
-        basic_pressure_event_id = events.get('basic_pressure_event')
-        basic_pressure_event = self.database.fetch_event(basic_pressure_event_id, "BASIC_PRESSURE_EVENTS")
-
-        delta_cp = basic_pressure_event['delta_cp']
-        if delta_cp < threshold:
-            id = self.database.insertEvent(
-                {
-                    "name": "UNEXPECTED_LOW_CASING_PRESSURE_EVENTS",
-                    "basic_pressure_event": basic_pressure_event_id,
-                    # "description": "Abnormally low casing pressure change detected."
-                }
-            )
-            return id, 'unexpected_low_casing_pressure'
-        else:
-            # No event triggered
-            return None, None
-
-    def __PlungerArrivalStatusEvent(self, cycle_df, events):
-        # non_arrival: True if all Current Non-Arrival Count.csv > 0, else False
-        non_arrival = cycle_df["Current Non-Arrival Count.csv"].astype(float).max() > 0
-
-        unexpected_casing_pressure_id = events.get('unexpected_low_casing_pressure', None)
-
-        if unexpected_casing_pressure_id is not None:
-            id = self.database.insertEvent(
-            {
-                "name": "PLUNGER_ARRIVAL_STATUS_EVENTS",
-                "non_arrival": bool(non_arrival),
-                "unexpected_casing_pressure": True,
-                "unexpected_low_casing_pressure": unexpected_casing_pressure_id
-            }
-        )
-        else:
-            id = self.database.insertEvent(
-                {
-                    "name": "PLUNGER_ARRIVAL_STATUS_EVENTS",
-                    "non_arrival": bool(non_arrival),
-                    "unexpected_casing_pressure": False,
-                }
-            )
-
-        return id, 'plunger_arrival_status_event'
-    
-    def __PlungerUnsafeVelocityEvent(self, cycle_df, events, safety_threshold=2.5):
-        plunger_arrival_velocity_id = events.get('plunger_arrival_velocity_event')
-
-        velocity_event = self.database.fetch_event(plunger_arrival_velocity_id, "PLUNGER_ARRIVAL_VELOCITY_EVENTS")
-        arrival_speed = velocity_event["arrival_speed"]
-        unsafe = arrival_speed > safety_threshold
-
-        if unsafe:
-            id = self.database.insertEvent(
-                {
-                    "name": "PLUNGER_UNSAFE_VELOCITY_EVENTS",
-                    "velocity_event": plunger_arrival_velocity_id,
-                }
-            )
-            return id, 'plunger_unsafe_velocity_event'
-        return None, None
-    
-    def __UnexpectedLowFlow(self, cycle_df, events, volume_threshold=10.0):
-        gas_volume_event_id = events.get('gas_volume_produced_event')
-
-        gas_volume_event = self.database.fetch_event(gas_volume_event_id, "GAS_VOLUME_PRODUCED_EVENTS")
-        gas_volume = gas_volume_event["gas_volume"]
-        if gas_volume < volume_threshold:
-            id = self.database.insertEvent(
-                {
-                    "name": "UNEXPECTED_LOW_FLOW_EVENTS",
-                    "gas_volume_produced_event": gas_volume_event_id,
-                }
-            )
-            return id, 'unexpected_low_flow'
-        return None, None
-
-    def __UnexpectedLowCycleDuration(self, cycle_df, events, total_duration_threshold=600, flow_duration_threshold=300, shutin_duration_threshold=300):
-        cycle_duration_event_id = events.get('cycle_duration_event')
-        if not cycle_duration_event_id:
-            return None, None
-
-        cycle_duration_event = self.database.fetch_event(cycle_duration_event_id, "CYCLE_DURATION_EVENTS")
-        total_duration = cycle_duration_event["total_duration"]
-        flow_duration = cycle_duration_event["flow_duration"]
-        shutin_duration = cycle_duration_event["shutin_duration"]
-
-        is_short = (
-            total_duration < total_duration_threshold or
-            flow_duration < flow_duration_threshold or
-            shutin_duration < shutin_duration_threshold
-        )
-
-        if is_short:
-            id = self.database.insertEvent(
-                {
-                    "name": "UNEXPECTED_LOW_CYCLE_DURATION_EVENTS",
-                    "cycle_duration_event": cycle_duration_event_id,
-                }
-            )
-            return id, 'unexpected_low_cycle_duration'
-        return None, None
-    
-    def __UnexpectedHighCycleDuration(self, cycle_df, events, total_duration_threshold=7200, flow_duration_threshold=3600, shutin_duration_threshold=3600):
-        cycle_duration_event_id = events.get('cycle_duration_event')
-        if not cycle_duration_event_id:
-            return None, None
-
-        cycle_duration_event = self.database.fetch_event(cycle_duration_event_id, "CYCLE_DURATION_EVENTS")
-        total_duration = cycle_duration_event["total_duration"]
-        flow_duration = cycle_duration_event["flow_duration"]
-        shutin_duration = cycle_duration_event["shutin_duration"]
-
-        is_long = (
-            total_duration > total_duration_threshold or
-            flow_duration > flow_duration_threshold or
-            shutin_duration > shutin_duration_threshold
-        )
-
-        if is_long:
-            id = self.database.insertEvent(
-                {
-                    "name": "UNEXPECTED_HIGH_CYCLE_DURATION_EVENTS",
-                    "cycle_duration_event": cycle_duration_event_id,
-                }
-            )
-            return id, 'unexpected_high_cycle_duration'
-        return None, None
-    
-    # def __CycleAnomalyEvent(self, cycle_df, events):
-    #     # Map anomaly event keys to their output names and descriptions
-    #     anomaly_map = {
-    #         "PlungerUnsafeVelocity": "plungerUnsafeVelocity",
-    #         "PlungerNonArrival": "plungerNonArrival",
-    #         "UnexpectedLowCasingPressure": "UnexpectedCasingPressure",
-    #         "UnexpectedLowFlow": "UnexpectedLowFlow",
-    #         "UnexpectedLowCycleDuration": "UnexpectedLowCycleDuration",
-    #         "UnexpectedHighCycleDuration": "UnexpectedHighCycleDuration"
-    #     }
-
-    #     # Find which anomaly events are present in the events list
-    #     triggered = {}
-    #     for event in events:
-    #         for key, output_name in anomaly_map.items():
-    #             if key in event:
-    #                 triggered[output_name] = event[key]
-
-    #     if triggered:
-    #         return {
-    #             "CycleAnomalyEvent": {
-    #                 "cycle_id": int(cycle_df.iloc[0]["cycle_id"]),
-    #                 "anomalies": list(triggered.keys()),
-    #                 "details": triggered,
-    #                 "description": (
-    #                     "The CycleAnomalyEvent is a composite event designed to encapsulate critical failures, "
-    #                     "inefficiencies, or safety violations occurring during a plunger lift cycle. It is triggered "
-    #                     "whenever one or more constituent anomaly events occur, including PlungerNonArrival, "
-    #                     "PlungerUnsafeVelocity, UnexpectedLowCasingPressure, UnexpectedLowFlow, "
-    #                     "UnexpectedLowCycleDuration, and UnexpectedHighCycleDuration. This wrapper event provides "
-    #                     "a high-level signal indicating that a cycle has deviated from expected operational behavior. "
-    #                     "It supports automated monitoring and root-cause analysis by summarizing which specific "
-    #                     "anomalies occurred, helping identify equipment issues, cycle misconfigurations, or poor lift "
-    #                     "conditions that warrant intervention."
-    #                 )
-    #             }
-    #         }
-    #     return None
\ No newline at end of file
+            # replaying a range, the last cycle of every well in it may be cut off
+            open_cycles = self.df.groupby('well_id')['cycle_id'].max()
+            closed = self.df[self.df['cycle_id'] < self.df['well_id'].map(open_cycles.to_dict())]
+
+        # cycle ids restart for every well, so cycles are keyed by (well_id, cycle_id)
+        closed = closed.sort_values(['well_id', 'cycle_id', 'isotime'], kind='stable')
+        flow_thresholds = {well_id: definition['flow_threshold']
+                           for well_id, definition in self.data_loader.cycle_definitions().items()}
+        features = cycle_features(closed, flow_thresholds)
+        if features.empty:
+            return
+
+        insert_cycle_events(self.database, features, self.rules, self.thresholds)
+
+
+def insert_cycle_events(database, features, rules, thresholds):
+    # Runs the rules over the cycles' features and adds one EVENTS row per cycle linking
+    # whatever fired for it, all in one transaction. Returns {rule name: RuleResult}
+    with database.batch():
+        # Continuously increasing cycle_id across runs
+        last = database.get_last_cycle_id()
+        base_cycle_id = (last + 1) if last is not None and last >= 0 else 0
+
+        results = run_rules(rules, features, thresholds, database)
+        events = {
+            "cycle_id": (base_cycle_id + np.arange(len(features))).tolist(),
+            "well_id": features['well_id'].to_numpy(dtype=np.int64).tolist(),
+        }
+        for name, result in results.items():
+            events[name] = result.refs().tolist()
+        event_ids = database.insertEvents("EVENTS", events)
+        database.insertEvents("CYCLE_SUMMARY", cycle_summary(features, results, events["cycle_id"], event_ids))
+        update_rollups(database, events["well_id"], features['start_time'].to_numpy(dtype=np.int64))
+    # counted once the transaction has committed
+    CYCLES.inc(len(features))
+    for name, result in results.items():
+        EVENTS.inc(int(np.count_nonzero(result.fired)), type=name)
+    return results
+
+
+# CYCLE_SUMMARY flag column -> the rule whose firing it records
+SUMMARY_FLAGS = {
+    'low_casing_pressure': 'unexpected_low_casing_pressure',
+    'unsafe_velocity': 'plunger_unsafe_velocity_event',
+    'low_flow': 'unexpected_low_flow',
+    'low_cycle_duration': 'unexpected_low_cycle_duration',
+    'high_cycle_duration': 'unexpected_high_cycle_duration',
+}
+
+
+def cycle_summary(features, results, cycle_ids, event_ids):
+    # CYCLE_SUMMARY columns for the cycles: their features, rounded like the events store
+    # them, and which anomalies fired. Flags of rules that did not run stay NULL
+    n = len(features)
+    summary = {'cycle_id': cycle_ids, 'event_id': event_ids,
+               'well_id': features['well_id'].to_numpy(dtype=np.int64).tolist()}
+    for column in ('start_time', 'end_time', 'total_duration', 'flow_duration', 'shutin_duration'):
+        summary[column] = features[column].to_numpy(dtype=np.int64).tolist()
+    for column in ('pt_first', 'pt_last', 'cp_first', 'cp_last', 'pl_first', 'pl_last',
+                   'delta_pt', 'delta_cp', 'delta_pl', 'gas_volume'):
+        summary[column] = np.round(features[column].to_numpy(dtype=np.float64), 3).tolist()  # NaN is stored as NULL
+    summary['arrival_speed'] = np.round(features['mean_arrival_speed'].to_numpy(dtype=np.float64), 3).tolist()
+    summary['non_arrival'] = features['non_arrival'].to_numpy(dtype=bool).tolist()
+    status = results.get('plunger_arrival_status_event')
+    # NULL where there is no arrival status
+    late = np.where(status.fired, status.values['late_arrival'], None) if status else np.full(n, None)
+    summary['late_arrival'] = late.tolist()
+    for column, name in SUMMARY_FLAGS.items():
+        summary[column] = results[name].fired.tolist() if name in results else [None] * n
+    return summary
@@ -1,16 +1,26 @@
 from typing import Dict, Any,List
 from dateutil import parser
 import os
-import csv
 from typing import List, Tuple
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .onping_auth import AuthManager
-from .onping_fetcher import fetch_data_range
+from .onping_fetcher import OnPingClient
+from .response_cache import ResponseCache
 import json
+import time
 
-from ..metadata import cdt,WELLS_CONFIG_FILE,DATA_FOLDER
+from ..metadata import cdt,WELLS_CONFIG_FILE,DATA_FOLDER,FETCH_CHECKPOINT_FILE,FETCH_CACHE_DIR
+from ..metrics import STAGE_SECONDS
+from ..samples import SampleSink, append_csv
 days_to_subtract=1  # used if no config avaliable  or  FETCHDATA_DAYS = True
 FETCHDATA_DAYS =False
+FETCH_WORKERS = 8          # PID requests in flight, overridable with "fetch_workers" in the config
+CONNECTIONS_PER_HOST = 4   # overridable with "connections_per_host"
+FETCH_WINDOW_SECONDS = 6 * 3600  # backfills are requested in windows of this size ("fetch_window_seconds")
+SAMPLE_FORMAT = "npy"      # typed day partitions, written per touched day; "csv" ("sample_format")
+                           # rewrites a PID's whole csv on every flush, it is kept for compatibility
+FETCH_CACHE_MB = 512       # response cache size ("fetch_cache_mb"), "fetch_cache": false bypasses it
 
 
 def save_to_csv(file_path: str, data: List[Dict[str, Any]]):
@@ -19,33 +29,44 @@ def save_to_csv(file_path: str, data: List[Dict[str, Any]]):
     if folder:
         os.makedirs(folder, exist_ok=True)
 
-    # Check if file exists
-    file_exists = os.path.exists(file_path)
+    # Appends only timestamps newer than the file's last row, written atomically
+    written = append_csv(file_path, data)
+    print(f"Saved {written} rows to {file_path}")
 
-    #  Open the file in append mode
-    with open(file_path, mode='w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
 
-        # Write header if file is new
-        if not file_exists:
-            writer.writerow(["timestamp", "val"])
+def plan_windows(start_time: datetime, end_time: datetime, window_seconds: int) -> List[Tuple[datetime, datetime]]:
+    # [start_time, end_time) cut into windows on a fixed window_seconds grid (the first one
+    # starts at the grid line before start_time), so repeated runs ask for the same windows
+    # and the response cache can serve them. Rows before start_time are dropped by the sink
+    windows = []
+    window = timedelta(seconds=window_seconds)
+    start_time -= timedelta(seconds=start_time.timestamp() % window_seconds)
+    while start_time < end_time:
+        windows.append((start_time, min(start_time + window, end_time)))
+        start_time += window
+    return windows
 
-        for item in data:
-            # Extract "time" and "val" from each dict
-            timestamp = item.get("time")
-            val = item.get("val")
 
-            # Print comma-separated
-            print(f"{timestamp},{val}")
+def load_checkpoints() -> Dict[str, str]:
+    # "<well name>/<pid name>" -> ISO time up to which that PID's data is saved
+    if not os.path.exists(FETCH_CHECKPOINT_FILE):
+        return {}
+    with open(FETCH_CHECKPOINT_FILE, "r") as f:
+        return json.load(f)
 
-            # Write to CSV
-            writer.writerow([timestamp, val])
 
-    print(f"Saved {len(data)} rows to {file_path}")
+def save_checkpoints(checkpoints: Dict[str, str]) -> None:
+    # written next to the old file and renamed over it, so a crash never leaves it half written
+    os.makedirs(os.path.dirname(FETCH_CHECKPOINT_FILE), exist_ok=True)
+    tmp = FETCH_CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoints, f, indent=3)
+    os.replace(tmp, FETCH_CHECKPOINT_FILE)
 
 
-def fetch_data(auth: AuthManager, config: Dict) -> None:
+def fetch_data(auth: AuthManager, config: Dict, client: OnPingClient = None, cache: ResponseCache = None) -> None:
     stepSec=config["step_seconds"]
+    window_seconds = config.get("fetch_window_seconds", FETCH_WINDOW_SECONDS)
     print(f"Starting  data fetching ")
     
    
@@ -58,47 +79,127 @@ def fetch_data(auth: AuthManager, config: Dict) -> None:
             startTime = parser.parse(config["lastFetchTime"]).astimezone(cdt)
             endTime = datetime.now()
         endTime = endTime.astimezone(cdt)
-        
-
-
-        iso_str = endTime.isoformat()
         print(f"found config , start time is now {startTime} and {endTime}")
-        if not os.path.exists(WELLS_CONFIG_FILE):
-            with open(WELLS_CONFIG_FILE, "w") as f:
-                json.dump({}, f)
 
-            
-        with open(WELLS_CONFIG_FILE, "r") as f:
-            file = json.load(f)
-            file["lastFetchTime"] = iso_str
-
-        with open(WELLS_CONFIG_FILE, "w") as f:
-            print(f"writing  to config file")
-            json.dump(file, f, indent=3)
-            
-
-                
-        print("--- Starting new live fetch data ---")
+        # Every PID resumes from its own checkpoint, lastFetchTime is only the fallback
+        checkpoints = load_checkpoints()
+        backfills = []
         for well_object in config["wells"]:
             well_name = well_object.get("name", "N/A")
-
-            print(f"\nWell: {well_name}")
             for pid_object in well_object["pids"]:
                 pid_name = pid_object.get("name", "N/A")
-                pid_id = pid_object.get("pid", "N/A")
-                data = fetch_data_range(auth,pid_id,startTime,endTime,stepSec)
-                print("GOT DATA")
-                if data != None:
-                    save_to_csv(f"{DATA_FOLDER}/{well_name}/{pid_name}.csv",data)
-                    print(f"✓ {well_name} - {pid_name} ({pid_id}): {len(data)} readings fetched")
-                else:
-                    print(f"✗ {well_name} - {pid_name} ({pid_id}): No data found for range {startTime} to {endTime}")
+                key = f"{well_name}/{pid_name}"
+                start = parser.parse(checkpoints[key]).astimezone(cdt) if key in checkpoints else startTime
+                backfills.append({
+                    "key": key,
+                    "well": well_name,
+                    "name": pid_name,
+                    "pid": pid_object.get("pid", "N/A"),
+                    "windows": plan_windows(start, endTime, window_seconds),
+                    "futures": [],
+                    "done": {},     # window index -> response, until the windows before it are saved
+                    "next": 0,      # first window not saved yet
+                    "saved_until": None,  # end of the last window handed to the sink
+                    "failed": False,
+                })
+
+        print("--- Starting new live fetch data ---")
+        sink = SampleSink(DATA_FOLDER, config.get("sample_format", SAMPLE_FORMAT))
+        if client is None:
+            client = OnPingClient(auth, per_host=config.get("connections_per_host", CONNECTIONS_PER_HOST))
+        if cache is None:
+            cache = ResponseCache(FETCH_CACHE_DIR, max_bytes=config.get("fetch_cache_mb", FETCH_CACHE_MB) * 1024 * 1024,
+                                  enabled=config.get("fetch_cache", True))
+        fetch_started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=config.get("fetch_workers", FETCH_WORKERS)) as pool:
+            # window by window across all PIDs, so every PID makes progress
+            futures = {}
+            for index in range(max((len(b["windows"]) for b in backfills), default=0)):
+                for backfill in backfills:
+                    if index < len(backfill["windows"]):
+                        window_start, window_end = backfill["windows"][index]
+                        future = pool.submit(cache.fetch, client, backfill["pid"], window_start, window_end, stepSec)
+                        futures[future] = (backfill, index)
+                        backfill["futures"].append(future)
+
+            try:
+                for future in as_completed(futures):
+                    backfill, index = futures[future]
+                    if backfill["failed"] or future.cancelled():
+                        continue
+                    backfill["done"][index] = future.result()
+                    _save_completed(backfill, checkpoints, sink)
+                    if backfill["failed"]:
+                        for pending in backfill["futures"]:
+                            pending.cancel()
+            except KeyboardInterrupt:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            finally:
+                # whatever was fetched before an interruption is still kept
+                sink.flush()
+                for backfill in backfills:
+                    _advance_checkpoint(backfill, checkpoints, sink)
+                STAGE_SECONDS.observe(time.perf_counter() - fetch_started, stage="fetch")
+
+        for backfill in backfills:
+            fetched = backfill["next"]
+            if backfill["failed"]:
+                print(f"✗ {backfill['well']} - {backfill['name']} ({backfill['pid']}): stopped after {fetched} of {len(backfill['windows'])} windows, resumes from {checkpoints.get(backfill['key'], startTime.isoformat())}")
+            else:
+                print(f"✓ {backfill['well']} - {backfill['name']} ({backfill['pid']}): {fetched} windows fetched")
+
+        if cache.enabled:
+            print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+
+        # lastFetchTime follows the PID that is furthest behind
+        saved = [parser.parse(checkpoints[b["key"]]) for b in backfills if b["key"] in checkpoints]
+        if saved and len(saved) == len(backfills):
+            if not os.path.exists(WELLS_CONFIG_FILE):
+                with open(WELLS_CONFIG_FILE, "w") as f:
+                    json.dump({}, f)
+            with open(WELLS_CONFIG_FILE, "r") as f:
+                file = json.load(f)
+                file["lastFetchTime"] = min(saved).astimezone(cdt).isoformat()
+            with open(WELLS_CONFIG_FILE, "w") as f:
+                print(f"writing  to config file")
+                json.dump(file, f, indent=3)
     except KeyboardInterrupt:
         print("Live data fetching stopped by user.")
           
         print(f"---  fetch data complete. ")
 
 
+def _save_completed(backfill: Dict, checkpoints: Dict[str, str], sink: SampleSink) -> None:
+    # Hands the PID's windows that are complete and contiguous from its checkpoint to the sink.
+    # The checkpoint moves past them once the sink has written their rows. A failed window stops
+    # the PID there; the windows after it are fetched again on the next run
+    while backfill["next"] in backfill["done"]:
+        index = backfill["next"]
+        data = backfill["done"].pop(index)
+        window_start, window_end = backfill["windows"][index]
+        if data is None:
+            backfill["failed"] = True
+            backfill["done"].clear()
+            print(f"✗ {backfill['well']} - {backfill['name']} ({backfill['pid']}): No data found for range {window_start} to {window_end}")
+            return
+        if data:
+            sink.add(backfill["well"], backfill["name"], data)
+        backfill["saved_until"] = window_end.isoformat()
+        backfill["next"] += 1
+        _advance_checkpoint(backfill, checkpoints, sink)
+
+
+def _advance_checkpoint(backfill: Dict, checkpoints: Dict[str, str], sink: SampleSink) -> None:
+    # only once none of the PID's rows are waiting in the sink's buffer
+    saved_until = backfill["saved_until"]
+    if saved_until is None or sink.buffered(backfill["well"], backfill["name"]):
+        return
+    if checkpoints.get(backfill["key"]) != saved_until:
+        checkpoints[backfill["key"]] = saved_until
+        save_checkpoints(checkpoints)
+
+
 def fetcher_Main():
     print("start Athentication")
     auth=AuthManager()
@@ -1,6 +1,8 @@
 # --- Authentication Manager ---
 import pickle 
 import os
+import threading
+import time
 from dotenv import load_dotenv
 load_dotenv()
 import json
@@ -11,9 +13,19 @@ from src.metadata import (
     BASE_URL, AUTH_URL, LOGIN_URL
 )
 
+SESSION_FRESH_SECONDS = 6 * 3600  # a session validated this recently is used without probing it
+
 class AuthManager:
-    def __init__(self):
+    # Holds the OnPing session shared by all fetch workers. `generation` counts logins, so a
+    # worker that got a 401 can tell whether the session it used has been replaced already
+    def __init__(self, fresh_seconds=SESSION_FRESH_SECONDS):
         self.cookies = None
+        self.validated_at = None  # epoch seconds the session was last known to work
+        self.generation = 0
+        self.fresh_seconds = fresh_seconds
+        self.__lock = threading.Lock()
+        self.__login_done = threading.Condition(self.__lock)
+        self.__logging_in = False
         self.load_credentials()
 
     def load_credentials(self):
@@ -33,14 +45,59 @@ class AuthManager:
         if not self.username or not self.password:
             raise ValueError("Credentials not found")
 
+    def session_age(self):
+        # seconds since the session was last known to work, None if never
+        return None if self.validated_at is None else time.time() - self.validated_at
+
     def authenticate(self, force_new=False):
         if not force_new and os.path.exists(COOKIE_FILE):
-            with open(COOKIE_FILE, "rb") as f:
-                self.cookies = pickle.load(f)
-                if self._test_cookies():
-                    print("Using cached cookies")
-                    return True
+            self.__load_cookies()
+            age = self.session_age()
+            if age is not None and age < self.fresh_seconds:
+                # known fresh: no probe, an expired session shows up as a 401 and is renewed then
+                print("Using cached cookies")
+                return True
+            if self._test_cookies():
+                print("Using cached cookies")
+                self.validated_at = time.time()
+                self.__save_cookies()
+                return True
+        return self.__login()
+
+    def reauthenticate(self, generation):
+        # For workers that got a 401 using the session of `generation`. Only the first of them
+        # logs in; the ones arriving while that login is in flight wait for it and share its
+        # outcome, and those whose session was already replaced just retry with the new one
+        with self.__lock:
+            if self.generation != generation:
+                return True
+            if self.__logging_in:
+                while self.__logging_in:
+                    self.__login_done.wait()
+                return self.generation != generation
+            self.__logging_in = True
+        try:
+            return self.__login()
+        finally:
+            with self.__lock:
+                self.__logging_in = False
+                self.__login_done.notify_all()
+
+    def __load_cookies(self):
+        with open(COOKIE_FILE, "rb") as f:
+            saved = pickle.load(f)
+        if isinstance(saved, dict):
+            self.cookies = saved["cookies"]
+            self.validated_at = saved.get("validated_at")
+        else:  # cookie jar pickled on its own by older versions, age unknown
+            self.cookies = saved
+            self.validated_at = None
+
+    def __save_cookies(self):
+        with open(COOKIE_FILE, "wb") as f:
+            pickle.dump({"cookies": self.cookies, "validated_at": self.validated_at}, f)
 
+    def __login(self):
         print("Authenticating...")
         try:
             auth_data = {
@@ -59,9 +116,11 @@ class AuthManager:
             r = requests.post(LOGIN_URL, json=auth_data["Right"], timeout=10)
             r.raise_for_status()
 
-            self.cookies = r.cookies
-            with open(COOKIE_FILE, "wb") as f:
-                pickle.dump(self.cookies, f)
+            with self.__lock:
+                self.cookies = r.cookies
+                self.validated_at = time.time()
+                self.generation += 1
+            self.__save_cookies()
 
             print("Auth successful")
             return True
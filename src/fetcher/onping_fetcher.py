@@ -1,29 +1,103 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
 import requests
+from requests.adapters import HTTPAdapter
 from zoneinfo import ZoneInfo
 from ..metadata import HISTORY_URL
+from ..metrics import FETCH_RETRIES, FETCH_SECONDS
 cdt = ZoneInfo("America/Chicago")
 
+# Responses worth another try: throttling and server side trouble
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class OnPingClient:
+    # One connection-pooled session shared by every fetch worker. Requests per host are
+    # capped by a semaphore (per_host, or host_limits[host]) and failed requests are retried
+    # with jittered exponential backoff. history_url can point at a local stand-in
+    def __init__(self, auth_manager, history_url=HISTORY_URL, per_host=4, host_limits=None,
+                 attempts=4, backoff=0.5, max_backoff=30.0, timeout=15):
+        self.auth_manager = auth_manager
+        self.history_url = history_url
+        self.per_host = per_host
+        self.host_limits = dict(host_limits or {})
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        pool_size = max([per_host, *self.host_limits.values()])
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(len(self.host_limits), 1), pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.__semaphores = {}
+        self.__lock = threading.Lock()
+
+    def history(self, pid, start_time, end_time, step):
+        params = {
+            "pid": pid,
+            "steps": [step],
+            "time_ranges": [[start_time.strftime("%Y-%m-%dT%H:%M:%SZ"), end_time.strftime("%Y-%m-%dT%H:%M:%SZ")]],
+            "delta": 15
+        }
+        with FETCH_SECONDS.time(pid=pid):
+            return self.get_json(self.history_url, params, f"PID {pid}")
+
+    def get_json(self, url, params, label):
+        # Parsed JSON body, or None once every attempt failed
+        semaphore = self.__semaphore(urlparse(url).netloc)
+        reauthenticated = False
+        for attempt in range(self.attempts):
+            try:
+                generation = self.auth_manager.generation
+                with semaphore:
+                    r = self.session.get(url, json=params, cookies=self.auth_manager.cookies, timeout=self.timeout)
+                if r.status_code == 401 and not reauthenticated:
+                    # concurrent 401s share a single login
+                    print("Session expired, retrying auth...")
+                    reauthenticated = True
+                    if not self.auth_manager.reauthenticate(generation):
+                        return None
+                    FETCH_RETRIES.inc(reason="401")
+                    continue
+                if r.status_code < 500 and r.status_code not in RETRY_STATUS:
+                    r.raise_for_status()
+                    return r.json()
+                print(f"Attempt {attempt+1} failed for {label}: HTTP {r.status_code}")
+                reason = str(r.status_code)
+            except requests.HTTPError as e:
+                # other client errors will not go away by asking again
+                print(f"Request failed for {label}: {e}")
+                return None
+            except Exception as e:
+                print(f"Attempt {attempt+1} failed for {label}: {e}")
+                reason = type(e).__name__
+            if attempt + 1 < self.attempts:
+                FETCH_RETRIES.inc(reason=reason)
+                time.sleep(self.__delay(attempt))
+        return None
+
+    def close(self):
+        self.session.close()
+
+    def __delay(self, attempt):
+        # "full jitter": anywhere up to the exponential bound, so retries from many workers spread out
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def __semaphore(self, host):
+        with self.__lock:
+            semaphore = self.__semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.host_limits.get(host, self.per_host))
+                self.__semaphores[host] = semaphore
+            return semaphore
+
 
-def fetch_data_range(auth_manager, pid, start_time, end_time, step):
-    params = {
-        "pid": pid,
-        "steps": [step],
-        "time_ranges": [[start_time.strftime("%Y-%m-%dT%H:%M:%SZ"), end_time.strftime("%Y-%m-%dT%H:%M:%SZ")]],
-        "delta": 15
-    }
-    # print("Params: ", params)
-    for attempt in range(2):
-        try:
-            r = requests.get(HISTORY_URL, json=params, cookies=auth_manager.cookies, timeout=15)
-            if r.status_code == 401 and attempt == 0:
-                print("Session expired, retrying auth...")
-                auth_manager.authenticate(force_new=True)
-                continue
-            r.raise_for_status()
-            # print(f"Response status code: {r.status_code}")
-            # print(f"Response content: {r.text[:800]}...")  # Print first 100 chars for brevity
-            return r.json()
-        except Exception as e:
-            print(f"Attempt {attempt+1} failed for PID {pid}: {e}")
-            if attempt == 1:
-                return None
\ No newline at end of file
+def fetch_data_range(auth_manager, pid, start_time, end_time, step, client=None):
+    if client is None:
+        client = OnPingClient(auth_manager)
+    return client.history(pid, start_time, end_time, step)
@@ -0,0 +1,81 @@
+import gzip
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class ResponseCache:
+    # History responses on disk, gzipped JSON keyed by (pid, step, window start, window end).
+    # Only closed windows are stored, i.e. ending at least settle_seconds ago, so the data in
+    # them will not change any more. Once the files exceed max_bytes the least recently used
+    # ones are evicted. enabled=False bypasses it (nothing read or written)
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, settle_seconds=3600, enabled=True):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.settle_seconds = settle_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__sizes = {}  # file name -> size, for the eviction budget
+        if enabled:
+            self.root.mkdir(parents=True, exist_ok=True)
+            for path in self.root.glob("*.json.gz"):
+                self.__sizes[path.name] = path.stat().st_size
+
+    def fetch(self, client, pid, start_time, end_time, step):
+        # client.history(...) for the window, served from disk when it was fetched before
+        closed = end_time.timestamp() <= time.time() - self.settle_seconds
+        if not (self.enabled and closed):
+            return client.history(pid, start_time, end_time, step)
+        name = f"{pid}_{step}_{int(start_time.timestamp())}_{int(end_time.timestamp())}.json.gz"
+        data = self.__read(name)
+        if data is not None:
+            return data
+        data = client.history(pid, start_time, end_time, step)
+        if data is not None:
+            self.__write(name, data)
+        return data
+
+    def __read(self, name):
+        path = self.root / name
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, EOFError, ValueError):
+            with self.__lock:
+                self.misses += 1
+            return None
+        os.utime(path)  # recently used
+        with self.__lock:
+            self.hits += 1
+        return data
+
+    def __write(self, name, data):
+        path = self.root / name
+        tmp = path.with_name(f"{name}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+        with self.__lock:
+            self.__sizes[name] = path.stat().st_size
+            if sum(self.__sizes.values()) > self.max_bytes:
+                self.__evict()
+
+    def __evict(self):
+        # least recently used first, down to 90% of the budget
+        budget = self.max_bytes * 0.9
+        total = sum(self.__sizes.values())
+        entries = []
+        for name in self.__sizes:
+            try:
+                entries.append(((self.root / name).stat().st_mtime, name))
+            except FileNotFoundError:
+                entries.append((0, name))
+        for _, name in sorted(entries):
+            if total <= budget:
+                break
+            (self.root / name).unlink(missing_ok=True)
+            total -= self.__sizes.pop(name)
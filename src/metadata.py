@@ -11,4 +11,6 @@ LOGIN_URL = f"{BASE_URL}/auth/page/plow/plowlogin"
 HISTORY_URL = f"{BASE_URL}/json/listers/parameterHistoryLister"
 
 COOKIE_FILE = "data/onping_cookies.pkl"
-WELLS_CONFIG_FILE = "config/wells-config.json"
\ No newline at end of file
+WELLS_CONFIG_FILE = "config/wells-config.json"
+FETCH_CHECKPOINT_FILE = "data/fetch-checkpoints.json"
+FETCH_CACHE_DIR = "data/fetch-cache"
\ No newline at end of file
@@ -0,0 +1,153 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Counters and histograms of the pipeline, rendered in the Prometheus text format at /metrics
+# on the query server. An update is a dict lookup and an add under a lock, so callers update
+# once per file, window, transaction or request, never per row
+
+STAGE_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.__values = {}  # label values -> count
+        self.__lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple([str(labels[label]) for label in self.labels])
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.__values.get(tuple([str(labels[label]) for label in self.labels]), 0)
+
+    def samples(self):
+        # (name suffix, {label: value}, sample value) for every label combination seen
+        with self.__lock:
+            return [("", dict(zip(self.labels, key)), value) for key, value in self.__values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.__values = {}  # label values -> [count per bucket (last one +Inf), sum, count]
+        self.__lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple([str(labels[label]) for label in self.labels])
+        with self.__lock:
+            state = self.__values.get(key)
+            if state is None:
+                state = self.__values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        # observes the wall clock time the block took, also when it raises
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.__lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self.__values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", {**labels, "le": _number(bound)}, cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class Collected:
+    # A value kept somewhere else (e.g. a cache's hit counter), read when /metrics is rendered
+    def __init__(self, name, help, kind, read):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+
+    def samples(self):
+        return [("", {}, self.read())]
+
+
+REGISTRY = {}  # name -> metric, in registration order
+
+
+def register(metric):
+    # a metric registered again under the same name replaces the old one
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+def render():
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _escape(value):
+    # label values escape backslash, double quote and newline
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bool, int)):
+        return str(int(value))
+    return repr(float(value))
+
+
+STAGE_SECONDS = register(Histogram(
+    "plunger_stage_duration_seconds",
+    "Wall clock time of pipeline stages: fetch, load, parse and join (per well), generate, commit",
+    ("stage",)))
+ROWS_PARSED = register(Counter(
+    "plunger_rows_parsed_total", "PID samples read from csv or typed sample files", ("well",)))
+CYCLES = register(Counter(
+    "plunger_cycles_total", "Closed cycles the event rules ran over"))
+EVENTS = register(Counter(
+    "plunger_events_total", "Events written, per event type", ("type",)))
+ROWS_INSERTED = register(Counter(
+    "plunger_db_rows_inserted_total", "Rows inserted into the events database, per table", ("table",)))
+FETCH_RETRIES = register(Counter(
+    "plunger_fetch_retries_total", "History requests tried again, by HTTP status or exception", ("reason",)))
+FETCH_SECONDS = register(Histogram(
+    "plunger_fetch_duration_seconds",
+    "Time to fetch one history window of a PID from OnPing (cache misses), retries included",
+    ("pid",), REQUEST_BUCKETS + (30, 60)))
+REQUEST_SECONDS = register(Histogram(
+    "plunger_http_request_duration_seconds", "Time to answer a query server request", ("endpoint",),
+    REQUEST_BUCKETS))
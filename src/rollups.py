@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+# endpoint name -> (table, bucket width in seconds). Buckets are aligned to UTC hours / days
+ROLLUPS = {
+    "hourly": ("CYCLE_ROLLUP_HOURLY", 3600),
+    "daily": ("CYCLE_ROLLUP_DAILY", 86400),
+}
+
+# Parameters: bucket start, well id, and the bucket's [start, end) on CYCLE_SUMMARY.start_time,
+# which its (well_id, start_time) index turns into a range scan
+ROLLUP_SQL = """
+INSERT OR REPLACE INTO {table} (
+    well_id, bucket_start, cycles, gas_volume, mean_arrival_speed, flow_duration, shutin_duration,
+    non_arrivals, late_arrivals, low_casing_pressure, unsafe_velocity, low_flow,
+    low_cycle_duration, high_cycle_duration
+)
+SELECT well_id, ?, count(*), total(gas_volume), avg(arrival_speed), sum(flow_duration), sum(shutin_duration),
+    sum(non_arrival), sum(late_arrival), sum(low_casing_pressure), sum(unsafe_velocity), sum(low_flow),
+    sum(low_cycle_duration), sum(high_cycle_duration)
+FROM CYCLE_SUMMARY
+WHERE well_id = ? AND start_time >= ? AND start_time < ?
+GROUP BY well_id
+"""
+
+
+def update_rollups(database, well_ids, start_times):
+    # Recomputes the hourly and daily buckets that cycles with these wells and start times
+    # fall in, inside the caller's transaction. Buckets no new cycle falls in are not touched
+    well_ids = np.asarray(well_ids, dtype=np.int64)
+    start_times = np.asarray(start_times, dtype=np.int64)
+    if len(well_ids) == 0:
+        return
+    for table, width in ROLLUPS.values():
+        buckets = np.unique(np.stack([well_ids, start_times // width * width], axis=1), axis=0)
+        database.executemany(ROLLUP_SQL.format(table=table),
+                             [(int(start), int(well), int(start), int(start) + width) for well, start in buckets])
+
+
+def rollup_query(name, params):
+    # (SELECT, parameters) for GET /rollups/<name>?well_id=&start=&end=, each filter optional.
+    # start and end are epoch seconds or ISO times (UTC unless an offset is given) and select
+    # the buckets starting in [start, end)
+    table, _ = ROLLUPS[name]
+    conditions, args = [], []
+    if "well_id" in params:
+        try:
+            args.append(int(params["well_id"][-1]))
+        except ValueError:
+            raise ValueError("well_id must be a whole number") from None
+        conditions.append("well_id = ?")
+    for param, condition in (("start", "bucket_start >= ?"), ("end", "bucket_start < ?")):
+        if param in params:
+            args.append(parse_time(params[param][-1]))
+            conditions.append(condition)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT * FROM {table}{where} ORDER BY well_id, bucket_start", tuple(args)
+
+
+def parse_time(value):
+    # epoch seconds from epoch seconds or an ISO time (UTC unless an offset is given)
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Cannot read {value} as epoch seconds or an ISO time") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
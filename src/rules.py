@@ -0,0 +1,245 @@
+import json
+
+import numpy as np
+
+# the per-cycle features rules read (see cycle_features in src/events_generator.py)
+FEATURE_COLUMNS = [
+    'well_id', 'cycle_id', 'start_time', 'end_time',
+    'pt_first', 'pt_last', 'cp_first', 'cp_last', 'pl_first', 'pl_last',
+    'flow_duration', 'shutin_duration', 'mean_flow_rate', 'mean_arrival_speed', 'max_non_arrival_count',
+    'min_arrival_time_remaining',
+    'delta_pt', 'delta_cp', 'delta_pl', 'total_duration', 'gas_volume', 'non_arrival',
+]
+
+
+class Rule:
+    # One event type. `name` is the EVENTS column that links its rows, `table` the table they
+    # go to. `inputs` are the cycle feature columns it reads, `depends` the rules whose events
+    # it needs (it only fires for cycles where they all fired) and `optional` rules it reads
+    # when present. `thresholds` maps parameter name -> default, overridable per well.
+    # `evaluate(cycles, deps, params)` runs once over all cycles and returns
+    # (fired mask or None for every cycle, {column: array of values for every cycle}).
+    # A feature is NaN when the cycle had no sample of its PID (or the well has no such PID);
+    # rules storing it in a NOT NULL column do not fire then, threshold rules never fire on it.
+    # Inputs are checked against FEATURE_COLUMNS here, so a misspelt one fails when the rule
+    # is defined rather than halfway through the events transaction
+    __slots__ = ('name', 'table', 'inputs', 'depends', 'optional', 'thresholds', 'evaluate')
+
+    def __init__(self, name, table, evaluate, inputs=(), depends=(), optional=(), thresholds=None):
+        self.name = name
+        self.table = table
+        self.evaluate = evaluate
+        self.inputs = tuple(inputs)
+        unknown = [column for column in self.inputs if column not in FEATURE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Rule {name} reads unknown cycle features {', '.join(unknown)}")
+        self.depends = tuple(depends)
+        self.optional = tuple(optional)
+        self.thresholds = dict(thresholds or {})
+
+
+class RuleResult:
+    # What a rule produced over all cycles: which cycles fired, the ids of their rows
+    # (0 where it did not fire) and the values as stored
+    __slots__ = ('fired', 'ids', 'values')
+
+    def __init__(self, fired, ids, values):
+        self.fired = fired
+        self.ids = ids
+        self.values = values
+
+    def refs(self):
+        # ids as a foreign key column, NULL where the rule did not fire
+        return np.where(self.fired, self.ids, None)
+
+
+RULES = []  # built-in rules, in registration order
+
+
+def rule(name, table, inputs=(), depends=(), optional=(), thresholds=None):
+    # Registers the decorated function as the evaluate step of a new rule
+    def register(evaluate):
+        if any(existing.name == name for existing in RULES):
+            raise ValueError(f"Rule {name} is already registered")
+        RULES.append(Rule(name, table, evaluate, inputs, depends, optional, thresholds))
+        return evaluate
+    return register
+
+
+def order_rules(rules):
+    # Dependencies first, otherwise registration order
+    by_name = {r.name: r for r in rules}
+    for r in rules:
+        for dep in r.depends + r.optional:
+            if dep not in by_name:
+                raise ValueError(f"Rule {r.name} depends on unknown rule {dep}")
+    ordered, done = [], set()
+    remaining = list(rules)
+    while remaining:
+        ready = [r for r in remaining if all(dep in done for dep in r.depends + r.optional)]
+        if not ready:
+            raise ValueError(f"Circular rule dependencies between {', '.join(r.name for r in remaining)}")
+        for r in ready:
+            ordered.append(r)
+            done.add(r.name)
+        remaining = [r for r in remaining if r.name not in done]
+    return ordered
+
+
+def load_thresholds(config_file):
+    # {well_id: {parameter: value}} from the wells config. A parameter set on the well
+    # (like arrival_time_remaining_threshold) wins over the config-wide "event_thresholds",
+    # which wins over the rule's default
+    with open(config_file, "r") as f:
+        config = json.load(f)
+    shared = config.get("event_thresholds", {})
+    return {well["id"]: {**shared, **well} for well in config.get("wells", [])}
+
+
+def run_rules(rules, cycles, thresholds, database):
+    # Evaluates every rule across all cycles at once, in dependency order, and bulk inserts
+    # the events that fired. Returns {rule name: RuleResult}
+    n = len(cycles)
+    well_ids, well_index = np.unique(cycles['well_id'].to_numpy(dtype=np.int64), return_inverse=True)
+    results = {}
+    for r in order_rules(rules):
+        params = {
+            param: np.array([thresholds.get(int(w), {}).get(param, default) for w in well_ids],
+                            dtype=np.float64)[well_index]
+            for param, default in r.thresholds.items()
+        }
+        deps = {dep: results[dep] for dep in r.depends + r.optional}
+        fired, values = r.evaluate(cycles, deps, params)
+        fired = np.ones(n, dtype=bool) if fired is None else np.asarray(fired, dtype=bool)
+        for dep in r.depends:
+            fired = fired & results[dep].fired
+
+        rows = np.flatnonzero(fired)
+        ids = np.zeros(n, dtype=np.int64)
+        if len(rows):
+            ids[rows] = database.insertEvents(
+                r.table, {column: np.asarray(array)[rows].tolist() for column, array in values.items()}
+            )
+        results[r.name] = RuleResult(fired, ids, values)
+    return results
+
+
+# == Basic Events ==
+
+@rule('basic_pressure_event', 'BASIC_PRESSURE_EVENTS',
+      inputs=('delta_pt', 'delta_cp', 'delta_pl'),
+      thresholds={'specific_gravity': 0.6, 'liquid_height': 1000})
+def basic_pressure(cycles, deps, params):
+    # hydrostatic head of the liquid column
+    ph = 0.433 * params['specific_gravity'] * params['liquid_height']
+    deltas = {column: np.round(cycles[column].to_numpy(dtype=np.float64), 3)
+              for column in ('delta_pt', 'delta_cp', 'delta_pl')}
+    # only cycles with all three pressures
+    known = np.isfinite(deltas['delta_pt']) & np.isfinite(deltas['delta_cp']) & np.isfinite(deltas['delta_pl'])
+    return known, {**deltas, 'ph': np.round(ph, 3)}
+
+
+@rule('cycle_duration_event', 'CYCLE_DURATION_EVENTS',
+      inputs=('start_time', 'end_time', 'total_duration', 'flow_duration', 'shutin_duration'))
+def cycle_duration(cycles, deps, params):
+    # flow duration spans the rows with flow_rate > 0, shutin duration those with flow_rate == 0
+    return None, {
+        column: cycles[column].to_numpy(dtype=np.int64)
+        for column in ('start_time', 'end_time', 'total_duration', 'flow_duration', 'shutin_duration')
+    }
+
+
+@rule('plunger_arrival_velocity_event', 'PLUNGER_ARRIVAL_VELOCITY_EVENTS',
+      inputs=('mean_arrival_speed',))
+def plunger_arrival_velocity(cycles, deps, params):
+    speed = np.round(cycles['mean_arrival_speed'].to_numpy(dtype=np.float64), 3)  # m/s
+    # no event for cycles without a single arrival speed sample
+    return np.isfinite(speed), {'arrival_speed': speed}
+
+
+# == Complex Events ==
+
+@rule('gas_volume_produced_event', 'GAS_VOLUME_PRODUCED_EVENTS',
+      inputs=('gas_volume',), depends=('cycle_duration_event',))
+def gas_volume_produced(cycles, deps, params):
+    gas_volume = np.round(cycles['gas_volume'].to_numpy(dtype=np.float64), 3)  # m³
+    return np.isfinite(gas_volume), {
+        'gas_volume': gas_volume,
+        'cycle_duration_event': deps['cycle_duration_event'].ids,
+    }
+
+
+@rule('unexpected_low_casing_pressure', 'UNEXPECTED_LOW_CASING_PRESSURE_EVENTS',
+      depends=('basic_pressure_event',), thresholds={'min_delta_cp': -5.0})
+def unexpected_low_casing_pressure(cycles, deps, params):
+    basic_pressure = deps['basic_pressure_event']
+    delta_cp = basic_pressure.values['delta_cp']
+    return np.isfinite(delta_cp) & (delta_cp < params['min_delta_cp']), {
+        'basic_pressure_event': basic_pressure.ids,
+    }
+
+
+@rule('plunger_arrival_status_event', 'PLUNGER_ARRIVAL_STATUS_EVENTS',
+      inputs=('non_arrival', 'max_non_arrival_count', 'min_arrival_time_remaining'),
+      optional=('unexpected_low_casing_pressure',),
+      thresholds={'arrival_time_remaining_threshold': 30})
+def plunger_arrival_status(cycles, deps, params):
+    # non_arrival: the Current Non-Arrival Count went above 0 during the cycle.
+    # late_arrival: the plunger did arrive, but with less than the threshold left on the
+    # controller's Arrival Time Remaining countdown. Cycles without a Non-Arrival Count sample
+    # get no status; without a countdown sample an arrival is not called late
+    non_arrival = cycles['non_arrival'].to_numpy(dtype=bool)
+    remaining = cycles['min_arrival_time_remaining'].to_numpy(dtype=np.float64)
+    low_casing_pressure = deps['unexpected_low_casing_pressure']
+    return ~np.isnan(cycles['max_non_arrival_count'].to_numpy(dtype=np.float64)), {
+        'non_arrival': non_arrival,
+        'late_arrival': ~non_arrival & np.isfinite(remaining) & (remaining < params['arrival_time_remaining_threshold']),
+        'unexpected_casing_pressure': low_casing_pressure.fired,
+        'unexpected_low_casing_pressure': low_casing_pressure.refs(),
+    }
+
+
+@rule('plunger_unsafe_velocity_event', 'PLUNGER_UNSAFE_VELOCITY_EVENTS',
+      depends=('plunger_arrival_velocity_event',), thresholds={'max_arrival_speed': 2.5})
+def plunger_unsafe_velocity(cycles, deps, params):
+    velocity = deps['plunger_arrival_velocity_event']
+    speed = velocity.values['arrival_speed']
+    return np.isfinite(speed) & (speed > params['max_arrival_speed']), {
+        'velocity_event': velocity.ids,
+    }
+
+
+@rule('unexpected_low_flow', 'UNEXPECTED_LOW_FLOW_EVENTS',
+      depends=('gas_volume_produced_event',), thresholds={'min_gas_volume': 10.0})
+def unexpected_low_flow(cycles, deps, params):
+    gas_volume = deps['gas_volume_produced_event']
+    volume = gas_volume.values['gas_volume']
+    return np.isfinite(volume) & (volume < params['min_gas_volume']), {
+        'gas_volume_produced_event': gas_volume.ids,
+    }
+
+
+@rule('unexpected_low_cycle_duration', 'UNEXPECTED_LOW_CYCLE_DURATION_EVENTS',
+      depends=('cycle_duration_event',),
+      thresholds={'min_total_duration': 600, 'min_flow_duration': 300, 'min_shutin_duration': 300})
+def unexpected_low_cycle_duration(cycles, deps, params):
+    durations = deps['cycle_duration_event']
+    is_short = (
+        (durations.values['total_duration'] < params['min_total_duration']) |
+        (durations.values['flow_duration'] < params['min_flow_duration']) |
+        (durations.values['shutin_duration'] < params['min_shutin_duration'])
+    )
+    return is_short, {'cycle_duration_event': durations.ids}
+
+
+@rule('unexpected_high_cycle_duration', 'UNEXPECTED_HIGH_CYCLE_DURATION_EVENTS',
+      depends=('cycle_duration_event',),
+      thresholds={'max_total_duration': 7200, 'max_flow_duration': 3600, 'max_shutin_duration': 3600})
+def unexpected_high_cycle_duration(cycles, deps, params):
+    durations = deps['cycle_duration_event']
+    is_long = (
+        (durations.values['total_duration'] > params['max_total_duration']) |
+        (durations.values['flow_duration'] > params['max_flow_duration']) |
+        (durations.values['shutin_duration'] > params['max_shutin_duration'])
+    )
+    return is_long, {'cycle_duration_event': durations.ids}
@@ -0,0 +1,162 @@
+import csv
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 86400
+SAMPLES_SUFFIX = ".samples"  # "<pid name>.samples/" next to (or instead of) "<pid name>.csv"
+SAMPLE_DTYPE = np.dtype([("time", "<i8"), ("val", "<f8")])
+
+
+class SampleSink:
+    # Collects fetched samples per well/PID and writes them in large batches, into the PID's
+    # typed day partitions (sample_format="npy"), which the loader reads without parsing text
+    # and which cost only the days a flush touches, or appended to the PID's csv (for tools
+    # that read the csvs; see append_csv for its cost). Timestamps already on disk are not
+    # written again, so overlapping fetch windows do not duplicate rows, and every file is
+    # replaced atomically. A PID switching to npy has its csv history imported once
+    def __init__(self, data_folder, sample_format="npy", flush_rows=200000):
+        if sample_format not in ("csv", "npy"):
+            raise ValueError(f"Unknown sample format: {sample_format}")
+        self.data_folder = Path(data_folder)
+        self.sample_format = sample_format
+        self.flush_rows = flush_rows
+        self.__buffers = {}  # (well name, pid name) -> list of fetched rows
+
+    def add(self, well_name, pid_name, data):
+        buffer = self.__buffers.setdefault((well_name, pid_name), [])
+        buffer.extend(data)
+        if len(buffer) >= self.flush_rows:
+            self.flush(well_name, pid_name)
+
+    def buffered(self, well_name, pid_name):
+        return len(self.__buffers.get((well_name, pid_name), ()))
+
+    def flush(self, well_name=None, pid_name=None):
+        # Writes the buffered rows of one PID, or of every PID when none is given
+        keys = list(self.__buffers) if well_name is None else [(well_name, pid_name)]
+        for key in keys:
+            data = self.__buffers.pop(key, None)
+            if not data:
+                continue
+            well_dir = self.data_folder / key[0]
+            well_dir.mkdir(parents=True, exist_ok=True)
+            if self.sample_format == "csv":
+                written = append_csv(well_dir / f"{key[1]}.csv", data)
+            else:
+                samples_dir = well_dir / f"{key[1]}{SAMPLES_SUFFIX}"
+                if not samples_dir.exists() and (well_dir / f"{key[1]}.csv").exists():
+                    _import_csv(well_dir / f"{key[1]}.csv", samples_dir)
+                written = write_samples(samples_dir, *_parse_rows(data)[:2])
+            print(f"Saved {written} rows to {key[0]}/{key[1]}")
+
+
+def _parse_rows(data):
+    # [{"time": ISO string, "val": reading}, ...] -> (epoch seconds, values, ISO strings), in
+    # time order with one row per timestamp (the first) and unreadable rows dropped
+    return _parse_columns(pd.Series([item.get("time") for item in data], dtype=object),
+                          pd.Series([item.get("val") for item in data], dtype=object))
+
+
+def _parse_columns(iso, raw_values):
+    values = pd.to_numeric(raw_values, errors="coerce").to_numpy(dtype=np.float64)
+    parsed = pd.to_datetime(iso, format="ISO8601", utc=True, errors="coerce")
+    valid = ~parsed.isna().to_numpy() & ~np.isnan(values)
+    times = parsed[valid].dt.tz_localize(None).to_numpy(dtype="datetime64[s]").astype(np.int64)
+    times, first = np.unique(times, return_index=True)
+    return times, values[valid][first], iso[valid].to_numpy()[first]
+
+
+def _last_csv_time(file_path):
+    # epoch seconds of the newest row of a sample csv, None when it has no rows
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 4096, 0))
+        lines = f.read().splitlines()
+    for line in reversed(lines):
+        timestamp = line.split(b",", 1)[0].decode(errors="ignore")
+        parsed = pd.to_datetime(timestamp, format="ISO8601", utc=True, errors="coerce")
+        if not pd.isna(parsed):
+            return int(parsed.timestamp())
+    return None
+
+
+def append_csv(file_path, data):
+    # Appends the rows newer than the file's last one. The file is copied, appended to and
+    # renamed over the original, so readers never see a partial write, which makes every call
+    # cost the whole file: the fetcher's default sink writes typed samples instead. Returns the
+    # rows written
+    file_path = Path(file_path)
+    times, values, iso = _parse_rows(data)
+    if file_path.exists():
+        last = _last_csv_time(file_path)
+        if last is not None:
+            newer = times > last
+            times, values, iso = times[newer], values[newer], iso[newer]
+    if len(times) == 0:
+        return 0
+
+    tmp = file_path.with_name(file_path.name + ".tmp")
+    if file_path.exists():
+        shutil.copyfile(file_path, tmp)
+    else:
+        with open(tmp, "w", newline="") as f:
+            csv.writer(f).writerow(["timestamp", "val"])
+    with open(tmp, "a", newline="", buffering=1 << 20) as f:
+        csv.writer(f).writerows(zip(iso, values.tolist()))
+    os.replace(tmp, file_path)
+    return len(times)
+
+
+def write_samples(samples_dir, times, values):
+    # Merges (times, values) into the day partitions of a typed sample directory; samples at
+    # an already stored timestamp keep the stored value. Returns the rows added
+    samples_dir = Path(samples_dir)
+    samples_dir.mkdir(parents=True, exist_ok=True)
+    added = 0
+    days = times // SECONDS_PER_DAY
+    bounds = np.flatnonzero(np.diff(days)) + 1
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(times)]):
+        if lo == hi:
+            continue
+        target = samples_dir / f"{np.datetime64(int(days[lo]), 'D')}.npy"
+        new = np.empty(hi - lo, dtype=SAMPLE_DTYPE)
+        new["time"] = times[lo:hi]
+        new["val"] = values[lo:hi]
+        stored = np.load(target) if target.exists() else np.empty(0, dtype=SAMPLE_DTYPE)
+        merged = np.concatenate([stored, new])
+        _, first = np.unique(merged["time"], return_index=True)
+        added += len(first) - len(stored)
+        tmp = target.with_name(target.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, merged[first])
+        os.replace(tmp, target)
+    return added
+
+
+def read_samples(samples_dir, since=None):
+    # (times, values) of a typed sample directory in time order, only samples at or after
+    # `since` (epoch seconds) when given; older days are not opened at all
+    parts = []
+    for path in sorted(Path(samples_dir).glob("*.npy")):
+        day = int(np.datetime64(path.stem, "D").astype(np.int64))
+        if since is not None and (day + 1) * SECONDS_PER_DAY <= since:
+            continue
+        parts.append(np.load(path))
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    samples = np.concatenate(parts)
+    if since is not None:
+        samples = samples[samples["time"] >= since]
+    return samples["time"].copy(), samples["val"].copy()
+
+
+def _import_csv(file_path, samples_dir):
+    # One-off conversion of a PID's existing csv history when it switches to typed samples
+    raw = pd.read_csv(file_path, usecols=[0, 1], header=0, names=["time", "val"], dtype=str,
+                      on_bad_lines="skip")
+    times, values, _ = _parse_columns(raw["time"], raw["val"])
+    write_samples(samples_dir, times, values)
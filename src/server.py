@@ -0,0 +1,555 @@
+import base64
+import gzip
+import hashlib
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from urllib.parse import parse_qs, urlsplit
+
+from . import metrics
+from .database import check_select, stream_query
+from .rollups import ROLLUPS, parse_time, rollup_query
+from .store import ColumnStore, bucket_stats, lttb
+
+POOL_SIZE = 4
+CACHE_BYTES = 64 * 1024 * 1024
+MAX_PAGE_ROWS = 10000  # largest ?limit= a page may ask for
+CHUNK_BYTES = 64 * 1024
+QUERY_TIMEOUT_SECONDS = 5.0  # wall clock a query may run before it is interrupted
+POOL_WAIT_SECONDS = 30.0     # how long a request may wait for a free connection before a 503
+MAX_ROWS = 50000             # rows an unpaged query may return, None for no limit
+PROGRESS_STEPS = 10000       # SQLite VM instructions between deadline checks
+DEFAULT_POINTS = 1000        # /timeseries buckets or points per column unless ?points= says otherwise
+MAX_POINTS = 10000
+
+# Authorizer actions a pooled connection may perform; anything else is refused while the
+# statement is prepared, on top of the connection being opened read-only
+READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+
+def _authorize(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+class QueryRejected(Exception):
+    # A query refused for what it would cost, answered with its status and message
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Deadline:
+    # Progress handler: a non-zero return makes SQLite interrupt the running statement
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds
+
+    def __call__(self):
+        return self.expired()
+
+    def expired(self):
+        return time.monotonic() > self.at
+
+
+class ReadOnlyPool:
+    # A fixed set of read-only connections to the events database, opened once and handed
+    # out one request at a time. The database is in WAL mode (see Database), so readers see
+    # the last committed state and never wait for, or hold up, the events generator
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        # Only ever asked for PRAGMA data_version, which changes on every commit made through
+        # another connection: the events generator's, since the pool itself cannot write
+        self.__probe = self.__connect()
+        self.__probe_lock = threading.Lock()
+        self.__idle = queue.Queue()
+        for _ in range(size):
+            self.__idle.put(self.__connect_guarded())
+
+    def __connect(self):
+        connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        connection.execute("PRAGMA query_only=ON")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute("PRAGMA cache_size=-32000")      # 32 MB page cache per connection
+        connection.execute("PRAGMA mmap_size=268435456")    # read pages through a 256 MB mapping
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    def __connect_guarded(self):
+        connection = self.__connect()
+        connection.set_authorizer(_authorize)
+        return connection
+
+    def data_version(self):
+        # Read before running a query, its result is at least as new as the returned version
+        with self.__probe_lock:
+            return self.__probe.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def connection(self, timeout=None, wait=None):
+        # (connection, Deadline or None). The deadline starts once a connection is free, so
+        # time spent queued behind other requests does not count against the query's timeout;
+        # the queueing itself is bounded by `wait` seconds, after which None is yielded
+        try:
+            connection = self.__idle.get(timeout=wait)
+        except queue.Empty:
+            yield None
+            return
+        deadline = Deadline(timeout) if timeout else None
+        if deadline is not None:
+            connection.set_progress_handler(deadline, PROGRESS_STEPS)
+        try:
+            yield connection, deadline
+        finally:
+            connection.set_progress_handler(None, 0)
+            self.__idle.put(connection)
+
+    def close(self):
+        for _ in range(self.size):
+            self.__idle.get().close()
+        self.__probe.close()
+
+
+class ResultCache:
+    # Encoded responses (body as sent, extra headers) keyed on (request, database version), least
+    # recently used evicted first once the bodies take more than max_bytes. Entries of older
+    # versions are dropped as soon as a newer version is seen
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self.__entries = OrderedDict()
+        self.__version = 0
+        self.__lock = threading.Lock()
+
+    def get(self, query, version):
+        with self.__lock:
+            entry = self.__entries.get((query, version))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end((query, version))
+            self.hits += 1
+            return entry
+
+    def entry_limit(self):
+        # bytes a single body may take; one huge result would flush everything else
+        return self.max_bytes // 4
+
+    def put(self, query, version, body, headers=None):
+        if len(body) > self.entry_limit():
+            return
+        with self.__lock:
+            if version < self.__version:
+                return
+            if version > self.__version:
+                self.__entries.clear()
+                self.size = 0
+                self.__version = version
+            old = self.__entries.pop((query, version), None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.__entries[(query, version)] = (body, headers or {})
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.__entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.__entries), "bytes": self.size}
+
+
+def normalize_query(query):
+    # Same statement modulo whitespace and a trailing semicolon; quoted text is left alone
+    parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""", query)
+    normalized = "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts))
+    return normalized.strip().rstrip(";").rstrip()
+
+
+class RowEncoder:
+    # How rows are written out for ?format=: "json" is the original list of objects,
+    # "ndjson" one object per line, "columns" sends the column names once and then the rows
+    # as arrays: {"columns": [...], "rows": [[...], ...]}
+    FORMATS = {"json": "application/json", "ndjson": "application/x-ndjson", "columns": "application/json"}
+
+    def __init__(self, format, columns):
+        self.format = format
+        self.columns = columns
+        self.content_type = self.FORMATS[format]
+        self.__first = True
+
+    def head(self):
+        if self.format == "json":
+            return b"["
+        if self.format == "columns":
+            return b'{"columns": ' + json.dumps(self.columns).encode() + b', "rows": ['
+        return b""
+
+    def rows(self, rows):
+        if self.format == "ndjson":
+            return "".join(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows).encode()
+        if self.format == "json":
+            encoded = ", ".join(json.dumps(dict(zip(self.columns, row))) for row in rows)
+        else:
+            encoded = ", ".join(json.dumps(list(row)) for row in rows)
+        if encoded and not self.__first:
+            encoded = ", " + encoded
+        self.__first = self.__first and not encoded
+        return encoded.encode()
+
+    def tail(self):
+        return {"json": b"]", "columns": b"]}"}.get(self.format, b"")
+
+
+class Page:
+    # Keyset pagination: ?limit=N&key=<column> returns the first N rows ordered by that column,
+    # which has to be unique and not null, and an opaque token in the X-Next-Cursor header
+    # while more rows follow. Sending it back as &cursor= continues after the last row seen
+    def __init__(self, query, params, max_limit=MAX_PAGE_ROWS):
+        try:
+            self.limit = int(params["limit"][-1])
+        except ValueError:
+            raise ValueError("limit must be a whole number") from None
+        if not 0 < self.limit <= max_limit:
+            raise ValueError(f"limit must be between 1 and {max_limit}")
+        if "key" not in params:
+            raise ValueError("Paging needs key=<column> to order the rows by")
+        self.key = params["key"][-1]
+        self.__scope = hashlib.sha1(f"{self.key}\0{query}".encode()).hexdigest()[:16]
+        self.token = params.get("cursor", [None])[-1]
+        self.after = self.__decode(self.token) if self.token else None
+
+        quoted = '"' + self.key.replace('"', '""') + '"'
+        where = f"WHERE {quoted} > ? " if self.token else ""
+        self.query = f"SELECT * FROM ({query}) {where}ORDER BY {quoted} LIMIT ?"
+        self.params = (self.after, self.limit + 1) if self.token else (self.limit + 1,)
+
+    def next_token(self, columns, rows):
+        # rows holds up to limit + 1 rows; the extra one only tells that another page exists
+        if self.key not in columns:
+            # SQLite reads an unknown "name" as a string, so this is the only place to catch it
+            raise ValueError(f"key {self.key} is not a column of the query")
+        if len(rows) <= self.limit:
+            return None
+        last = rows[self.limit - 1][columns.index(self.key)]
+        payload = json.dumps({"s": self.__scope, "a": last}).encode()
+        return base64.urlsafe_b64encode(payload).rstrip(b"=").decode()
+
+    def __decode(self, token):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            scope, after = payload["s"], payload["a"]
+        except Exception:
+            raise ValueError("Invalid cursor") from None
+        if scope != self.__scope:
+            raise ValueError("Cursor belongs to a different query")
+        return after
+
+
+class ChunkedWriter:
+    # Writes a response body with chunked transfer encoding, gzipped on the fly when asked.
+    # Keeps a copy of the body as sent (so gzipped when compressing) for the result cache
+    # while it stays under keep_bytes
+    def __init__(self, wfile, compress, keep_bytes):
+        self.wfile = wfile
+        self.keep_bytes = keep_bytes
+        self.kept = []  # None once the body outgrew keep_bytes
+        self.__kept_size = 0
+        self.__gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.__pending = []
+        self.__pending_size = 0
+
+    def write(self, data):
+        if self.__gzip:
+            data = self.__gzip.compress(data)
+        self.__keep(data)
+        self.__pending.append(data)
+        self.__pending_size += len(data)
+        if self.__pending_size >= CHUNK_BYTES:
+            self.__flush()
+
+    def finish(self):
+        # ends the body (the gzip trailer) without sending the last chunk, so kept is complete
+        if self.__gzip:
+            data = self.__gzip.flush()
+            self.__gzip = None
+            self.__keep(data)
+            self.__pending.append(data)
+
+    def close(self):
+        self.finish()
+        self.__flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def __keep(self, data):
+        if self.kept is not None:
+            self.__kept_size += len(data)
+            if self.__kept_size <= self.keep_bytes:
+                self.kept.append(data)
+            else:
+                self.kept = None
+
+    def __flush(self):
+        data = b"".join(self.__pending)
+        self.__pending = []
+        self.__pending_size = 0
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # POST a SELECT statement as the body, get its rows back. The rows are streamed from the
+    # cursor as they are read, see RowEncoder for ?format= and Page for ?limit=&key=&cursor=.
+    # Queries running past the server's query_timeout are stopped (422), ones returning more
+    # than max_rows rows are refused (413) and anything that is not a read gets a 403. A
+    # request that finds every pooled connection busy for pool_wait seconds gets a 503.
+    # GET /rollups/hourly and /rollups/daily return the per-well rollups, see rollup_query,
+    # and GET /timeseries the processed samples downsampled, see __timeseries
+    protocol_version = 'HTTP/1.1'
+    # responses go out as several small writes (headers, chunks); with Nagle on, a kept-alive
+    # client's delayed ACK would hold each one back by ~40 ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        endpoint = path[1:] if path in ('/metrics', '/timeseries') else \
+            'rollups' if path.startswith('/rollups/') else 'unknown'
+        with metrics.REQUEST_SECONDS.time(endpoint=endpoint):
+            self.__get(url)
+
+    def do_POST(self):
+        with metrics.REQUEST_SECONDS.time(endpoint='query'):
+            self.__post()
+
+    def __get(self, url):
+        if url.path.rstrip('/') == '/metrics':
+            self.__reply(200, metrics.render().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        if url.path.rstrip('/') == '/timeseries':
+            self.__timeseries(parse_qs(url.query))
+            return
+        name = url.path.rstrip('/').removeprefix('/rollups/')
+        if name not in ROLLUPS:
+            self.__reply(404, f"Unknown endpoint {url.path}".encode())
+            return
+        params = parse_qs(url.query)
+        format = params.get('format', ['json'])[-1]
+        if format not in RowEncoder.FORMATS:
+            self.__reply(400, f"Unknown format {format}, use one of {', '.join(RowEncoder.FORMATS)}".encode())
+            return
+        try:
+            query, args = rollup_query(name, params)
+        except ValueError as ve:
+            self.__reply(400, str(ve).encode())
+            return
+        self.__answer(query, args, format, None, f"{format} {args}\n{query}")
+
+    def __post(self):
+        content_length = int(self.headers.get('Content-Length', 0))
+        post_data = self.rfile.read(content_length)
+        query = normalize_query(post_data.decode())
+        if not query:
+            self.__reply(400, b'Missing query in request body')
+            return
+        params = parse_qs(urlsplit(self.path).query)
+        format = params.get('format', ['json'])[-1]
+        if format not in RowEncoder.FORMATS:
+            self.__reply(400, f"Unknown format {format}, use one of {', '.join(RowEncoder.FORMATS)}".encode())
+            return
+        try:
+            check_select(query)
+            page = Page(query, params, min(MAX_PAGE_ROWS, self.server.max_rows or MAX_PAGE_ROWS)) \
+                if 'limit' in params else None
+        except ValueError as ve:
+            self.__reply(400, str(ve).encode())
+            return
+        key = query if format == 'json' and page is None else \
+            f"{format} {page and (page.limit, page.key, page.token)}\n{query}"
+        self.__answer(query, (), format, page, key)
+
+    def __timeseries(self, params):
+        # ?well_id=&column=<name>[&column=...]&start=&end=&points=&mode=buckets|lttb.
+        # buckets: min/max/mean/count per time bucket, `points` buckets over [start, end].
+        # lttb: `points` samples picked to keep the line's shape. start and end default to
+        # the first and last stored sample
+        store = self.server.store
+        if store is None:
+            self.__reply(404, b'No sample store configured')
+            return
+        try:
+            if 'well_id' not in params or 'column' not in params:
+                raise ValueError("well_id and at least one column are required")
+            try:
+                well_id = int(params['well_id'][-1])
+                points = int(params.get('points', [DEFAULT_POINTS])[-1])
+            except ValueError:
+                raise ValueError("well_id and points must be whole numbers") from None
+            if not 0 < points <= MAX_POINTS:
+                raise ValueError(f"points must be between 1 and {MAX_POINTS}")
+            mode = params.get('mode', ['buckets'])[-1]
+            if mode not in ('buckets', 'lttb'):
+                raise ValueError(f"Unknown mode {mode}, use buckets or lttb")
+            if mode == 'lttb' and points < 3:
+                raise ValueError("lttb needs at least 3 points, the first and last sample and one between")
+            stored = store.columns(well_id)
+            unknown = [column for column in params['column'] if column not in stored or column == 'isotime']
+            if unknown:
+                raise ValueError(f"Well {well_id} has no column {', '.join(unknown)}")
+            start = parse_time(params['start'][-1]) if 'start' in params else None
+            end = parse_time(params['end'][-1]) if 'end' in params else None
+        except ValueError as ve:
+            self.__reply(400, str(ve).encode())
+            return
+
+        series = {}
+        times, columns = store.series(well_id, params['column'], start, end)
+        for column, values in columns.items():
+            if mode == 'lttb':
+                picked_times, picked = lttb(times, values, points)
+                series[column] = {'time': picked_times.tolist(), 'value': picked.tolist()}
+            elif len(times):
+                width, stats = bucket_stats(times, values, int(times[0]) if start is None else start,
+                                            int(times[-1]) if end is None else end, points)
+                series[column] = {'width': width, **{name: array.tolist() for name, array in stats.items()}}
+            else:
+                series[column] = {'width': None, 'time': [], 'min': [], 'max': [], 'mean': [], 'count': []}
+        body = json.dumps({'well_id': well_id, 'mode': mode, 'series': series}).encode()
+        self.__reply(200, body, 'application/json', compress='gzip' in self.headers.get('Accept-Encoding', ''))
+
+    def __answer(self, query, args, format, page, key):
+        # Runs the query (or its page) and streams the rows back, through the result cache
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        cache = self.server.cache
+        # gzipped and plain bodies are cached apart, a hit is sent as stored
+        key = (key, 'gzip' if compress else 'identity')
+        version = self.server.pool.data_version()
+        cached = cache.get(key, version)
+        if cached is not None:
+            body, headers = cached
+            self.__reply(200, body, RowEncoder.FORMATS[format], {**headers, 'X-Cache': 'hit'}, gzipped=compress)
+            return
+
+        max_rows = self.server.max_rows
+        with self.server.pool.connection(self.server.query_timeout, self.server.pool_wait) as pooled:
+            if pooled is None:
+                message = f"All {self.server.pool.size} database connections stayed busy for " \
+                          f"{self.server.pool_wait:g} s, try again later"
+                self.__reply(503, message.encode(), headers={'Retry-After': '1'})
+                return
+            connection, deadline = pooled
+            try:
+                # everything up to the first batch of rows can still fail with a proper status;
+                # with a row cap that is the whole result, so it is known to fit before sending
+                if page is None:
+                    columns, rows = stream_query(connection.cursor(), query, args)
+                    first = list(islice(rows, max_rows + 1 if max_rows else 1000))
+                    if max_rows and len(first) > max_rows:
+                        raise QueryRejected(413, f"Query returns more than {max_rows} rows, "
+                                                 f"page through it with ?limit=&key=")
+                    headers = {}
+                else:
+                    columns, rows = stream_query(connection.cursor(), page.query, page.params)
+                    first = list(rows)
+                    token = page.next_token(columns, first)
+                    first = first[:page.limit]
+                    headers = {'X-Next-Cursor': token} if token else {}
+                encoder = RowEncoder(format, columns)
+                encoded = encoder.rows(first)
+            except QueryRejected as e:
+                self.__reply(e.status, str(e).encode())
+                return
+            except ValueError as ve:
+                self.__reply(400, str(ve).encode())
+                return
+            except sqlite3.DatabaseError as e:
+                if deadline is not None and deadline.expired():
+                    self.__reply(422, f"Query ran longer than {deadline.seconds:g} s and was stopped".encode())
+                elif str(e) == "not authorized":
+                    self.__reply(403, b'Only statements that read the database are allowed')
+                else:
+                    self.__reply(400, str(e).encode())
+                return
+            except Exception:
+                self.__reply(500, b'Database query failed or returned None')
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', encoder.content_type)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.__send_headers({**headers, 'X-Cache': 'miss'}, compress)
+            writer = ChunkedWriter(self.wfile, compress, cache.entry_limit())
+            try:
+                writer.write(encoder.head())
+                writer.write(encoded)
+                if page is None:
+                    while batch := list(islice(rows, 1000)):
+                        writer.write(encoder.rows(batch))
+                writer.write(encoder.tail())
+                writer.finish()
+                # cached before the last chunk goes out, so the client's next request can hit it
+                if writer.kept is not None:
+                    cache.put(key, version, b"".join(writer.kept), headers)
+                writer.close()
+            except Exception as e:
+                # the status is already sent, so cut the response short instead
+                print(f"Query failed while streaming its rows: {e}")
+                self.close_connection = True
+                return
+
+    def __reply(self, status, body, content_type=None, headers=None, compress=False, gzipped=False):
+        # compress gzips the body (of a 200), gzipped says it already is
+        if compress and status == 200:
+            body = gzip.compress(body, 6)
+            gzipped = True
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.__send_headers(headers or {}, gzipped)
+        self.wfile.write(body)
+
+    def __send_headers(self, headers, compressed):
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+
+
+class QueryServer(ThreadingHTTPServer):
+    # One thread per request; the pool bounds how many of them query at once
+    daemon_threads = True
+
+    def __init__(self, address, db_path, pool_size=POOL_SIZE, cache_bytes=CACHE_BYTES,
+                 query_timeout=QUERY_TIMEOUT_SECONDS, max_rows=MAX_ROWS, store_root=None,
+                 pool_wait=POOL_WAIT_SECONDS, handler_class=None):
+        # handler_class: a QueryHandler subclass, e.g. one that does not log every request
+        self.pool = ReadOnlyPool(db_path, pool_size)
+        self.store = ColumnStore(store_root) if store_root is not None else None  # for /timeseries
+        self.cache = ResultCache(cache_bytes)
+        self.query_timeout = query_timeout
+        self.pool_wait = pool_wait
+        self.max_rows = max_rows
+        for name, help in (("hits", "Requests answered from the result cache"),
+                           ("misses", "Cacheable requests that ran their query")):
+            metrics.register(metrics.Collected(f"plunger_query_cache_{name}_total", help, "counter",
+                                               lambda name=name: getattr(self.cache, name)))
+        metrics.register(metrics.Collected("plunger_query_cache_bytes", "Bytes held by the result cache", "gauge",
+                                           lambda: self.cache.size))
+        super().__init__(address, handler_class or QueryHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
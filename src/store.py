@@ -0,0 +1,227 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 86400
+
+
+class ColumnStore:
+    # Processed well data on disk, one typed .npy array per column, partitioned by well and
+    # UTC day: <root>/<well_id>/<YYYY-MM-DD>/{columns.json, 0.npy, 1.npy, ...}.
+    # Partitions are opened memory-mapped, so a time range read only touches its own pages.
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def wells(self):
+        if not self.root.is_dir():
+            return []
+        return sorted(int(p.name) for p in self.root.iterdir() if p.is_dir() and p.name.isdigit())
+
+    def days(self, well_id):
+        well_dir = self.root / str(well_id)
+        if not well_dir.is_dir():
+            return []
+        return sorted(p.name for p in well_dir.iterdir() if p.is_dir() and "." not in p.name)
+
+    def open_partition(self, well_id, day, columns=None):
+        # {column name: read-only memmap} for one partition; `columns` narrows the set
+        # (isotime is always included)
+        partition = self.root / str(well_id) / day
+        with open(partition / "columns.json", "r") as f:
+            names = json.load(f)
+        return {
+            name: np.load(partition / f"{i}.npy", mmap_mode="r")
+            for i, name in enumerate(names)
+            if columns is None or name == "isotime" or name in columns
+        }
+
+    def read(self, well_ids=None, start=None, end=None, columns=None):
+        # Rows with start <= isotime <= end (either bound optional) as a DataFrame with a
+        # well_id column. Only partitions overlapping the range are opened
+        frames = []
+        for well_id in (self.wells() if well_ids is None else well_ids):
+            for day in self.days(well_id):
+                day_start = _day_number(day) * SECONDS_PER_DAY
+                if (start is not None and day_start + SECONDS_PER_DAY <= start) or \
+                        (end is not None and day_start > end):
+                    continue
+                arrays = self.open_partition(well_id, day, columns)
+                times = arrays["isotime"]
+                lo = 0 if start is None else np.searchsorted(times, start, side="left")
+                hi = len(times) if end is None else np.searchsorted(times, end, side="right")
+                if lo >= hi:
+                    continue
+                frame = pd.DataFrame({name: np.asarray(array[lo:hi]) for name, array in arrays.items()})
+                frame.insert(0, "well_id", well_id)
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=["well_id", "cycle_id", "isotime", "flow_rate"])
+        return pd.concat(frames, ignore_index=True)
+
+    def columns(self, well_id):
+        # column names of the well's newest partition
+        days = self.days(well_id)
+        if not days:
+            return []
+        with open(self.root / str(well_id) / days[-1] / "columns.json", "r") as f:
+            return json.load(f)
+
+    def series(self, well_id, columns, start=None, end=None):
+        # (times, {column: values}) with start <= isotime <= end, as plain arrays; NaN where a
+        # partition does not have the column
+        times, values = [], {column: [] for column in columns}
+        for day in self.days(well_id):
+            day_start = _day_number(day) * SECONDS_PER_DAY
+            if (start is not None and day_start + SECONDS_PER_DAY <= start) or \
+                    (end is not None and day_start > end):
+                continue
+            arrays = self.open_partition(well_id, day, columns)
+            day_times = arrays["isotime"]
+            lo = 0 if start is None else np.searchsorted(day_times, start, side="left")
+            hi = len(day_times) if end is None else np.searchsorted(day_times, end, side="right")
+            times.append(np.asarray(day_times[lo:hi]))
+            for column in columns:
+                values[column].append(np.asarray(arrays[column][lo:hi]) if column in arrays else np.full(hi - lo, np.nan))
+        if not times:
+            return np.empty(0, dtype=np.int64), {column: np.empty(0, dtype=np.float64) for column in columns}
+        return np.concatenate(times), {column: np.concatenate(parts) for column, parts in values.items()}
+
+    def tail(self, well_id, after=None):
+        # Stored rows of the well's last cycle, extended back to the start of the first cycle
+        # with rows later than `after`. None if nothing is stored for the well
+        parts = []
+        from_cycle = None
+        for day in reversed(self.days(well_id)):
+            arrays = self.open_partition(well_id, day)
+            cycle_ids = arrays["cycle_id"]
+            if from_cycle is None:
+                from_cycle = cycle_ids[-1]
+            if after is not None:
+                later = np.searchsorted(arrays["isotime"], after, side="right")
+                if later < len(cycle_ids):
+                    from_cycle = min(from_cycle, cycle_ids[later])
+            first = np.searchsorted(cycle_ids, from_cycle, side="left")
+            parts.append(pd.DataFrame({name: np.asarray(array[first:]) for name, array in arrays.items()}))
+            if first > 0:
+                break
+        if not parts:
+            return None
+        return pd.concat(parts[::-1], ignore_index=True)
+
+    def write(self, well_id, df):
+        # Replaces everything stored for the well from df's first timestamp onward with df
+        if df.empty:
+            return
+        df = df.drop(columns="well_id", errors="ignore").reset_index(drop=True)
+        times = df["isotime"].to_numpy(dtype=np.int64)
+        cutoff = int(times[0])
+        first_day = cutoff // SECONDS_PER_DAY
+
+        stale = []
+        for day in self.days(well_id):
+            number = _day_number(day)
+            if number == first_day:
+                kept = self.read([well_id], start=number * SECONDS_PER_DAY, end=cutoff - 1)
+                df = pd.concat([kept.drop(columns="well_id"), df], ignore_index=True)
+                times = df["isotime"].to_numpy(dtype=np.int64)
+            elif number > first_day:
+                stale.append(day)
+
+        day_numbers = times // SECONDS_PER_DAY
+        bounds = np.flatnonzero(np.diff(day_numbers)) + 1
+        written = set()
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(df)]):
+            day = _day_name(int(day_numbers[lo]))
+            self.__write_partition(well_id, day, df.iloc[lo:hi])
+            written.add(day)
+        for day in stale:
+            if day not in written:
+                shutil.rmtree(self.root / str(well_id) / day)
+
+    def __write_partition(self, well_id, day, df):
+        # Written next to the live partition and swapped in by rename
+        well_dir = self.root / str(well_id)
+        target = well_dir / day
+        tmp = well_dir / f"{day}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        names = list(df.columns)
+        for i, name in enumerate(names):
+            dtype = np.int64 if name in ("cycle_id", "isotime") else np.float64
+            np.save(tmp / f"{i}.npy", df[name].to_numpy(dtype=dtype))
+        with open(tmp / "columns.json", "w") as f:
+            json.dump(names, f)
+        if target.exists():
+            old = well_dir / f"{day}.old"
+            shutil.rmtree(old, ignore_errors=True)
+            os.rename(target, old)
+            os.rename(tmp, target)
+            shutil.rmtree(old)
+        else:
+            os.rename(tmp, target)
+
+
+def _day_number(day):
+    return int(np.datetime64(day, "D").astype(np.int64))
+
+
+def _day_name(number):
+    return str(np.datetime64(number, "D"))
+
+
+def bucket_stats(times, values, start, end, buckets):
+    # min / max / mean / count of the values in `buckets` equal time buckets covering
+    # [start, end], NaN values left out. times must be sorted. Only buckets holding values are
+    # returned, each keyed by its start time. Returns (bucket width in seconds, {name: array})
+    width = max(1, -(-(end - start + 1) // buckets))
+    edges = start + np.arange(buckets + 1, dtype=np.int64) * width
+    bounds = np.searchsorted(times, edges, side="left")
+    filled = np.flatnonzero(bounds[1:] > bounds[:-1])
+    first = bounds[filled]
+    if len(first) == 0:
+        return width, {name: np.empty(0) for name in ("time", "min", "max", "mean", "count")}
+    valid = ~np.isnan(values)
+    counts = np.add.reduceat(valid, first)
+    sums = np.add.reduceat(np.where(valid, values, 0.0), first)
+    kept = counts > 0
+    return width, {
+        "time": edges[filled][kept],
+        "min": np.fmin.reduceat(values, first)[kept],  # fmin/fmax skip NaN
+        "max": np.fmax.reduceat(values, first)[kept],
+        "mean": sums[kept] / counts[kept],
+        "count": counts[kept],
+    }
+
+
+def lttb(times, values, points):
+    # Largest-Triangle-Three-Buckets: `points` of the samples (NaN left out) chosen so the line
+    # through them keeps the series' shape, spikes included. First and last samples are kept
+    # (only the first for a single point), never more than `points` samples are returned
+    keep = ~np.isnan(values)
+    times, values = times[keep], values[keep]
+    n = len(times)
+    if points >= n:
+        return times, values
+    if points < 3:
+        ends = [0, n - 1][:points]
+        return times[ends], values[ends]
+    t = times.astype(np.float64)
+    # bucket i + 1 covers [bounds[i], bounds[i + 1]); bucket points - 1 is the last sample
+    bounds = np.r_[(np.arange(points - 1) * ((n - 2) / (points - 2))).astype(np.int64) + 1, n]
+    counts = np.diff(bounds)
+    mean_t = np.add.reduceat(t, bounds[:-1]) / counts
+    mean_v = np.add.reduceat(values, bounds[:-1]) / counts
+    chosen = np.empty(points, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        # twice the area of the triangle (a, candidate, mean of the next bucket)
+        area = np.abs((t[a] - mean_t[i + 1]) * (values[lo:hi] - values[a]) - (t[a] - t[lo:hi]) * (mean_v[i + 1] - values[a]))
+        a = lo + int(area.argmax())
+        chosen[i + 1] = a
+    return times[chosen], values[chosen]
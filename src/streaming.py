@@ -0,0 +1,284 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from .data import FLOW_RATE_FILE, JOIN_TOLERANCE_SECONDS, MAX_PID_LAG_SECONDS
+from .events_generator import (ARRIVAL_SPEED, ARRIVAL_TIME_REMAINING, CASING_PRESSURE, LINE_PRESSURE,
+                               NON_ARRIVAL_COUNT, TUBING_PRESSURE, derive_cycle_features,
+                               insert_cycle_events)
+from .metadata import WELLS_CONFIG_FILE
+from .rules import RULES, load_thresholds
+
+# The PIDs the cycle features read, only these are buffered for the join
+FEATURE_PIDS = (TUBING_PRESSURE, CASING_PRESSURE, LINE_PRESSURE, ARRIVAL_SPEED, NON_ARRIVAL_COUNT,
+                ARRIVAL_TIME_REMAINING)
+
+
+# CycleAggregates.as_dict() columns and their types
+AGGREGATE_COLUMNS = {
+    'well_id': np.int64, 'cycle_id': np.int64, 'start_time': np.int64, 'end_time': np.int64,
+    'pt_first': np.float64, 'pt_last': np.float64, 'cp_first': np.float64, 'cp_last': np.float64,
+    'pl_first': np.float64, 'pl_last': np.float64, 'flow_duration': np.int64, 'shutin_duration': np.int64,
+    'mean_flow_rate': np.float64, 'mean_arrival_speed': np.float64, 'max_non_arrival_count': np.float64,
+    'min_arrival_time_remaining': np.float64, 'flowing_rows': np.int64,
+}
+
+
+class StreamingDetector:
+    # Online counterpart of DataLoader + EventsGenerator: samples are pushed as they arrive,
+    # one at a time or in micro-batches, and a cycle's events are written as soon as the
+    # zero-flow onset of the next cycle closes it (and its rows have their PID values).
+    # Each well only keeps its running cycle aggregates plus the samples still inside the
+    # join window, so memory does not grow with history.
+    # Samples of a PID must arrive in time order, older ones are dropped
+    def __init__(self, database, config_file=WELLS_CONFIG_FILE, rules=None, flow_threshold=0.0,
+                 min_shutin_seconds=0, on_cycles=None):
+        self.database = database
+        self.rules = RULES if rules is None else rules
+        self.thresholds = load_thresholds(config_file)
+        self.flow_threshold = flow_threshold
+        self.min_shutin_seconds = min_shutin_seconds
+        # called with (features, results) after every write of closed cycles, e.g. for alerts
+        self.on_cycles = on_cycles
+        self.wells = {}
+
+    def push(self, well_id, pid_name, time, value):
+        return self.push_many(well_id, pid_name, [time], [value])
+
+    def push_many(self, well_id, pid_name, times, values):
+        # times in epoch seconds; pid_name is the PID name with or without ".csv".
+        # Returns the features of the cycles this closed (one row each)
+        column = pid_name if pid_name.endswith(".csv") else f"{pid_name}.csv"
+        well = self.__well(well_id)
+        if column != FLOW_RATE_FILE and column not in FEATURE_PIDS:
+            return self.__emit([])
+        for time, value in zip(times, values):
+            value = float(value)
+            if math.isnan(value):  # unreadable samples are skipped, as by the loader
+                continue
+            if column == FLOW_RATE_FILE:
+                well.add_flow(int(time), value)
+            else:
+                well.add_sample(column, int(time), value)
+        return self.__emit(well.drain())
+
+    def __well(self, well_id):
+        well = self.wells.get(well_id)
+        if well is None:
+            settings = self.thresholds.get(well_id, {})
+            well = WellStream(
+                well_id,
+                settings.get("cycle_flow_threshold", self.flow_threshold),
+                settings.get("cycle_min_shutin_seconds", self.min_shutin_seconds),
+            )
+            self.wells[well_id] = well
+        return well
+
+    def __emit(self, closed):
+        if not closed:
+            # most pushes close nothing, building an empty frame each time would dominate them
+            return NO_CYCLES.copy()
+        features = derive_cycle_features(_stack_aggregates(closed))
+        results = insert_cycle_events(self.database, features, self.rules, self.thresholds)
+        if self.on_cycles is not None:
+            self.on_cycles(features, results)
+        return features
+
+
+class WellStream:
+    # Per-well state machine. Flow samples are split into cycles as they arrive (the same
+    # onset rule as find_cycle_onsets), wait in `rows` until every feature PID has a sample
+    # inside the join window, then are folded into the running cycle
+    def __init__(self, well_id, flow_threshold=0.0, min_shutin_seconds=0):
+        self.well_id = well_id
+        self.flow_threshold = flow_threshold
+        self.min_shutin_seconds = min_shutin_seconds
+        self.cycle_id = -1          # rows before the first onset are dropped, like the batch cleanup
+        self.shut_in = False        # flow state of the last flow row
+        self.held = []              # rows of a shut-in that is not long enough to count yet
+        self.held_after = None      # time of the flow row before the held ones
+        self.last_flow_time = None
+        self.pid_floor = None       # PID samples older than this were cleaned up
+        self.rows = deque()         # [time, flow, cycle_id, {pid: value}] waiting for PID samples
+        self.samples = {pid: deque() for pid in FEATURE_PIDS}
+        self.latest = {}            # pid -> time of the newest sample
+        self.cycle = None           # running aggregates of the current cycle
+
+    def add_flow(self, time, flow):
+        previous = self.last_flow_time
+        if previous is not None and time < previous:
+            return
+        self.last_flow_time = time
+
+        # flow within the threshold of zero is shut in, above it flowing, below it noise
+        # that keeps the previous state
+        if abs(flow) <= self.flow_threshold:
+            shut_in = True
+        elif flow > self.flow_threshold:
+            shut_in = False
+        else:
+            shut_in = self.shut_in
+        onset = shut_in and not self.shut_in
+        self.shut_in = shut_in
+
+        if self.held:
+            self.held.append((time, flow))
+            # the shut-in counts once it lasted min_shutin_seconds, measured up to the row where
+            # flow resumes; ending earlier it does not start a cycle
+            if time - self.held[0][0] >= self.min_shutin_seconds:
+                self.__start_cycle()
+            elif not shut_in:
+                self.__release(self.cycle_id)
+            return
+        if onset:
+            self.held.append((time, flow))
+            self.held_after = previous
+            if self.min_shutin_seconds <= 0:
+                self.__start_cycle()
+            return
+        if self.cycle_id >= 0:
+            self.rows.append([time, flow, self.cycle_id, {}])
+
+    def __start_cycle(self):
+        if self.cycle_id < 0 and self.held_after is not None:
+            # first cycle: drop PID samples older than a minute after the last dropped flow row
+            self.pid_floor = self.held_after + 60
+            for buffer in self.samples.values():
+                while buffer and buffer[0][0] < self.pid_floor:
+                    buffer.popleft()
+        self.cycle_id += 1
+        self.__release(self.cycle_id)
+
+    def __release(self, cycle_id):
+        if cycle_id >= 0:
+            self.rows.extend([time, flow, cycle_id, {}] for time, flow in self.held)
+        self.held = []
+
+    def add_sample(self, pid, time, value):
+        latest = self.latest.get(pid)
+        if (latest is not None and time < latest) or (self.pid_floor is not None and time < self.pid_floor):
+            return
+        self.latest[pid] = time
+        buffer = self.samples[pid]
+        buffer.append((time, value))
+        # bounded even when flow stops: flow rows lagging further behind a PID than
+        # MAX_PID_LAG_SECONDS lose its older samples
+        while buffer and buffer[0][0] < time - MAX_PID_LAG_SECONDS - JOIN_TOLERANCE_SECONDS:
+            buffer.popleft()
+
+    def drain(self):
+        # Moves the rows whose PID values are known into the running cycle. Returns the
+        # aggregates of the cycles that closed
+        closed = []
+        flow_latest = self.last_flow_time
+        while self.rows:
+            time, flow, cycle_id, values = self.rows[0]
+            # PIDs lagging more than MAX_PID_LAG_SECONDS behind flow are given up on, as in
+            # the loader
+            give_up = flow_latest - time >= MAX_PID_LAG_SECONDS + JOIN_TOLERANCE_SECONDS
+            for pid in FEATURE_PIDS:
+                if pid in values:
+                    continue
+                buffer = self.samples[pid]
+                # the first sample within [time - tolerance, time + tolerance] in time order
+                while buffer and buffer[0][0] < time - JOIN_TOLERANCE_SECONDS:
+                    buffer.popleft()
+                if buffer:
+                    sample_time, value = buffer[0]
+                    values[pid] = value if sample_time <= time + JOIN_TOLERANCE_SECONDS else math.nan
+                elif give_up:
+                    values[pid] = math.nan
+            if len(values) < len(FEATURE_PIDS):
+                break
+            self.rows.popleft()
+            if self.cycle is not None and self.cycle.cycle_id != cycle_id:
+                closed.append(self.cycle)
+                self.cycle = None
+            if self.cycle is None:
+                self.cycle = CycleAggregates(self.well_id, cycle_id, time, flow, values, self.flow_threshold)
+            else:
+                self.cycle.add(time, flow, values)
+        return closed
+
+
+class CycleAggregates:
+    # Running first/last values, sums and counts of one cycle, the streaming version of
+    # what cycle_features reduces over the cycle's rows (flow_threshold as there)
+    __slots__ = ('well_id', 'cycle_id', 'flow_threshold', 'start_time', 'end_time', 'first', 'last',
+                 'flow_first', 'flow_last', 'shutin_first', 'shutin_last', 'flow_sum', 'flowing_rows',
+                 'speed_sum', 'speed_count', 'max_non_arrival_count', 'min_arrival_time_remaining')
+
+    def __init__(self, well_id, cycle_id, time, flow, values, flow_threshold=0.0):
+        self.well_id = well_id
+        self.cycle_id = cycle_id
+        self.flow_threshold = flow_threshold
+        self.start_time = time
+        self.first = values
+        self.flow_first = self.flow_last = None
+        self.shutin_first = self.shutin_last = None
+        self.flow_sum = 0.0
+        self.flowing_rows = 0
+        self.speed_sum = 0.0
+        self.speed_count = 0
+        self.max_non_arrival_count = math.nan
+        self.min_arrival_time_remaining = math.nan
+        self.add(time, flow, values)
+
+    def add(self, time, flow, values):
+        self.end_time = time
+        self.last = values
+        if flow > self.flow_threshold:
+            if self.flow_first is None:
+                self.flow_first = time
+            self.flow_last = time
+            self.flow_sum += flow
+            self.flowing_rows += 1
+        elif abs(flow) <= self.flow_threshold:
+            if self.shutin_first is None:
+                self.shutin_first = time
+            self.shutin_last = time
+        speed = values[ARRIVAL_SPEED]
+        if not math.isnan(speed):
+            self.speed_sum += speed
+            self.speed_count += 1
+        # NaN-ignoring max/min, like np.fmax/np.fmin
+        count = values[NON_ARRIVAL_COUNT]
+        if not math.isnan(count) and not count <= self.max_non_arrival_count:
+            self.max_non_arrival_count = count
+        remaining = values[ARRIVAL_TIME_REMAINING]
+        if not math.isnan(remaining) and not remaining >= self.min_arrival_time_remaining:
+            self.min_arrival_time_remaining = remaining
+
+    def as_dict(self):
+        return {
+            'well_id': self.well_id,
+            'cycle_id': self.cycle_id,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'pt_first': self.first[TUBING_PRESSURE],
+            'pt_last': self.last[TUBING_PRESSURE],
+            'cp_first': self.first[CASING_PRESSURE],
+            'cp_last': self.last[CASING_PRESSURE],
+            'pl_first': self.first[LINE_PRESSURE],
+            'pl_last': self.last[LINE_PRESSURE],
+            'flow_duration': 0 if self.flow_first is None else self.flow_last - self.flow_first,
+            'shutin_duration': 0 if self.shutin_first is None else self.shutin_last - self.shutin_first,
+            'mean_flow_rate': self.flow_sum / self.flowing_rows if self.flowing_rows else math.nan,
+            'mean_arrival_speed': self.speed_sum / self.speed_count if self.speed_count else math.nan,
+            'max_non_arrival_count': self.max_non_arrival_count,
+            'min_arrival_time_remaining': self.min_arrival_time_remaining,
+            'flowing_rows': self.flowing_rows,
+        }
+
+
+def _stack_aggregates(cycles):
+    # list of CycleAggregates -> {column: array}, the input of derive_cycle_features
+    rows = [cycle.as_dict() for cycle in cycles]
+    return {
+        column: np.array([row[column] for row in rows], dtype=dtype)
+        for column, dtype in AGGREGATE_COLUMNS.items()
+    }
+
+
+NO_CYCLES = derive_cycle_features(_stack_aggregates([]))  # what a push that closes no cycle returns
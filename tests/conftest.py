@@ -0,0 +1,10 @@
+import pytest
+
+from onping_stub import OnPingStub
+
+
+@pytest.fixture
+def onping():
+    stub = OnPingStub()
+    yield stub
+    stub.close()
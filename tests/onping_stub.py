@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HISTORY_PATH = "/json/listers/parameterHistoryLister"
+
+
+def sample_value(pid, t):
+    # the reading the stub reports for a PID at epoch second t
+    return round((pid * 7919 + t // 60) % 1000 / 10, 1)
+
+
+class OnPingStub(ThreadingHTTPServer):
+    # Local stand-in for OnPing's history lister, for OnPingClient(history_url=stub.url).
+    # Answers every window with one sample per `step` seconds (see sample_value), after
+    # `latency` seconds. `failures` holds statuses to answer the next requests with instead;
+    # with `session` set, requests without that session cookie get a 401. Every request is
+    # recorded, as is the most requests ever in flight at once
+    daemon_threads = True
+
+    def __init__(self, step=60, latency=0.0, session=None):
+        super().__init__(("127.0.0.1", 0), _HistoryHandler)
+        self.step = step
+        self.latency = latency
+        self.session = session
+        self.failures = []
+        self.requests = []  # (pid, start, end, status)
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}{HISTORY_PATH}"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _HistoryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        stub = self.server
+        params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        start, end = (_epoch(t) for t in params["time_ranges"][0])
+        with stub.lock:
+            stub.in_flight += 1
+            stub.peak = max(stub.peak, stub.in_flight)
+        try:
+            if stub.latency:
+                time.sleep(stub.latency)
+            with stub.lock:
+                if stub.session is not None and f"session={stub.session}" not in self.headers.get("Cookie", ""):
+                    status = 401
+                else:
+                    status = stub.failures.pop(0) if stub.failures else 200
+                stub.requests.append((params["pid"], start, end, status))
+            if status != 200:
+                self.__send(status, b"{}")
+                return
+            step = params["steps"][0]
+            first = -(-start // step) * step
+            body = [{"time": _iso(t), "val": sample_value(params["pid"], t)} for t in range(first, end, step)]
+            self.__send(200, json.dumps(body).encode())
+        finally:
+            with stub.lock:
+                stub.in_flight -= 1
+
+    def __send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _epoch(iso):
+    return int(datetime.strptime(iso, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp())
+
+
+def _iso(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+from src.database import Database
+
+EVENT = {"name": "CYCLE_DURATION_EVENTS", "start_time": 0, "end_time": 600,
+         "total_duration": 600, "flow_duration": 300, "shutin_duration": 300}
+
+
+def _ids(database, table="CYCLE_DURATION_EVENTS"):
+    return [row[0] for row in database.connection.execute(f"SELECT _id FROM {table} ORDER BY _id")]
+
+
+def test_batch_commits_and_links_ids(tmp_path):
+    database = Database(tmp_path / "events")
+    with database.batch():
+        child = database.insertEvent(EVENT)
+        parent = database.insertEvents("EVENTS", {"cycle_id": [0], "cycle_duration_event": [child]})
+    row = database.connection.execute("SELECT cycle_duration_event FROM EVENTS WHERE _id = ?", parent).fetchone()
+    assert row == (child,)
+
+
+def test_batch_rolls_back_on_error(tmp_path):
+    database = Database(tmp_path / "events")
+    database.insertEvent(EVENT)
+    with pytest.raises(RuntimeError):
+        with database.batch():
+            database.insertEvents("CYCLE_DURATION_EVENTS", {k: [v] * 3 for k, v in EVENT.items() if k != "name"})
+            raise RuntimeError("stop")
+    assert _ids(database) == [1]
+
+
+def test_concurrent_batches_get_distinct_ids(tmp_path):
+    # two writers on one database, e.g. the streaming detector next to a batch run
+    first = Database(tmp_path / "events")
+    errors = []
+
+    def other_writer():
+        second = Database(tmp_path / "events")
+        try:
+            with second.batch():
+                for _ in range(3):
+                    second.insertEvent(EVENT)
+        except Exception as e:
+            errors.append(e)
+
+    with first.batch():
+        for _ in range(3):
+            first.insertEvent(EVENT)
+        writer = threading.Thread(target=other_writer)
+        writer.start()
+        time.sleep(0.3)  # the other writer allocates its ids meanwhile, unless it has to wait
+    writer.join()
+    assert errors == []
+    assert _ids(first) == [1, 2, 3, 4, 5, 6]
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench.synth import generate
+from src import events_generator
+from src.data import DataLoader
+from src.database import Database
+from src.events_generator import EventsGenerator, cycle_features
+from src.streaming import FEATURE_PIDS, CycleAggregates
+
+SUMMARY = "SELECT well_id, start_time, end_time, total_duration, flow_duration, shutin_duration, gas_volume " \
+          "FROM CYCLE_SUMMARY ORDER BY well_id, start_time"
+
+
+@pytest.fixture
+def wells(tmp_path):
+    # half a day of 10 s samples for two wells
+    generate(tmp_path, wells=2, days=0.5, step=10, seed=5)
+    return tmp_path
+
+
+def _run(root, db_name):
+    database = Database(root / db_name)
+    loader = DataLoader(root / "data", config_file=root / "config" / "wells-config.json", max_workers=1)
+    EventsGenerator(loader, database).generate_events()
+    return database
+
+
+def test_cycles_of_a_failed_run_are_reported_by_the_next(wells, tmp_path, monkeypatch):
+    expected = _run(wells, "reference").connection.execute(SUMMARY).fetchall()
+    assert expected
+    # start over from the csvs, with a run whose events fail after the load has been stored
+    (wells / "data" / "watermarks.json").unlink()
+
+    def fail(*args):
+        raise RuntimeError("disk full")
+    with monkeypatch.context() as patch:
+        patch.setattr(events_generator, "run_rules", fail)
+        with pytest.raises(RuntimeError):
+            _run(wells, "events")
+    database = Database(wells / "events")
+    assert database.connection.execute("SELECT COUNT(*) FROM EVENTS").fetchone()[0] == 0
+
+    # nothing new to load, the cycles still get their events, and only once
+    _run(wells, "events")
+    _run(wells, "events")
+    assert database.connection.execute(SUMMARY).fetchall() == expected
+
+
+def test_a_well_without_a_pid_gets_events(wells):
+    # one well never reported its arrival speed; neither it nor the other well lose their cycles
+    (wells / "data" / "Synthetic 2H" / "Arrival Speed.csv").unlink()
+    database = _run(wells, "events")
+    counts = database.connection.execute(
+        "SELECT s.well_id, COUNT(*), COUNT(s.arrival_speed), COUNT(e.plunger_arrival_velocity_event) "
+        "FROM CYCLE_SUMMARY s JOIN EVENTS e ON e._id = s.event_id GROUP BY s.well_id").fetchall()
+    (first, cycles, speeds, velocities), (second, missing_cycles, missing_speeds, missing_velocities) = counts
+    assert (first, second) == (1, 2)
+    assert cycles > 0 and speeds == velocities == cycles
+    assert missing_cycles > 0 and missing_speeds == missing_velocities == 0
+
+
+def test_features_follow_the_cycle_definition():
+    # with a 0.5 MCF/Day threshold, readings of 0.3 and 0.2 are shut in, not flowing
+    times = np.arange(0, 80, 10, dtype=np.int64)
+    flow = np.array([5.0, 5.0, 0.3, 0.3, 0.0, 0.2, 7.0, 7.0])
+    rows = pd.DataFrame({'well_id': 1, 'cycle_id': 0, 'isotime': times, 'flow_rate': flow})
+    batch = cycle_features(rows, {1: 0.5}).iloc[0]
+    assert (batch['flow_duration'], batch['shutin_duration'], batch['mean_flow_rate']) == (70, 30, 6.0)
+
+    values = {pid: float('nan') for pid in FEATURE_PIDS}
+    streamed = CycleAggregates(1, 0, int(times[0]), flow[0], values, flow_threshold=0.5)
+    for time, value in zip(times[1:], flow[1:]):
+        streamed.add(int(time), value, values)
+    streamed = streamed.as_dict()
+    assert (streamed['flow_duration'], streamed['shutin_duration'], streamed['mean_flow_rate']) == (70, 30, 6.0)
@@ -0,0 +1,173 @@
+import csv
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from onping_stub import OnPingStub, sample_value
+from src.fetcher import fetcher, onping_fetcher
+from src.fetcher.onping_auth import AuthManager
+from src.fetcher.onping_fetcher import OnPingClient
+from src.fetcher.response_cache import ResponseCache
+from src.samples import SAMPLES_SUFFIX, read_samples
+
+START = datetime(2025, 6, 29, tzinfo=timezone.utc)
+
+
+class Session:
+    # what OnPingClient needs of an AuthManager, for a server that does not check cookies
+    generation = 0
+    cookies = {}
+
+    def reauthenticate(self, generation):
+        return True
+
+
+def test_history_against_the_stub(onping):
+    client = OnPingClient(Session(), history_url=onping.url)
+    data = client.history(11, START, START + timedelta(hours=1), 60)
+    assert len(data) == 60
+    assert data[0] == {"time": "2025-06-29T00:00:00Z", "val": sample_value(11, int(START.timestamp()))}
+
+
+def test_retries_with_exponential_backoff(onping, monkeypatch):
+    # full jitter picks anywhere up to backoff * 2^attempt (capped); take the bound to see it
+    delays = []
+    monkeypatch.setattr(onping_fetcher.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(onping_fetcher.time, "sleep", delays.append)
+    onping.failures = [503, 429, 500]
+    client = OnPingClient(Session(), history_url=onping.url, attempts=4, backoff=0.5, max_backoff=1.5)
+    assert len(client.history(11, START, START + timedelta(minutes=10), 60)) == 10
+    assert [status for *_, status in onping.requests] == [503, 429, 500, 200]
+    assert delays == [0.5, 1.0, 1.5]
+
+
+def test_gives_up(onping, monkeypatch):
+    monkeypatch.setattr(onping_fetcher.time, "sleep", lambda seconds: None)
+    client = OnPingClient(Session(), history_url=onping.url, attempts=3)
+    onping.failures = [503] * 3
+    assert client.history(11, START, START + timedelta(minutes=10), 60) is None
+    assert len(onping.requests) == 3
+    # other client errors are not retried
+    onping.failures = [404]
+    assert client.history(11, START, START + timedelta(minutes=10), 60) is None
+    assert len(onping.requests) == 4
+
+
+def test_requests_per_host_are_capped():
+    stub = OnPingStub(latency=0.1)
+    try:
+        client = OnPingClient(Session(), history_url=stub.url, per_host=3)
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            results = list(pool.map(lambda pid: client.history(pid, START, START + timedelta(hours=1), 60),
+                                    range(24)))
+        assert all(len(data) == 60 for data in results)
+        assert stub.peak == 3
+    finally:
+        stub.close()
+
+
+def test_single_login_on_401(monkeypatch):
+    # the stored session has expired; the first worker to get a 401 logs in, the others wait for it
+    monkeypatch.setenv("ONPING_USERNAME", "user")
+    monkeypatch.setenv("ONPING_PASSWORD", "secret")
+    logins = []
+
+    def login(self):
+        time.sleep(0.2)
+        logins.append(threading.get_ident())
+        self.cookies = {"session": "new"}
+        self.generation += 1
+        return True
+    monkeypatch.setattr(AuthManager, "_AuthManager__login", login)
+
+    stub = OnPingStub(latency=0.05, session="new")
+    try:
+        auth = AuthManager()
+        auth.cookies = {"session": "expired"}
+        client = OnPingClient(auth, history_url=stub.url, per_host=12)
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            results = list(pool.map(lambda pid: client.history(pid, START, START + timedelta(hours=1), 60),
+                                    range(24)))
+        assert all(len(data) == 60 for data in results)
+        assert len(logins) == 1
+    finally:
+        stub.close()
+
+
+@pytest.fixture
+def fetch_env(tmp_path, monkeypatch):
+    # fetch_data writing into tmp_path, for one well with two PIDs over the last 12 hours
+    monkeypatch.setattr(fetcher, "DATA_FOLDER", str(tmp_path / "data"))
+    monkeypatch.setattr(fetcher, "FETCH_CHECKPOINT_FILE", str(tmp_path / "data" / "fetch-checkpoints.json"))
+    monkeypatch.setattr(fetcher, "WELLS_CONFIG_FILE", str(tmp_path / "wells-config.json"))
+    monkeypatch.setattr(onping_fetcher.time, "sleep", lambda seconds: None)
+    config = {
+        "step_seconds": 60,
+        "lastFetchTime": (datetime.now(timezone.utc) - timedelta(hours=12)).isoformat(),
+        "fetch_window_seconds": 3600,
+        "wells": [{"name": "Synthetic 1H", "pids": [{"name": "Tubing Pressure (PSI)", "pid": 11},
+                                                     {"name": "Casing Pressure (PSI)", "pid": 12}]}],
+    }
+    return tmp_path, config
+
+
+def _fetch(onping, tmp_path, config, **cache_options):
+    client = OnPingClient(Session(), history_url=onping.url, attempts=1)
+    cache = ResponseCache(tmp_path / "cache", **cache_options)
+    fetcher.fetch_data(Session(), config, client=client, cache=cache)
+    return cache
+
+
+def _rows(tmp_path, pid_name):
+    # [[ISO time, value], ...] of a fetched PID, from its typed samples or its csv
+    well_dir = tmp_path / "data" / "Synthetic 1H"
+    if (well_dir / f"{pid_name}{SAMPLES_SUFFIX}").is_dir():
+        times, values = read_samples(well_dir / f"{pid_name}{SAMPLES_SUFFIX}")
+        return [[datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), str(v)]
+                for t, v in zip(times.tolist(), values.tolist())]
+    with open(well_dir / f"{pid_name}.csv") as f:
+        return list(csv.reader(f))[1:]
+
+
+def _assert_gap_free(rows):
+    times = [datetime.strptime(t, "%Y-%m-%dT%H:%M:%SZ") for t, _ in rows]
+    assert all(b - a == timedelta(minutes=1) for a, b in zip(times, times[1:]))
+
+
+def test_backfill_resumes_from_checkpoints(onping, fetch_env):
+    tmp_path, config = fetch_env
+    onping.failures = [200] * 5 + [404]  # one window fails partway through the first run
+    _fetch(onping, tmp_path, config, enabled=False)
+    checkpoints = json.loads((tmp_path / "data" / "fetch-checkpoints.json").read_text())
+    assert len(checkpoints) == 2
+    names = ("Tubing Pressure (PSI)", "Casing Pressure (PSI)")
+    first_run = [len(_rows(tmp_path, name)) for name in names]
+    assert min(first_run) < max(first_run)  # the PID with the failed window stopped before it
+
+    _fetch(onping, tmp_path, config, enabled=False)
+    second_run = [_rows(tmp_path, name) for name in names]
+    assert len(second_run[0]) == len(second_run[1]) >= max(first_run)
+    for rows in second_run:
+        _assert_gap_free(rows)
+    assert json.loads((tmp_path / "wells-config.json").read_text())["lastFetchTime"]
+
+
+def test_closed_windows_come_from_the_cache(onping, fetch_env):
+    tmp_path, config = fetch_env
+    config["sample_format"] = "csv"
+    _fetch(onping, tmp_path, config)
+    first = _rows(tmp_path, "Tubing Pressure (PSI)")
+    requests = len(onping.requests)
+
+    # a second backfill of the same range only asks for the windows that were still open
+    for path in (tmp_path / "data").rglob("*"):
+        if path.is_file():
+            path.unlink()
+    cache = _fetch(onping, tmp_path, config)
+    assert cache.hits > 0
+    assert len(onping.requests) - requests == requests - cache.hits
+    assert _rows(tmp_path, "Tubing Pressure (PSI)")[:len(first)] == first
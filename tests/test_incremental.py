@@ -0,0 +1,71 @@
+import shutil
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from bench.synth import START, generate
+from src.data import DataLoader
+
+
+@pytest.fixture(scope="module")
+def synthetic(tmp_path_factory):
+    # one day of 10 s samples for two wells, and its full (non-incremental) load
+    root = tmp_path_factory.mktemp("full")
+    generate(root, wells=2, days=1, step=10, seed=3)
+    loader = DataLoader(root / "data", config_file=root / "config" / "wells-config.json", max_workers=1)
+    loader.load(force_reload=True)
+    return root, loader.get_data()
+
+
+def _copy_until(source, target, cutoff):
+    # the synthetic csvs as they would have been fetched up to `cutoff` (epoch seconds)
+    iso = datetime.fromtimestamp(cutoff, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    for csv in (source / "data").glob("*/*.csv"):
+        out = target / "data" / csv.parent.name / csv.name
+        out.parent.mkdir(parents=True, exist_ok=True)
+        lines = csv.read_text().splitlines(keepends=True)
+        out.write_text(lines[0] + "".join(line for line in lines[1:] if line[:20] < iso))
+    (target / "config").mkdir(exist_ok=True)
+    shutil.copy(source / "config" / "wells-config.json", target / "config" / "wells-config.json")
+
+
+def _loader(root):
+    return DataLoader(root / "data", config_file=root / "config" / "wells-config.json", max_workers=1)
+
+
+def test_incremental_loads_match_a_full_load(synthetic, tmp_path):
+    source, expected = synthetic
+    for cutoff in (START + 6 * 3600, START + 6 * 3600 + 7, START + 15 * 3600, START + 86400):
+        _copy_until(source, tmp_path, cutoff)
+        _loader(tmp_path).load()
+    pd.testing.assert_frame_equal(_loader(tmp_path).get_data(), expected)
+
+
+def test_crash_between_store_and_watermarks(synthetic, tmp_path, monkeypatch):
+    source, expected = synthetic
+    _copy_until(source, tmp_path, START + 8 * 3600)
+    _loader(tmp_path).load()
+    _copy_until(source, tmp_path, START + 86400)
+
+    def crash(self, watermarks):
+        raise RuntimeError("killed")
+    with monkeypatch.context() as patch:
+        patch.setattr(DataLoader, "_DataLoader__write_watermarks", crash)
+        with pytest.raises(RuntimeError):
+            _loader(tmp_path).load()
+
+    # the store is ahead of the watermarks now; the next run must not duplicate its rows
+    _loader(tmp_path).load()
+    stored = _loader(tmp_path).get_data()
+    assert not stored.duplicated(["well_id", "isotime"]).any()
+    pd.testing.assert_frame_equal(stored, expected)
+
+
+def test_watermarks_are_replaced_atomically(synthetic, tmp_path):
+    source, _ = synthetic
+    _copy_until(source, tmp_path, START + 3600)
+    loader = _loader(tmp_path)
+    loader.load()
+    assert loader.watermarks_path.exists()
+    assert not loader.watermarks_path.with_name(loader.watermarks_path.name + ".tmp").exists()
@@ -0,0 +1,113 @@
+import csv
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from src.data import FLOW_RATE_FILE, WellLoader
+
+T0 = 1751184000  # 2025-06-29T08:00:00Z
+
+
+def _iso(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", "val"])
+        for t, v in rows:
+            writer.writerow([_iso(t), v])
+
+
+def _reference(files):
+    # The original loader's cleanup, cycle numbering and triple-loop join, on parsed
+    # {file name: [[time, value], ...]}
+    flow = files[FLOW_RATE_FILE]
+    threshold = 0
+    for i in range(len(flow)):
+        if flow[i][1] == 0.0:
+            if i == 0:
+                break
+            threshold = flow[i - 1][0] + 60
+            flow = flow[i:]
+            break
+    pids = {}
+    for name, rows in files.items():
+        if name == FLOW_RATE_FILE:
+            continue
+        pids[name] = rows
+        for i in range(len(rows)):
+            if rows[i][0] >= threshold:
+                pids[name] = rows[i:]
+                break
+
+    data, cycle_id, in_shutin = [], -1, False
+    for t, v in flow:
+        if v == 0.0 and not in_shutin:
+            cycle_id += 1
+            in_shutin = True
+        elif v > 0.0:
+            in_shutin = False
+        data.append([cycle_id, t, v])
+    df = pd.DataFrame(data, columns=["cycle_id", "isotime", "flow_rate"])
+    for name, rows in pids.items():
+        df[name] = None
+        for i in range(len(df)):
+            t = df.iloc[i]["isotime"]
+            for sample_time, value in rows:
+                if sample_time in range(t - 60, t + 61):
+                    df.at[i, name] = value
+                    break
+    return df
+
+
+def _synthetic_well(tmp_path):
+    rng = np.random.default_rng(7)
+    flow_times = T0 + 60 * np.arange(240)
+    # flowing, then shut-in / flowing cycles, with a little negative meter noise
+    flow_values = np.where((np.arange(240) // 30) % 2 == 1, 0.0, rng.uniform(50, 150, 240).round(3))
+    flow_values[[5, 100]] = -0.5
+    files = {FLOW_RATE_FILE: [[int(t), float(v)] for t, v in zip(flow_times, flow_values)]}
+
+    # dense: several samples in every +/-60 s window, the first one must win
+    dense_times = T0 - 300 + 10 * np.arange(1600)
+    files["Tubing Pressure (PSI).csv"] = [[int(t), float(i)] for i, t in enumerate(dense_times)]
+
+    # sparse and gapped, with samples exactly at t - 60, t + 60 and one second outside
+    edge = flow_times[60]
+    sparse = [T0 + 1000, T0 + 1777, edge - 61, edge + 60, flow_times[80] + 61, flow_times[90] - 60,
+              T0 + 9000, T0 + 9013, T0 + 12000]
+    files["Casing Pressure (PSI).csv"] = [[int(t), round(100 + i * 1.5, 3)] for i, t in enumerate(sorted(sparse))]
+
+    well_dir = tmp_path / "Synthetic 1H"
+    well_dir.mkdir()
+    for name, rows in files.items():
+        _write_csv(well_dir / name, rows)
+    return well_dir, files
+
+
+def test_join_matches_original_loader(tmp_path):
+    well_dir, files = _synthetic_well(tmp_path)
+    expected = _reference(files)
+    actual = WellLoader(well_dir).load()
+
+    expected = expected.astype({name: np.float64 for name in expected.columns if name.endswith(".csv")})
+    expected = expected.astype({"cycle_id": np.int64, "isotime": np.int64})
+    pd.testing.assert_frame_equal(actual[expected.columns].reset_index(drop=True), expected)
+
+
+def test_join_tolerance_boundaries(tmp_path):
+    well_dir, files = _synthetic_well(tmp_path)
+    df = WellLoader(well_dir).load().set_index("isotime")
+    casing = files["Casing Pressure (PSI).csv"]
+    value = dict((t, v) for t, v in casing)
+    edge = T0 + 60 * 60
+    # t + 60 is inside the window, t - 61 is not; the earlier sample in the window wins
+    assert df.loc[edge, "Casing Pressure (PSI).csv"] == value[edge + 60]
+    assert df.loc[T0 + 60 * 90, "Casing Pressure (PSI).csv"] == value[T0 + 60 * 90 - 60]
+    assert np.isnan(df.loc[T0 + 60 * 80, "Casing Pressure (PSI).csv"])
+    # dense samples every 10 s: the first one at or after t - 60
+    tubing = dict((t, v) for t, v in files["Tubing Pressure (PSI).csv"])
+    assert df.loc[edge, "Tubing Pressure (PSI).csv"] == tubing[edge - 60]
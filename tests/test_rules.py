@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.database import Database
+from src.rules import FEATURE_COLUMNS, RULES, Rule, order_rules, rule, run_rules
+
+
+def _cycles(rows):
+    # features of a few cycles; columns not given are 0
+    return pd.DataFrame([{column: row.get(column, 0) for column in FEATURE_COLUMNS} for row in rows])
+
+
+def test_unknown_inputs_fail_at_registration():
+    with pytest.raises(ValueError, match="delta_tp"):
+        @rule('misspelt_event', 'BASIC_PRESSURE_EVENTS', inputs=('delta_pt', 'delta_tp'))
+        def misspelt(cycles, deps, params):
+            return None, {'delta_pt': cycles['delta_tp']}
+    with pytest.raises(ValueError, match="gas_volume_m3"):
+        Rule('misspelt_event', 'GAS_VOLUME_PRODUCED_EVENTS', lambda cycles, deps, params: (None, {}),
+             inputs=('gas_volume_m3',))
+    assert not any(r.name == 'misspelt_event' for r in RULES)
+
+
+def test_dependencies_run_first():
+    def noop(cycles, deps, params):
+        return None, {}
+    rules = [Rule('c', 'T', noop, depends=('b',)), Rule('a', 'T', noop), Rule('b', 'T', noop, optional=('a',))]
+    assert [r.name for r in order_rules(rules)] == ['a', 'b', 'c']
+    with pytest.raises(ValueError, match="unknown rule"):
+        order_rules([Rule('a', 'T', noop, depends=('missing',))])
+    with pytest.raises(ValueError, match="Circular"):
+        order_rules([Rule('a', 'T', noop, depends=('b',)), Rule('b', 'T', noop, depends=('a',))])
+
+
+def test_run_rules_fires_per_cycle_with_well_thresholds():
+    database = Database()
+    cycles = _cycles([
+        {'well_id': 1, 'cycle_id': 0, 'gas_volume': 5.0, 'total_duration': 900},
+        {'well_id': 1, 'cycle_id': 1, 'gas_volume': 50.0, 'total_duration': 900},
+        {'well_id': 2, 'cycle_id': 0, 'gas_volume': 15.0, 'total_duration': 900},
+    ])
+    with database.batch():
+        results = run_rules(RULES, cycles, {2: {'min_gas_volume': 20.0}}, database)
+    low_flow = results['unexpected_low_flow']
+    assert low_flow.fired.tolist() == [True, False, True]
+    # its rows link the gas volume events of the same cycles
+    linked = database.connection.execute(
+        "SELECT gas_volume_produced_event FROM UNEXPECTED_LOW_FLOW_EVENTS ORDER BY _id").fetchall()
+    assert [row[0] for row in linked] == results['gas_volume_produced_event'].ids[[0, 2]].tolist()
+    assert np.all(results['cycle_duration_event'].ids > 0)
+
+
+def test_missing_features_do_not_fire():
+    # the second cycle's well has no Arrival Speed or Line Pressure PID, the third missed a sample
+    database = Database()
+    nan = float('nan')
+    cycles = _cycles([
+        {'well_id': 1, 'cycle_id': 0, 'mean_arrival_speed': 3.0, 'delta_cp': -10.0, 'max_non_arrival_count': 0,
+         'min_arrival_time_remaining': 10, 'gas_volume': 50.0},
+        {'well_id': 2, 'cycle_id': 0, 'mean_arrival_speed': nan, 'delta_pl': nan, 'delta_cp': -10.0,
+         'max_non_arrival_count': 0, 'min_arrival_time_remaining': nan, 'gas_volume': 50.0},
+        {'well_id': 1, 'cycle_id': 1, 'mean_arrival_speed': 1.0, 'delta_cp': nan, 'max_non_arrival_count': nan,
+         'min_arrival_time_remaining': 10, 'gas_volume': nan},
+    ])
+    with database.batch():
+        results = run_rules(RULES, cycles, {}, database)
+    fired = {name: result.fired.tolist() for name, result in results.items()}
+    assert fired['basic_pressure_event'] == [True, False, False]
+    assert fired['unexpected_low_casing_pressure'] == [True, False, False]
+    assert fired['plunger_arrival_velocity_event'] == [True, False, True]
+    assert fired['plunger_unsafe_velocity_event'] == [True, False, False]
+    assert fired['gas_volume_produced_event'] == [True, True, False]
+    assert fired['unexpected_low_flow'] == [False, False, False]
+    assert fired['plunger_arrival_status_event'] == [True, True, False]
+    # no countdown sample, not late
+    assert results['plunger_arrival_status_event'].values['late_arrival'][:2].tolist() == [True, False]
+    assert all(results['cycle_duration_event'].fired)
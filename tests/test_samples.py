@@ -0,0 +1,47 @@
+import csv
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from src.samples import SAMPLES_SUFFIX, SampleSink, read_samples
+
+T0 = 1751184000
+
+
+def _rows(times):
+    return [{"time": datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "val": t % 97}
+            for t in times]
+
+
+@pytest.mark.parametrize("sample_format", ["npy", "csv"])
+def test_overlapping_flushes_keep_unique_timestamps(tmp_path, sample_format):
+    sink = SampleSink(tmp_path, sample_format)
+    sink.add("W", "P", _rows(range(T0, T0 + 3600, 60)))
+    sink.flush()
+    # the next window overlaps the last one and crosses midnight
+    sink.add("W", "P", _rows(range(T0 + 1800, T0 + 86400 + 600, 60)) + [{"time": "bad", "val": 1}])
+    sink.flush()
+    if sample_format == "npy":
+        times, values = read_samples(tmp_path / "W" / f"P{SAMPLES_SUFFIX}")
+    else:
+        with open(tmp_path / "W" / "P.csv") as f:
+            rows = list(csv.reader(f))[1:]
+        times = np.array([int(datetime.strptime(t, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp())
+                          for t, _ in rows])
+        values = np.array([float(v) for _, v in rows])
+    assert times.tolist() == list(range(T0, T0 + 86400 + 600, 60))
+    assert values.tolist() == [t % 97 for t in times.tolist()]
+
+
+def test_switching_to_npy_imports_the_csv_history(tmp_path):
+    csv_sink = SampleSink(tmp_path, "csv")
+    csv_sink.add("W", "P", _rows(range(T0, T0 + 600, 60)))
+    csv_sink.flush()
+    sink = SampleSink(tmp_path)
+    sink.add("W", "P", _rows(range(T0 + 600, T0 + 1200, 60)))
+    sink.flush()
+    times, _ = read_samples(tmp_path / "W" / f"P{SAMPLES_SUFFIX}")
+    assert times.tolist() == list(range(T0, T0 + 1200, 60))
+    assert read_samples(tmp_path / "W" / f"P{SAMPLES_SUFFIX}", since=T0 + 900)[0].tolist() == \
+        list(range(T0 + 900, T0 + 1200, 60))
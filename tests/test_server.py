@@ -0,0 +1,232 @@
+import gzip
+import http.client
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.server import QueryHandler, QueryServer, normalize_query
+from src.store import ColumnStore, lttb
+
+RUNAWAY = "SELECT COUNT(*) FROM t a, t b, t c"
+SLOW = "SELECT COUNT(*) FROM t a, t b WHERE a.x + b.x > 0"  # ~0.3 s on its own
+
+
+class QuietHandler(QueryHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "events.db"
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE t (x INTEGER)")
+    connection.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(2000)])
+    connection.commit()
+    connection.close()
+    return path
+
+
+@pytest.fixture
+def serve(db_path):
+    servers = []
+
+    def start(**options):
+        options.setdefault("cache_bytes", 0)
+        server = QueryServer(("127.0.0.1", 0), db_path, handler_class=QuietHandler, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post(port, query, path="/", headers=None):
+    status, body, _ = request(port, query, path, headers)
+    return status, body
+
+
+def request(port, query, path="/", headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("POST", path, body=query, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, body, response
+
+
+def test_runaway_query_is_stopped(serve):
+    port = serve(query_timeout=1)
+    started = time.perf_counter()
+    status, body = post(port, RUNAWAY)
+    assert status == 422
+    assert time.perf_counter() - started < 5
+
+
+def test_queue_time_does_not_count_against_the_timeout(serve):
+    # one connection: the second query waits ~1 s behind the runaway one, then gets its full budget
+    port = serve(pool_size=1, query_timeout=1)
+    runaway = threading.Thread(target=post, args=(port, RUNAWAY))
+    runaway.start()
+    time.sleep(0.2)
+    status, body = post(port, SLOW)
+    runaway.join()
+    assert status == 200
+    assert json.loads(body) == [{"COUNT(*)": 3999999}]
+
+
+def test_busy_pool_gets_503(serve):
+    port = serve(pool_size=1, query_timeout=1, pool_wait=0.2)
+    runaway = threading.Thread(target=post, args=(port, RUNAWAY))
+    runaway.start()
+    time.sleep(0.1)
+    status, _ = post(port, "SELECT 1")
+    runaway.join()
+    assert status == 503
+
+
+def test_row_cap(serve):
+    port = serve(max_rows=100)
+    assert post(port, "SELECT x FROM t")[0] == 413
+    status, body = post(port, "SELECT x FROM t WHERE x < 100")
+    assert status == 200 and len(json.loads(body)) == 100
+
+
+def test_writes_are_refused(serve):
+    port = serve()
+    for query in ("SELECT * FROM t; DELETE FROM t", "SELECT load_extension('x')"):
+        assert post(port, query)[0] in (400, 403)
+    assert post(port, "SELECT x FROM t WHERE x = 1; ATTACH 'x.db' AS x")[0] in (400, 403)
+    assert json.loads(post(port, "SELECT COUNT(*) AS n FROM t")[1]) == [{"n": 2000}]
+
+
+def test_common_table_expressions(serve, db_path):
+    port = serve(query_timeout=1)
+    status, body = post(port, "WITH small AS (SELECT x FROM t WHERE x < 3) SELECT SUM(x) AS s FROM small")
+    assert status == 200 and json.loads(body) == [{"s": 3}]
+    # a runaway recursive CTE reaches the engine and is stopped by the deadline
+    assert post(port, "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+                      "SELECT COUNT(*) FROM n")[0] == 422
+    status, body = post(port, "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 5) "
+                              "SELECT i FROM n", path="/?limit=2&key=i")
+    assert status == 200 and json.loads(body) == [{"i": 1}, {"i": 2}]
+    assert post(port, "WITH d AS (SELECT 1) DELETE FROM t")[0] == 403
+    assert sqlite3.connect(db_path).execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2000
+
+
+def test_run_query_refuses_writes():
+    from src.database import Database
+    database = Database()
+    database.insertEvent({"name": "CYCLE_DURATION_EVENTS", "start_time": 0, "end_time": 60,
+                          "total_duration": 60, "flow_duration": 30, "shutin_duration": 30})
+    with pytest.raises(ValueError):
+        database.run_query("DELETE FROM CYCLE_DURATION_EVENTS")
+    with pytest.raises(sqlite3.OperationalError):
+        database.run_query("WITH d AS (SELECT 1) DELETE FROM CYCLE_DURATION_EVENTS")
+    assert database.run_query("WITH d AS (SELECT start_time FROM CYCLE_DURATION_EVENTS) "
+                              "SELECT COUNT(*) AS n FROM d") == [{"n": 1}]
+    database.insertEvent({"name": "CYCLE_DURATION_EVENTS", "start_time": 60, "end_time": 120,
+                          "total_duration": 60, "flow_duration": 30, "shutin_duration": 30})
+
+
+def test_normalize_query():
+    assert normalize_query("  SELECT  x\n FROM\tt ;  ") == "SELECT x FROM t"
+    assert normalize_query("SELECT 'a  b' ,  \"c  d\"") == "SELECT 'a  b' , \"c  d\""
+
+
+def test_keyset_pages_cover_the_result_once(serve):
+    port = serve()
+    query = "SELECT x, x * 2 AS y FROM t WHERE x % 3 = 0"
+    seen, cursor, first_cursor = [], None, None
+    while True:
+        path = "/?limit=97&key=x" + (f"&cursor={cursor}" if cursor else "")
+        status, body, response = request(port, query, path)
+        assert status == 200
+        page = json.loads(body)
+        assert len(page) <= 97
+        seen.extend(row["x"] for row in page)
+        cursor = response.getheader("X-Next-Cursor")
+        first_cursor = first_cursor or cursor
+        if cursor is None:
+            break
+    assert seen == list(range(0, 2000, 3))
+    assert post(port, query, "/?limit=10&key=nope")[0] == 400
+    # a cursor only continues the query it came from
+    assert post(port, "SELECT x FROM t", f"/?limit=10&key=x&cursor={first_cursor}")[0] == 400
+
+
+def test_cache_serves_each_encoding_as_stored(serve, monkeypatch):
+    port = serve(cache_bytes=1024 * 1024)
+    query = "SELECT x FROM t WHERE x < 500"
+    plain = post(port, query)[1]
+    status, body, response = request(port, query, headers={"Accept-Encoding": "gzip"})
+    assert response.getheader("X-Cache") == "miss" and response.getheader("Content-Encoding") == "gzip"
+    assert gzip.decompress(body) == plain
+
+    # hits are not compressed again
+    monkeypatch.setattr("src.server.gzip.compress", lambda *args: pytest.fail("compressed a cached body"))
+    for headers, expected in (({"Accept-Encoding": "gzip"}, body), ({}, plain)):
+        status, hit, response = request(port, query, headers=headers)
+        assert status == 200 and response.getheader("X-Cache") == "hit"
+        assert hit == expected
+        assert response.getheader("Content-Encoding") == headers.get("Accept-Encoding")
+
+
+@pytest.fixture
+def store_root(tmp_path):
+    # two days of 10 s flow rate samples for well 1, a sine wave with one spike
+    times = 1754006400 + np.arange(0, 2 * 86400, 10, dtype=np.int64)
+    flow = np.sin(np.arange(len(times)) / 500.0)
+    flow[10000] = 50.0
+    ColumnStore(tmp_path / "processed").write(1, pd.DataFrame(
+        {"cycle_id": np.zeros(len(times), dtype=np.int64), "isotime": times, "flow_rate": flow}))
+    return tmp_path / "processed"
+
+
+def get(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, body
+
+
+def test_timeseries_buckets(serve, store_root):
+    port = serve(store_root=store_root)
+    status, body = get(port, "/timeseries?well_id=1&column=flow_rate&points=48")
+    assert status == 200
+    series = json.loads(body)["series"]["flow_rate"]
+    assert series["width"] == 3600 and len(series["time"]) == 48
+    assert sum(series["count"]) == 2 * 8640
+    assert max(series["max"]) == 50.0
+
+
+def test_timeseries_lttb_returns_at_most_points(serve, store_root):
+    port = serve(store_root=store_root)
+    status, body = get(port, "/timeseries?well_id=1&column=flow_rate&mode=lttb&points=200")
+    assert status == 200
+    series = json.loads(body)["series"]["flow_rate"]
+    assert len(series["time"]) == 200
+    assert series["time"][0] == 1754006400 and series["time"][-1] == 1754006400 + 2 * 86400 - 10
+    assert 50.0 in series["value"]  # the spike survives
+    for points in (0, 1, 2, 10001):
+        assert get(port, f"/timeseries?well_id=1&column=flow_rate&mode=lttb&points={points}")[0] == 400
+    assert get(port, "/timeseries?well_id=1&column=nope")[0] == 400
+
+
+def test_lttb_keeps_the_ends_for_fewer_than_three_points():
+    times = np.arange(1000, dtype=np.int64)
+    values = np.arange(1000, dtype=np.float64)
+    assert lttb(times, values, 2)[0].tolist() == [0, 999]
+    assert lttb(times, values, 1)[0].tolist() == [0]
+    assert len(lttb(times, values, 3)[0]) == 3
@@ -0,0 +1,83 @@
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench.synth import generate
+from src.data import DataLoader
+from src.database import Database
+from src.events_generator import EventsGenerator
+from src.streaming import StreamingDetector
+
+# every CYCLE_SUMMARY column but the ids, which depend on the order rows were written in
+SUMMARY = "SELECT well_id, start_time, end_time, total_duration, flow_duration, shutin_duration, " \
+          "pt_first, pt_last, cp_first, cp_last, pl_first, pl_last, delta_pt, delta_cp, delta_pl, " \
+          "gas_volume, arrival_speed, non_arrival, late_arrival, low_casing_pressure, unsafe_velocity, " \
+          "low_flow, low_cycle_duration, high_cycle_duration FROM CYCLE_SUMMARY ORDER BY well_id, start_time"
+
+
+@pytest.fixture(scope="module")
+def synthetic(tmp_path_factory):
+    # half a day of 5 s samples for one well, as (root, [(pid csv name, times, values)])
+    root = tmp_path_factory.mktemp("well")
+    generate(root, wells=1, days=0.5, step=5, seed=11)
+    samples = []
+    for csv in sorted((root / "data" / "Synthetic 1H").glob("*.csv")):
+        frame = pd.read_csv(csv)
+        times = pd.to_datetime(frame["timestamp"], utc=True).dt.tz_localize(None)
+        samples.append((csv.name, times.to_numpy(dtype="datetime64[s]").astype(np.int64),
+                        frame["val"].to_numpy(dtype=np.float64)))
+    return root, samples
+
+
+def _configure(source, root, min_shutin_seconds):
+    # a fresh copy of the generated well, so no run sees another's store or watermarks
+    shutil.copytree(source, root)
+    config_file = root / "config" / "wells-config.json"
+    config = json.loads(config_file.read_text())
+    config["wells"][0]["cycle_min_shutin_seconds"] = min_shutin_seconds
+    config_file.write_text(json.dumps(config))
+    return config_file
+
+
+def _batch(root, config_file, db_path):
+    database = Database(db_path)
+    loader = DataLoader(root / "data", config_file=config_file, max_workers=1)
+    EventsGenerator(loader, database).generate_events()
+    return database.connection.execute(SUMMARY).fetchall()
+
+
+def _single_samples(detector, samples):
+    # every sample on its own, all PIDs interleaved in time order
+    pushes = sorted((int(t), name, value) for name, times, values in samples for t, value in zip(times, values))
+    for t, name, value in pushes:
+        detector.push(1, name, t, value)
+
+
+def _micro_batches(detector, samples, seconds=60):
+    # every PID's samples of each minute at once
+    first = min(times[0] for _, times, _ in samples)
+    last = max(times[-1] for _, times, _ in samples)
+    for start in range(int(first), int(last) + 1, seconds):
+        for name, times, values in samples:
+            lo, hi = np.searchsorted(times, [start, start + seconds])
+            if hi > lo:
+                detector.push_many(1, name, times[lo:hi], values[lo:hi])
+
+
+@pytest.mark.parametrize("min_shutin_seconds", [0, 1500])
+@pytest.mark.parametrize("push", [_single_samples, _micro_batches])
+def test_streaming_matches_batch(synthetic, tmp_path, push, min_shutin_seconds):
+    source, samples = synthetic
+    root = tmp_path / "well"
+    config_file = _configure(source, root, min_shutin_seconds)
+    expected = _batch(root, config_file, tmp_path / "batch")
+    assert len(expected) >= 3
+
+    database = Database(tmp_path / "stream")
+    push(StreamingDetector(database, config_file=config_file), samples)
+    streamed = database.connection.execute(SUMMARY).fetchall()
+    # the batch run holds back the cycles still waiting for PID samples, streaming may not
+    assert streamed[:len(expected)] == expected